@@ -3,6 +3,23 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     DATABASE_URL: str = "sqlite:///./edu_platform.db"
+    # Connection pool (pre-ping and recycle apply to server databases only)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT_SECONDS: float = 30
+    DB_POOL_RECYCLE_SECONDS: int = 1800  # reconnect before the server/proxy drops idle connections
+    DB_POOL_PRE_PING: bool = True
+    # Read replicas (comma-separated URLs) for read-only handlers; empty = primary only
+    DATABASE_REPLICA_URLS: str = ""
+    DB_REPLICA_STICKY_SECONDS: float = 5  # a user's reads stay on the primary this long after a write
+    SQLITE_REPLICA_SYNC_SECONDS: float = 0  # local testing: copy a SQLite primary to SQLite replicas (0 = off)
+    # SQLite production mode: WAL + pragmas on every connection, writes queued FIFO.
+    # Off by default; opt in with SQLITE_PRODUCTION_MODE=true in the environment or .env
+    SQLITE_PRODUCTION_MODE: bool = False
+    SQLITE_SINGLE_WRITER: bool = True
+    SQLITE_BUSY_TIMEOUT_MS: int = 10000
+    SQLITE_CACHE_SIZE_KB: int = 16384  # page cache per connection
+    SQLITE_MMAP_SIZE_MB: int = 256
 
     SECRET_KEY: str = "super-secret-key-change-in-production-abc123"
     ALGORITHM: str = "HS256"
@@ -10,6 +27,49 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str = ""  # Set in .env file
     CORS_ORIGINS: str = "http://localhost:5173,http://localhost:5174,http://localhost:3000,http://127.0.0.1:5173,http://127.0.0.1:5174"
 
+    # Code sandbox: warm worker processes (0 = spawn a fresh python3 per run)
+    SANDBOX_POOL_SIZE: int = 4
+    SANDBOX_WORKER_MAX_JOBS: int = 200  # recycle a worker after this many runs
+    # Default per-run limits; a CodeTask can override each of them
+    SANDBOX_TIME_LIMIT_SECONDS: float = 5
+    SANDBOX_MEMORY_LIMIT_MB: int = 256
+    SANDBOX_OUTPUT_LIMIT_KB: int = 1024
+    # Admission control for /code/run and submissions
+    EXEC_MAX_CONCURRENT: int = 8
+    EXEC_MAX_QUEUE: int = 32  # waiting requests beyond this get 429
+    EXEC_MAX_PER_USER: int = 2
+    EXEC_QUEUE_TIMEOUT_SECONDS: float = 15
+    GRADING_PARALLEL: bool = True  # run the cases of one submission concurrently
+    GRADING_MAX_PARALLEL_CASES: int = 4
+    GRADING_CACHE_MAX_ENTRIES: int = 5000  # LRU of sandbox outcomes (0 = disabled)
+    SUBMISSION_WORKERS: int = 2  # background threads grading queued submissions
+    SUBMISSION_JOB_STALE_SECONDS: int = 300  # running jobs without progress for this long are requeued at startup
+    # Regrading stored attempts after a teacher edits a task or test
+    REGRADE_WORKERS: int = 1
+    REGRADE_CHUNK_SIZE: int = 200  # attempts per transaction; progress is saved after each
+    REGRADE_PARALLEL_ATTEMPTS: int = 2  # distinct submissions graded at once per job
+    REGRADE_JOB_STALE_SECONDS: int = 120  # running jobs without progress for this long are resumed
+    # Test-case payloads larger than this live in content-addressed files
+    TESTCASE_INLINE_MAX_BYTES: int = 4096
+    TESTCASE_BLOB_DIR: str = ""  # default: backend/data/testcases
+    # Performance tasks: inputs come from a teacher-written generator
+    PERF_GENERATED_CASES: int = 3
+    PERF_GENERATOR_TIMEOUT_SECONDS: float = 10
+    PERF_INPUT_MAX_KB: int = 8192
+    # Copy detection: estimated Jaccard similarity that flags two submissions
+    SIMILARITY_THRESHOLD: float = 0.8
+    SIMILARITY_MAX_BUCKET_USERS: int = 50  # larger LSH buckets are a common solution
+    # Student curriculum page: module/lesson tree per grade, shared by all students
+    CURRICULUM_CACHE_SECONDS: float = 300
+    # Per-request query counting (X-DB-Queries / X-DB-Time-Ms headers, /metrics)
+    QUERY_STATS_ENABLED: bool = True
+    QUERY_REPEAT_THRESHOLD: int = 10  # same statement this often in one request = likely N+1
+    QUERY_STRICT: bool = False  # tests: raise NPlusOneError instead of logging a warning
+    # Messenger WebSocket: the server pings idle sockets; a client silent this long is dropped
+    WS_HEARTBEAT_SECONDS: float = 25
+    WS_IDLE_TIMEOUT_SECONDS: float = 60
+    WS_OUTBOX_SIZE: int = 256  # events queued for a slow client before it is disconnected
+
     class Config:
         env_file = ".env"
 
@@ -1,23 +1,245 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+import itertools
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql.dml import UpdateBase
 
 from app.config import settings
+from app.utils import query_stats, sqlite_mode
+from app.utils.pool_metrics import InstrumentedQueuePool
+
+
+def _normalize_url(url: str) -> str:
+    # Render provides postgres:// but SQLAlchemy needs postgresql://
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[10:]
+    return url
+
+
+def _pool_args_for(url: str) -> dict:
+    if ":memory:" in url:
+        return {}
+    args = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT_SECONDS,
+    }
+    if not url.startswith("sqlite"):
+        args["pool_pre_ping"] = settings.DB_POOL_PRE_PING
+        args["pool_recycle"] = settings.DB_POOL_RECYCLE_SECONDS
+    return args
+
+
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def _async_url_for(url: str):
+    parsed = make_url(url)
+    return parsed.set(drivername=_ASYNC_DRIVERS.get(parsed.get_backend_name(), parsed.drivername))
+
+
+def _async_pool_args(pool_args: dict) -> dict:
+    return dict(pool_args, poolclass=AsyncAdaptedQueuePool) if pool_args else {}
+
+
+class RoutingSession(Session):
+    """Session that runs its reads on info["replica"] when a read dependency set one.
+
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = self.info.get("replica")
+        if replica is not None and not self._flushing and not isinstance(clause, UpdateBase):
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
 
-# Render provides postgres:// but SQLAlchemy needs postgresql://
-_db_url = settings.DATABASE_URL
-if _db_url.startswith("postgres://"):
-    _db_url = "postgresql://" + _db_url[10:]
+_db_url = _normalize_url(settings.DATABASE_URL)
 
 _connect_args = {}
+_sqlite_production = False
 if _db_url.startswith("sqlite"):
     _connect_args = {"check_same_thread": False}
+    # In-memory databases are per connection; WAL and the writer queue don't apply
+    _sqlite_production = settings.SQLITE_PRODUCTION_MODE and ":memory:" not in _db_url
+    if _sqlite_production:
+        _connect_args.update(sqlite_mode.connect_args())
+
+_pool_args = _pool_args_for(_db_url)
 
 engine = create_engine(
     _db_url,
     connect_args=_connect_args,
     echo=False,
+    **_pool_args,
+)
+if _sqlite_production:
+    sqlite_mode.configure(engine)
+query_stats.instrument(engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=RoutingSession)
+
+
+# Async engine on the same database, for handlers that await I/O (AI chat, read-heavy lists).
+# SQLite writes from it don't take the writer queue (its lock would block the event
+# loop); they wait in SQLite's busy handler, on aiosqlite's thread.
+_async_connect_args = {}
+if _sqlite_production:
+    _async_connect_args = {"timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000}
+
+async_engine = create_async_engine(
+    _async_url_for(_db_url),
+    connect_args=_async_connect_args,
+    echo=False,
+    **_async_pool_args(_pool_args),
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if _sqlite_production:
+    sqlite_mode.configure_async(async_engine)
+query_stats.instrument(async_engine.sync_engine)
+# Objects stay usable after commit: attributes can't be lazily reloaded outside an await
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, sync_session_class=RoutingSession,
+                                       autoflush=False, expire_on_commit=False)
+
+
+# ── Read replicas ──────────────────────────────────────
+# Read-only handlers (get_read_db / get_async_read_db in app.utils.auth) query a
+# replica, round robin. After a user commits a write, their read sessions stay on
+# the primary for DB_REPLICA_STICKY_SECONDS so they see their own changes despite
+# replication lag. The window is tracked per API process.
+
+replica_urls = [_normalize_url(u.strip()) for u in settings.DATABASE_REPLICA_URLS.split(",") if u.strip()]
+
+
+def _replica_engines(url: str) -> tuple:
+    """Sync and async engine for one replica; no writer queue, nothing writes there."""
+    connect_args = {}
+    if url.startswith("sqlite"):
+        connect_args = {"timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000}
+    pool_args = _pool_args_for(url)
+    sync = create_engine(url, connect_args=dict(connect_args, check_same_thread=False) if connect_args else {},
+                         echo=False, **pool_args)
+    async_ = create_async_engine(_async_url_for(url), connect_args=connect_args, echo=False,
+                                 **_async_pool_args(pool_args))
+    query_stats.instrument(sync)
+    query_stats.instrument(async_.sync_engine)
+    return sync, async_
+
+
+replica_engines = [_replica_engines(url) for url in replica_urls]
+_next_replica = itertools.count()
+
+
+class _RecentWriters:
+    """user id -> end of the read-your-writes window that started at their last write."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._until = {}
+        self.replica_sessions = 0
+        self.sticky_sessions = 0
+
+    def mark(self, user_id: int):
+        now = time.monotonic()
+        with self._lock:
+            self._until[user_id] = now + settings.DB_REPLICA_STICKY_SECONDS
+            if len(self._until) > 10000:
+                self._until = {u: t for u, t in self._until.items() if t > now}
+
+    def use_replica(self, user_id: int | None) -> bool:
+        with self._lock:
+            if user_id is not None and self._until.get(user_id, 0) > time.monotonic():
+                self.sticky_sessions += 1
+                return False
+            self.replica_sessions += 1
+            return True
+
+
+recent_writers = _RecentWriters()
+
+
+def _pick_replica(user_id: int | None, use_async: bool):
+    if not replica_engines or not recent_writers.use_replica(user_id):
+        return None
+    sync, async_ = replica_engines[next(_next_replica) % len(replica_engines)]
+    return async_.sync_engine if use_async else sync
+
+
+def read_session(user_id: int | None) -> Session:
+    db = SessionLocal()
+    db.info["user_id"] = user_id
+    db.info["replica"] = _pick_replica(user_id, use_async=False)
+    return db
+
+
+def async_read_session(user_id: int | None) -> AsyncSession:
+    db = AsyncSessionLocal()
+    db.info["user_id"] = user_id
+    db.info["replica"] = _pick_replica(user_id, use_async=True)
+    return db
+
+
+def _flushed(session, flush_context):
+    session.info["wrote"] = True
+
+
+def _orm_execute(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info["wrote"] = True
+
+
+def _committed(session):
+    # user_id is set by the auth dependencies on the request's session
+    if session.info.pop("wrote", False) and session.info.get("user_id") is not None:
+        recent_writers.mark(session.info["user_id"])
+
+
+def _rolled_back(session):
+    session.info.pop("wrote", None)
+
+
+if replica_engines:
+    event.listen(RoutingSession, "after_flush", _flushed)
+    event.listen(RoutingSession, "do_orm_execute", _orm_execute)
+    event.listen(RoutingSession, "after_commit", _committed)
+    event.listen(RoutingSession, "after_rollback", _rolled_back)
+
+
+def pool_stats() -> dict | None:
+    return engine.pool.stats() if isinstance(engine.pool, InstrumentedQueuePool) else None
+
+
+def async_pool_stats() -> dict | None:
+    pool = async_engine.pool
+    if not isinstance(pool, AsyncAdaptedQueuePool):
+        return None
+    return {"pool_size": pool.size(), "in_use": pool.checkedout(), "idle": pool.checkedin(),
+            "overflow": max(0, pool.overflow())}
+
+
+def replica_stats() -> dict | None:
+    if not replica_engines:
+        return None
+    with recent_writers._lock:
+        routed = {"replica_sessions": recent_writers.replica_sessions,
+                  "sticky_sessions": recent_writers.sticky_sessions}
+    return {
+        "replicas": len(replica_engines),
+        **routed,
+        "pools": [e.pool.stats() if isinstance(e.pool, InstrumentedQueuePool) else None
+                  for e, _ in replica_engines],
+    }
+
+
+async def dispose_async_engines():
+    await async_engine.dispose()
+    for _, async_ in replica_engines:
+        await async_.dispose()
 
 
 class Base(DeclarativeBase):
@@ -30,3 +252,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -6,42 +6,15 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 
-from sqlalchemy import text
-
 from app.config import settings
-from app.database import engine, Base
+from app import migrations
+from app.database import engine, SessionLocal, dispose_async_engines
 from app.routers import auth, student, teacher
+from app.utils import query_stats, sandbox, submission_queue, regrade, similarity, sqlite_replica, testcases
 
 
-def run_migrations():
-    """Add new columns to existing tables without data loss (SQLite + PostgreSQL safe)."""
-    migrations = [
-        ("users", "max_unlocked_grade", "INTEGER DEFAULT 6"),
-        ("lessons", "grade", "INTEGER DEFAULT 6"),
-        ("lessons", "topic_id", "INTEGER"),
-        ("tests", "grade", "INTEGER DEFAULT 6"),
-        ("tests", "topic_id", "INTEGER"),
-        ("code_tasks", "grade", "INTEGER DEFAULT 6"),
-        ("code_tasks", "topic_id", "INTEGER"),
-        ("direct_messages", "message_type", "VARCHAR(20) DEFAULT 'text'"),
-        ("direct_messages", "file_url", "VARCHAR(500)"),
-        ("group_messages", "message_type", "VARCHAR(20) DEFAULT 'text'"),
-        ("group_messages", "file_url", "VARCHAR(500)"),
-        ("code_attempts", "error_type", "VARCHAR(20)"),
-    ]
-    for table, col, definition in migrations:
-        # Each migration gets its own connection so a failure doesn't abort the rest
-        try:
-            with engine.connect() as conn:
-                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {col} {definition}"))
-                conn.commit()
-        except Exception:
-            pass  # column already exists or table not yet created (create_all handles it)
-
-
-# Run migrations then create any new tables
-run_migrations()
-Base.metadata.create_all(bind=engine)
+# Bring the schema up to date (versioned, one worker at a time)
+migrations.migrate(engine)
 
 BACKEND_DIR = Path(__file__).resolve().parent.parent
 STATIC_DIR = BACKEND_DIR / "static"
@@ -59,7 +32,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-DB-Queries", "X-DB-Time-Ms"],
 )
+app.add_middleware(query_stats.QueryStatsMiddleware)
 
 app.include_router(auth.router)
 app.include_router(student.router)
@@ -86,6 +61,39 @@ def seed_if_empty():
         db.close()
 
 
+@app.on_event("startup")
+def externalize_test_cases():
+    """Move large inline test-case payloads of existing tasks into blob files."""
+    db = SessionLocal()
+    try:
+        testcases.migrate_inline_cases(db)
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def start_background_workers():
+    """Pre-start sandbox workers and the queue workers; index old attempts for copy detection."""
+    sqlite_replica.start()
+    sandbox.start_pool()
+    submission_queue.start_workers()
+    regrade.start_workers()
+    similarity.start_backfill()
+
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    regrade.stop_workers()
+    submission_queue.stop_workers()
+    sandbox.shutdown_pool()
+    sqlite_replica.stop()
+
+
+@app.on_event("shutdown")
+async def close_async_engines():
+    await dispose_async_engines()
+
+
 @app.get("/api/health")
 def health():
     return {"status": "ok"}
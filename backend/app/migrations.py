@@ -0,0 +1,294 @@
+"""Versioned schema migrations.
+
+Each step has a version number and runs once; applied versions are recorded in
+schema_version. Steps are idempotent (they check the live schema first), so a
+database created by create_all, or one that ran the old ALTER list, converges
+to the same state. A lock keeps several API workers from migrating at once:
+pg_advisory_lock on PostgreSQL, an flock'ed file next to the SQLite database.
+
+Steps run in a transaction, except ones marked transactional=False, which run
+on an autocommit connection. Those are for PostgreSQL statements that cannot
+run inside a transaction and must not block writes, i.e. CREATE INDEX
+CONCURRENTLY; see create_index().
+
+To add a migration, append a step with the next version number.
+"""
+
+import contextlib
+import datetime
+from typing import Callable, NamedTuple
+
+from sqlalchemy import (
+    Column, DateTime, Integer, MetaData, String, Table, case, func, insert, inspect, select, text, update,
+)
+from sqlalchemy.engine import Connection, Engine
+
+from app.database import Base
+from app.models import models  # noqa: F401  (registers every table on Base)
+
+_LOCK_KEY = 0x6D696772  # pg_advisory_lock key shared by every worker of this app
+
+_meta = MetaData()
+schema_version = Table(
+    "schema_version", _meta,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    up: Callable[[Connection], None]
+    transactional: bool = True
+
+
+# ── Helpers for steps ──────────────────────────────────
+
+def has_column(conn: Connection, table: str, column: str) -> bool:
+    insp = inspect(conn)
+    return insp.has_table(table) and column in {c["name"] for c in insp.get_columns(table)}
+
+
+def add_column(conn: Connection, table: str, column: str, definition: str):
+    if inspect(conn).has_table(table) and not has_column(conn, table, column):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+
+
+def create_table(conn: Connection, table: Table):
+    table.create(conn, checkfirst=True)
+
+
+def create_index(conn: Connection, name: str, table: str, columns: list, unique: bool = False):
+    """Create an index if missing; on PostgreSQL without locking out writes.
+
+    Use it from a transactional=False step: CONCURRENTLY cannot run inside a
+    transaction. A CONCURRENTLY build that failed leaves an INVALID index
+    behind, which is dropped and rebuilt.
+    """
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    quote = conn.dialect.identifier_preparer.quote
+    cols = ", ".join(quote(c) for c in columns)
+    if conn.dialect.name == "postgresql":
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {"name": name}).first()
+        if invalid:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        conn.execute(text(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} ON {table} ({cols})"))
+    else:
+        conn.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({cols})"))
+
+
+def create_model_indexes(conn: Connection, names: list):
+    """create_index() for indexes declared in the models' __table_args__, by name."""
+    declared = {ix.name: ix for table in Base.metadata.tables.values() for ix in table.indexes}
+    for name in names:
+        ix = declared[name]
+        create_index(conn, name, ix.table.name, [c.name for c in ix.columns], unique=ix.unique)
+
+
+def drop_index(conn: Connection, name: str):
+    """Drop an index if present; CONCURRENTLY on PostgreSQL, so use it from a transactional=False step."""
+    concurrently = " CONCURRENTLY" if conn.dialect.name == "postgresql" else ""
+    conn.execute(text(f"DROP INDEX{concurrently} IF EXISTS {name}"))
+
+
+# ── Steps ──────────────────────────────────────────────
+
+def _create_missing_tables(conn: Connection):
+    Base.metadata.create_all(bind=conn)
+
+
+# Columns added to existing tables before migrations were versioned
+_LEGACY_COLUMNS = [
+    ("users", "max_unlocked_grade", "INTEGER DEFAULT 6"),
+    ("lessons", "grade", "INTEGER DEFAULT 6"),
+    ("lessons", "topic_id", "INTEGER"),
+    ("tests", "grade", "INTEGER DEFAULT 6"),
+    ("tests", "topic_id", "INTEGER"),
+    ("code_tasks", "grade", "INTEGER DEFAULT 6"),
+    ("code_tasks", "topic_id", "INTEGER"),
+    ("direct_messages", "message_type", "VARCHAR(20) DEFAULT 'text'"),
+    ("direct_messages", "file_url", "VARCHAR(500)"),
+    ("group_messages", "message_type", "VARCHAR(20) DEFAULT 'text'"),
+    ("group_messages", "file_url", "VARCHAR(500)"),
+    ("code_attempts", "error_type", "VARCHAR(20)"),
+    ("code_tasks", "time_limit_seconds", "FLOAT"),
+    ("code_tasks", "memory_limit_mb", "INTEGER"),
+    ("code_tasks", "output_limit_kb", "INTEGER"),
+    ("code_tasks", "mode", "VARCHAR(20) DEFAULT 'output'"),
+    ("code_tasks", "input_generator", "TEXT"),
+    ("code_tasks", "reference_solution", "TEXT"),
+    ("code_tasks", "generated_case_count", "INTEGER"),
+    ("code_tasks", "generated_cases", "JSON"),
+    ("code_tasks", "case_count", "INTEGER"),
+]
+
+
+def _legacy_columns(conn: Connection):
+    for table, column, definition in _LEGACY_COLUMNS:
+        add_column(conn, table, column, definition)
+
+
+# Per-user lookups of the student endpoints (progress, attempts, chat, messages)
+_HOT_LOOKUP_INDEXES = [
+    "ix_users_grade_role",
+    "ix_lessons_module_order",
+    "ix_lesson_progress_user_lesson",
+    "ix_questions_test_order",
+    "ix_test_attempts_user_test_completed",
+    "ix_test_attempts_test",
+    "ix_code_attempts_user_task_score",
+    "ix_code_attempts_task",
+    "ix_user_badges_user",
+    "ix_chat_messages_user_created",
+    "ix_feedback_student_created",
+    "ix_direct_messages_pair_created",
+    "ix_group_messages_grade_created",
+]
+
+
+def _hot_lookup_indexes(conn: Connection):
+    create_model_indexes(conn, _HOT_LOOKUP_INDEXES)
+
+
+def _drop_receiver_read_index(conn: Connection):
+    """Unread state lives in the read watermarks; direct_messages.is_read is no longer written."""
+    drop_index(conn, "ix_direct_messages_receiver_read")
+
+
+def _conversation_summaries(conn: Connection):
+    """Create conversation_summaries and fill it from the existing direct messages."""
+    summaries = models.ConversationSummary.__table__
+    create_table(conn, summaries)
+    if conn.execute(select(summaries.c.id).limit(1)).first():
+        return
+    dm = models.DirectMessage.__table__
+    user_a = case((dm.c.sender_id <= dm.c.receiver_id, dm.c.sender_id), else_=dm.c.receiver_id)
+    user_b = case((dm.c.sender_id <= dm.c.receiver_id, dm.c.receiver_id), else_=dm.c.sender_id)
+    unread = dm.c.is_read.isnot(True)
+
+    def unread_for(reader):
+        return func.sum(case((unread & (dm.c.receiver_id == reader), 1), else_=0)).over(partition_by=(user_a, user_b))
+
+    ranked = select(
+        user_a.label("user_a"), user_b.label("user_b"), dm.c.id, dm.c.sender_id,
+        func.substr(dm.c.content, 1, 50).label("preview"),
+        func.coalesce(dm.c.message_type, "text").label("message_type"), dm.c.created_at,
+        unread_for(user_a).label("unread_a"), unread_for(user_b).label("unread_b"),
+        func.row_number().over(partition_by=(user_a, user_b),
+                               order_by=(dm.c.created_at.desc(), dm.c.id.desc())).label("rn"),
+    ).subquery()
+    conn.execute(insert(summaries).from_select(
+        ["user_a", "user_b", "last_message_id", "last_sender_id", "last_preview", "last_message_type",
+         "last_at", "unread_a", "unread_b"],
+        select(ranked.c.user_a, ranked.c.user_b, ranked.c.id, ranked.c.sender_id,
+               func.nullif(ranked.c.preview, ""), ranked.c.message_type, ranked.c.created_at,
+               ranked.c.unread_a, ranked.c.unread_b).where(ranked.c.rn == 1),
+    ))
+
+
+def _read_watermarks(conn: Connection):
+    """Per-side read watermarks on conversation_summaries, derived from the old is_read flags."""
+    add_column(conn, "conversation_summaries", "read_a", "INTEGER")
+    add_column(conn, "conversation_summaries", "read_b", "INTEGER")
+    summaries = models.ConversationSummary.__table__
+    dm = models.DirectMessage.__table__
+    for reader, other, read, unread in ((summaries.c.user_a, summaries.c.user_b, "read_a", summaries.c.unread_a),
+                                        (summaries.c.user_b, summaries.c.user_a, "read_b", summaries.c.unread_b)):
+        last_read = select(func.max(dm.c.id)).where(
+            dm.c.sender_id == other, dm.c.receiver_id == reader, dm.c.is_read == True
+        ).scalar_subquery()
+        conn.execute(update(summaries).where(summaries.c[read].is_(None)).values(
+            {read: case((unread == 0, summaries.c.last_message_id), else_=last_read)}
+        ))
+
+
+def _submission_job_heartbeat(conn: Connection):
+    """Worker heartbeat on submission_jobs, so only abandoned jobs are requeued."""
+    add_column(conn, "submission_jobs", "updated_at", "TIMESTAMP")
+
+
+MIGRATIONS = [
+    # Tables of models that don't exist yet; later tables get their own steps
+    Migration(1, "create missing tables", _create_missing_tables),
+    Migration(2, "columns from the unversioned ALTER list", _legacy_columns),
+    Migration(3, "composite indexes for per-user lookups", _hot_lookup_indexes, transactional=False),
+    Migration(4, "conversation summaries for the messenger contact lists", _conversation_summaries),
+    Migration(5, "read watermarks instead of per-message read flags", _read_watermarks),
+    Migration(6, "heartbeat for submission jobs", _submission_job_heartbeat),
+    Migration(7, "drop the unused direct message read-flag index", _drop_receiver_read_index, transactional=False),
+]
+
+
+# ── Runner ─────────────────────────────────────────────
+
+@contextlib.contextmanager
+def _migration_lock(engine: Engine):
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": _LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _LOCK_KEY})
+        return
+
+    database = engine.url.database
+    if engine.dialect.name != "sqlite" or not database or database == ":memory:":
+        yield
+        return
+    try:
+        import fcntl
+    except ImportError:  # Windows: single dev process, nothing to coordinate
+        yield
+        return
+    with open(f"{database}.migrate-lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _applied(engine: Engine, create: bool = False) -> set:
+    with engine.begin() as conn:
+        if create:
+            schema_version.create(conn, checkfirst=True)
+        elif not inspect(conn).has_table(schema_version.name):
+            return set()
+        return set(conn.execute(select(schema_version.c.version)).scalars())
+
+
+def _record(conn: Connection, step: Migration):
+    conn.execute(schema_version.insert().values(
+        version=step.version, name=step.name, applied_at=datetime.datetime.utcnow(),
+    ))
+
+
+def pending(engine: Engine, create: bool = False) -> list:
+    applied = _applied(engine, create)
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def migrate(engine: Engine) -> list:
+    """Apply pending migrations in version order. Returns the versions applied."""
+    if not pending(engine):
+        return []
+    done = []
+    with _migration_lock(engine):
+        # Another worker may have migrated while we waited for the lock
+        for step in pending(engine, create=True):
+            if step.transactional:
+                with engine.begin() as conn:
+                    step.up(conn)
+                    _record(conn, step)
+            else:
+                with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                    step.up(conn)
+                    _record(conn, step)
+            done.append(step.version)
+    return done
@@ -1,8 +1,9 @@
 import datetime
 from sqlalchemy import (
-    Column, Integer, String, Text, Float, Boolean, DateTime, ForeignKey, Enum, JSON
+    Column, Integer, String, Text, Float, Boolean, DateTime, ForeignKey, Enum, JSON,
+    BigInteger, Index, UniqueConstraint,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from app.database import Base
 import enum
 
@@ -29,6 +30,9 @@ class QuestionType(str, enum.Enum):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_grade_role", "grade", "role"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, nullable=False, index=True)
@@ -96,6 +100,9 @@ class Module(Base):
 
 class Lesson(Base):
     __tablename__ = "lessons"
+    __table_args__ = (
+        Index("ix_lessons_module_order", "module_id", "order"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     module_id = Column(Integer, ForeignKey("modules.id", ondelete="CASCADE"), nullable=False)
@@ -115,6 +122,9 @@ class Lesson(Base):
 
 class LessonProgress(Base):
     __tablename__ = "lesson_progress"
+    __table_args__ = (
+        Index("ix_lesson_progress_user_lesson", "user_id", "lesson_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -150,6 +160,9 @@ class Test(Base):
 
 class Question(Base):
     __tablename__ = "questions"
+    __table_args__ = (
+        Index("ix_questions_test_order", "test_id", "order"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     test_id = Column(Integer, ForeignKey("tests.id", ondelete="CASCADE"), nullable=False)
@@ -165,6 +178,10 @@ class Question(Base):
 
 class TestAttempt(Base):
     __tablename__ = "test_attempts"
+    __table_args__ = (
+        Index("ix_test_attempts_user_test_completed", "user_id", "test_id", "completed_at"),
+        Index("ix_test_attempts_test", "test_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -193,7 +210,20 @@ class CodeTask(Base):
     grade = Column(Integer, default=6)
     topic_id = Column(Integer, ForeignKey("topics.id", ondelete="SET NULL"), nullable=True)
     starter_code = Column(Text, default="")
-    test_cases = Column(JSON, nullable=False)  # [{input, expected_output}, ...]
+    # [{input, expected_output}, ...]; large payloads are blob refs (see utils/testcases.py).
+    # Deferred so task listings don't load them.
+    test_cases = deferred(Column(JSON, nullable=False))
+    case_count = Column(Integer, nullable=True)  # test + generated cases
+    # Sandbox limits; NULL falls back to the SANDBOX_* defaults in settings
+    time_limit_seconds = Column(Float, nullable=True)
+    memory_limit_mb = Column(Integer, nullable=True)
+    output_limit_kb = Column(Integer, nullable=True)
+    # "performance" tasks are also judged on CPU time against generated inputs
+    mode = Column(String(20), default="output")  # output|performance
+    input_generator = Column(Text, nullable=True)  # prints one input; gets the case number on stdin
+    reference_solution = Column(Text, nullable=True)  # produces the expected output
+    generated_case_count = Column(Integer, nullable=True)
+    generated_cases = deferred(Column(JSON, nullable=True))  # built on save, same shape as test_cases
     deadline = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
@@ -202,6 +232,10 @@ class CodeTask(Base):
 
 class CodeAttempt(Base):
     __tablename__ = "code_attempts"
+    __table_args__ = (
+        Index("ix_code_attempts_user_task_score", "user_id", "task_id", "score"),
+        Index("ix_code_attempts_task", "task_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -209,7 +243,7 @@ class CodeAttempt(Base):
     code = Column(Text, nullable=False)
     score = Column(Float, default=0)
     max_score = Column(Float, default=0)
-    results = Column(JSON, nullable=True)  # per-case pass/fail
+    results = Column(JSON, nullable=True)  # per-case pass/fail + cpu/rss/wall usage
     error_type = Column(String(20), nullable=True)  # syntax|variable|loop|condition|io|logic
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
@@ -217,6 +251,125 @@ class CodeAttempt(Base):
     task = relationship("CodeTask", back_populates="attempts")
 
 
+class TaskBestRuntime(Base):
+    """Each student's fastest fully-passing run of a performance task."""
+    __tablename__ = "task_best_runtimes"
+    __table_args__ = (
+        UniqueConstraint("task_id", "user_id", name="uq_task_best_runtimes_task_user"),
+        Index("ix_task_best_runtimes_task_cpu", "task_id", "best_cpu_ms"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, ForeignKey("code_tasks.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    best_cpu_ms = Column(Float, nullable=False)  # summed over the generated cases
+    peak_rss_kb = Column(Integer, nullable=True)
+    attempt_id = Column(Integer, ForeignKey("code_attempts.id", ondelete="SET NULL"), nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    user = relationship("User")
+
+
+class CodeFingerprint(Base):
+    """MinHash signature of one distinct submission (per task, student and code)."""
+    __tablename__ = "code_fingerprints"
+    __table_args__ = (
+        UniqueConstraint("task_id", "user_id", "code_hash", name="uq_code_fingerprints_task_user_code"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, ForeignKey("code_tasks.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    attempt_id = Column(Integer, ForeignKey("code_attempts.id", ondelete="SET NULL"), nullable=True)
+    code_hash = Column(String(64), nullable=False)
+    signature = Column(JSON, nullable=False)  # MinHash values, one per permutation
+    shingle_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    user = relationship("User")
+
+
+class CodeLshBucket(Base):
+    """One LSH band of a fingerprint; submissions sharing a bucket are candidate copies."""
+    __tablename__ = "code_lsh_buckets"
+    __table_args__ = (
+        Index("ix_code_lsh_buckets_lookup", "task_id", "band", "bucket"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, ForeignKey("code_tasks.id", ondelete="CASCADE"), nullable=False)
+    band = Column(Integer, nullable=False)
+    bucket = Column(BigInteger, nullable=False)
+    fingerprint_id = Column(Integer, ForeignKey("code_fingerprints.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, nullable=False)
+
+
+class CodeSimilarPair(Base):
+    """Two students' submissions to a task that share an LSH bucket and look alike."""
+    __tablename__ = "code_similar_pairs"
+    __table_args__ = (
+        UniqueConstraint("fingerprint_a", "fingerprint_b", name="uq_code_similar_pairs_fingerprints"),
+        Index("ix_code_similar_pairs_task_similarity", "task_id", "similarity"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, ForeignKey("code_tasks.id", ondelete="CASCADE"), nullable=False)
+    fingerprint_a = Column(Integer, ForeignKey("code_fingerprints.id", ondelete="CASCADE"), nullable=False)
+    fingerprint_b = Column(Integer, ForeignKey("code_fingerprints.id", ondelete="CASCADE"), nullable=False)
+    user_a = Column(Integer, nullable=False)
+    user_b = Column(Integer, nullable=False)
+    similarity = Column(Float, nullable=False)
+
+
+class SubmissionJob(Base):
+    """Queued code submission, graded by a background worker."""
+    __tablename__ = "submission_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    task_id = Column(Integer, ForeignKey("code_tasks.id", ondelete="CASCADE"), nullable=False)
+    code = Column(Text, nullable=False)
+    fail_fast = Column(Boolean, default=False)
+    status = Column(String(10), default="queued", index=True)  # queued|running|done|failed
+    cases_total = Column(Integer, default=0)
+    cases_done = Column(Integer, default=0)
+    results = Column(JSON, nullable=True)  # per-case entries, filled in as cases finish
+    attempt_id = Column(Integer, ForeignKey("code_attempts.id", ondelete="SET NULL"), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=True)  # heartbeat of the worker grading it
+    finished_at = Column(DateTime, nullable=True)
+
+    attempt = relationship("CodeAttempt")
+
+
+class RegradeJob(Base):
+    """Re-scoring of stored attempts after a code task or test was edited.
+
+    Attempts are processed in id order up to `upto_id`; `cursor` is the last id
+    committed, so a job interrupted by a crash resumes where it stopped.
+    """
+    __tablename__ = "regrade_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(20), nullable=False)  # code_task|test
+    target_id = Column(Integer, nullable=False)
+    status = Column(String(12), default="queued", index=True)  # queued|running|done|failed|superseded
+    upto_id = Column(Integer, nullable=True)
+    cursor = Column(Integer, default=0)
+    total = Column(Integer, default=0)
+    processed = Column(Integer, default=0)
+    changed = Column(Integer, default=0)
+    points_delta = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
 # ── Badges ─────────────────────────────────────────────
 
 class Badge(Base):
@@ -233,6 +386,9 @@ class Badge(Base):
 
 class UserBadge(Base):
     __tablename__ = "user_badges"
+    __table_args__ = (
+        Index("ix_user_badges_user", "user_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -247,6 +403,9 @@ class UserBadge(Base):
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        Index("ix_chat_messages_user_created", "user_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -261,6 +420,9 @@ class ChatMessage(Base):
 
 class Feedback(Base):
     __tablename__ = "feedback"
+    __table_args__ = (
+        Index("ix_feedback_student_created", "student_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     teacher_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -276,6 +438,9 @@ class Feedback(Base):
 
 class DirectMessage(Base):
     __tablename__ = "direct_messages"
+    __table_args__ = (
+        Index("ix_direct_messages_pair_created", "sender_id", "receiver_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     sender_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -283,17 +448,47 @@ class DirectMessage(Base):
     content = Column(Text, default="")
     message_type = Column(String(20), default="text")  # text | file | voice
     file_url = Column(String(500), nullable=True)
-    is_read = Column(Boolean, default=False)
+    is_read = Column(Boolean, default=False)  # no longer written: see ConversationSummary.read_a/read_b
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     sender = relationship("User", foreign_keys=[sender_id])
     receiver = relationship("User", foreign_keys=[receiver_id])
 
 
+class ConversationSummary(Base):
+    """Last message, unread counts and read watermarks of a DM conversation, one row per user pair.
+
+    user_a is the lower user id. Kept up to date by app.utils.conversations in the
+    same transaction as the message it describes.
+    """
+    __tablename__ = "conversation_summaries"
+    __table_args__ = (
+        UniqueConstraint("user_a", "user_b", name="uq_conversation_summaries_pair"),
+        Index("ix_conversation_summaries_user_b", "user_b"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_a = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    user_b = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    last_message_id = Column(Integer, nullable=True)
+    last_sender_id = Column(Integer, nullable=True)
+    last_preview = Column(String(50), nullable=True)
+    last_message_type = Column(String(20), nullable=True)
+    last_at = Column(DateTime, nullable=True)
+    # Messages from user_b above read_a; a cache, only trusted when 0
+    unread_a = Column(Integer, default=0, nullable=False)
+    unread_b = Column(Integer, default=0, nullable=False)
+    read_a = Column(Integer, nullable=True)  # id of the last message user_a has read (watermark)
+    read_b = Column(Integer, nullable=True)
+
+
 # ── Group Messages ────────────────────────────────────
 
 class GroupMessage(Base):
     __tablename__ = "group_messages"
+    __table_args__ = (
+        Index("ix_group_messages_grade_created", "grade", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     sender_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -1,16 +1,23 @@
+import asyncio
 import datetime
+import json
 import os
 import re
+import threading
 import uuid
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, select
 
-from app.database import get_db
+from app.config import settings
+from app.database import get_db, get_async_db, SessionLocal
 from app.models.models import (
     User, Module, Lesson, LessonProgress, Test, Question,
     TestAttempt, CodeTask, CodeAttempt, ChatMessage, Feedback, UserBadge,
-    DirectMessage, GroupMessage, Topic,
+    DirectMessage, GroupMessage, Topic, SubmissionJob,
 )
 from app.schemas.schemas import (
     UserProfile, ModuleOut, LessonOut, ProgressOut, MarkCompleteRequest,
@@ -18,9 +25,19 @@ from app.schemas.schemas import (
     CodeAttemptOut, ChatSend, ChatMessageOut, FeedbackOut, BadgeOut,
     DirectMessageSend, GroupMessageSend, TopicOut,
 )
-from app.utils.auth import get_current_user, require_role
+from app.utils.auth import (
+    get_current_user, get_async_current_user, get_async_read_db, require_role, user_from_token,
+)
 from app.utils.badges import check_and_award_badges
 from app.utils.ai_helper import generate_response
+from app.utils import (
+    conversations, curriculum, message_pages, messenger_hub, perf, sandbox, submission_queue, testcases,
+)
+from app.utils.grading import (
+    grade_task, run_snippet, stream_snippet, record_code_attempt,
+    score_test, award_points, TEST_POINTS,
+)
+from app.utils.scheduler import Busy
 
 router = APIRouter(prefix="/api/student", tags=["student"])
 
@@ -31,6 +48,12 @@ def _student(user: User = Depends(get_current_user)):
     return user
 
 
+async def _async_student(user: User = Depends(get_async_current_user)):
+    if user.role != "student":
+        raise HTTPException(403, "Students only")
+    return user
+
+
 def parse_grade_num(grade_str) -> int:
     """Extract number from grade string: '10A' -> 10, '6' -> 6, None -> 6."""
     m = re.match(r'^(\d+)', str(grade_str or '6'))
@@ -97,32 +120,15 @@ def profile(user: User = Depends(_student), db: Session = Depends(get_db)):
 # ── Modules & Lessons ─────────────────────────────────
 
 @router.get("/modules")
-def list_modules(db: Session = Depends(get_db), user: User = Depends(_student)):
+async def list_modules(db: AsyncSession = Depends(get_async_read_db), user: User = Depends(_async_student)):
     student_grade = parse_grade_num(user.grade)
     max_unlocked = max(user.max_unlocked_grade or 0, student_grade)
-    modules = db.query(Module).order_by(Module.order).all()
-    result = []
-    for m in modules:
-        lessons = []
-        for l in m.lessons:
-            # Show lessons for student's grade or unlocked grades
-            lesson_grade = l.grade or 6
-            if lesson_grade > max_unlocked:
-                continue
-            prog = db.query(LessonProgress).filter(
-                LessonProgress.user_id == user.id, LessonProgress.lesson_id == l.id
-            ).first()
-            lessons.append({
-                "id": l.id, "title": l.title, "order": l.order,
-                "grade": lesson_grade, "topic_id": l.topic_id,
-                "completed": prog.completed if prog else False,
-            })
-        if lessons:  # only show modules that have accessible lessons
-            result.append({
-                "id": m.id, "title": m.title, "order": m.order,
-                "description": m.description, "lessons": lessons,
-            })
-    return result
+    tree = await curriculum.tree(max_unlocked)
+    completed = await curriculum.completed_lessons(db, user.id)
+    return [
+        dict(m, lessons=[dict(l, completed=l["id"] in completed) for l in m["lessons"]])
+        for m in tree
+    ]
 
 
 @router.get("/lessons/{lesson_id}", response_model=LessonOut)
@@ -169,23 +175,35 @@ def complete_lesson(req: MarkCompleteRequest, user: User = Depends(_student), db
 # ── Tests ──────────────────────────────────────────────
 
 @router.get("/tests")
-def list_tests(db: Session = Depends(get_db), user: User = Depends(_student)):
+async def list_tests(db: AsyncSession = Depends(get_async_read_db), user: User = Depends(_async_student)):
     student_grade = parse_grade_num(user.grade)
     max_unlocked = max(user.max_unlocked_grade or 0, student_grade)
-    tests = db.query(Test).filter(Test.grade <= max_unlocked).all()
-    result = []
-    for t in tests:
-        attempt = db.query(TestAttempt).filter(
-            TestAttempt.user_id == user.id, TestAttempt.test_id == t.id
-        ).order_by(TestAttempt.completed_at.desc()).first()
-        result.append({
-            "id": t.id, "title": t.title, "difficulty": t.difficulty,
-            "grade": t.grade, "topic_id": t.topic_id,
-            "question_count": len(t.questions),
-            "best_score": attempt.score if attempt else None,
-            "attempted": attempt is not None,
-        })
-    return result
+    # Latest attempt of this student per test, and question counts, in the same query
+    latest = select(
+        TestAttempt.test_id, TestAttempt.score,
+        func.row_number().over(partition_by=TestAttempt.test_id,
+                               order_by=(TestAttempt.completed_at.desc(), TestAttempt.id.desc())).label("rn"),
+    ).where(TestAttempt.user_id == user.id).subquery()
+    counts = select(Question.test_id, func.count(Question.id).label("n"))\
+        .group_by(Question.test_id).subquery()
+    rows = await db.execute(
+        select(Test.id, Test.title, Test.difficulty, Test.grade, Test.topic_id,
+               func.coalesce(counts.c.n, 0), latest.c.test_id, latest.c.score)
+        .outerjoin(counts, counts.c.test_id == Test.id)
+        .outerjoin(latest, (latest.c.test_id == Test.id) & (latest.c.rn == 1))
+        .where(Test.grade <= max_unlocked)
+        .order_by(Test.id)
+    )
+    return [
+        {
+            "id": test_id, "title": title, "difficulty": difficulty,
+            "grade": grade, "topic_id": topic_id,
+            "question_count": question_count,
+            "best_score": score,
+            "attempted": attempted is not None,
+        }
+        for test_id, title, difficulty, grade, topic_id, question_count, attempted, score in rows
+    ]
 
 
 @router.get("/tests/{test_id}")
@@ -208,24 +226,9 @@ def submit_test(test_id: int, req: TestSubmit, user: User = Depends(_student), d
     if not test:
         raise HTTPException(404, "Test not found")
 
-    score = 0
     max_score = len(test.questions)
-    wrong = []
-
-    for q in test.questions:
-        student_answer = req.answers.get(str(q.id))
-        if student_answer == q.correct_answer:
-            score += 1
-        else:
-            wrong.append({
-                "question_id": q.id, "text": q.text,
-                "your_answer": student_answer,
-                "correct_answer": q.correct_answer,
-                "explanation": q.explanation,
-            })
-
-    points_earned = int(score / max_score * 20) if max_score else 0
-    user.points += points_earned
+    score, wrong = score_test(test.questions, req.answers)
+    user.points += award_points(score, max_score, TEST_POINTS)
 
     attempt = TestAttempt(
         user_id=user.id, test_id=test_id,
@@ -243,45 +246,61 @@ def submit_test(test_id: int, req: TestSubmit, user: User = Depends(_student), d
 
 
 @router.get("/test-history")
-def test_history(user: User = Depends(_student), db: Session = Depends(get_db)):
-    attempts = db.query(TestAttempt).filter(TestAttempt.user_id == user.id)\
-        .order_by(TestAttempt.completed_at.desc()).all()
-    result = []
-    for a in attempts:
-        test = db.query(Test).filter(Test.id == a.test_id).first()
-        result.append({
+async def test_history(user: User = Depends(_async_student), db: AsyncSession = Depends(get_async_read_db)):
+    rows = await db.execute(
+        select(TestAttempt, Test.title).outerjoin(Test, Test.id == TestAttempt.test_id)
+        .where(TestAttempt.user_id == user.id).order_by(TestAttempt.completed_at.desc())
+    )
+    return [
+        {
             "id": a.id, "test_id": a.test_id,
-            "test_title": test.title if test else "Unknown",
+            "test_title": title or "Unknown",
             "score": a.score, "max_score": a.max_score,
             "time_spent_seconds": a.time_spent_seconds,
             "completed_at": a.completed_at.isoformat() if a.completed_at else None,
             "wrong_answers": a.wrong_answers,
-        })
-    return result
+        }
+        for a, title in rows
+    ]
 
 
 # ── Code Tasks ─────────────────────────────────────────
 
 @router.get("/tasks")
-def list_tasks(db: Session = Depends(get_db), user: User = Depends(_student)):
+async def list_tasks(db: AsyncSession = Depends(get_async_read_db), user: User = Depends(_async_student)):
+    """Task catalog; description and starter code come with GET /tasks/{id}."""
     student_grade = parse_grade_num(user.grade)
     max_unlocked = max(user.max_unlocked_grade or 0, student_grade, 6)
-    tasks = db.query(CodeTask).filter(func.coalesce(CodeTask.grade, 6) <= max_unlocked).all()
-    result = []
-    for t in tasks:
-        best = db.query(CodeAttempt).filter(
-            CodeAttempt.user_id == user.id, CodeAttempt.task_id == t.id
-        ).order_by(CodeAttempt.score.desc()).first()
-        module = db.query(Module).filter(Module.id == t.module_id).first() if t.module_id else None
-        result.append({
-            "id": t.id, "title": t.title, "difficulty": t.difficulty,
-            "grade": t.grade, "topic_id": t.topic_id, "module_id": t.module_id,
-            "module_title": module.title if module else None,
-            "description": t.description, "starter_code": t.starter_code,
-            "best_score": best.score if best else None,
-            "max_score": len(t.test_cases),
+    best = select(CodeAttempt.task_id, func.max(CodeAttempt.score).label("score"))\
+        .where(CodeAttempt.user_id == user.id).group_by(CodeAttempt.task_id).subquery()
+    rows = (await db.execute(
+        select(CodeTask.id, CodeTask.title, CodeTask.difficulty, CodeTask.grade, CodeTask.topic_id,
+               CodeTask.module_id, Module.title.label("module_title"), CodeTask.case_count, CodeTask.mode,
+               best.c.score)
+        .outerjoin(Module, Module.id == CodeTask.module_id)
+        .outerjoin(best, best.c.task_id == CodeTask.id)
+        .where(func.coalesce(CodeTask.grade, 6) <= max_unlocked)
+        .order_by(CodeTask.id)
+    )).all()
+
+    case_counts = {}
+    missing = [r.id for r in rows if r.case_count is None]
+    if missing:
+        # Rows saved before case_count existed: counting loads deferred columns (sync session)
+        case_counts = await db.run_sync(lambda s: {
+            t.id: testcases.case_count(t) for t in s.query(CodeTask).filter(CodeTask.id.in_(missing))
         })
-    return result
+    return [
+        {
+            "id": r.id, "title": r.title, "difficulty": r.difficulty,
+            "grade": r.grade, "topic_id": r.topic_id, "module_id": r.module_id,
+            "module_title": r.module_title,
+            "best_score": r.score,
+            "max_score": r.case_count if r.case_count is not None else case_counts.get(r.id),
+            "mode": r.mode or "output",
+        }
+        for r in rows
+    ]
 
 
 @router.get("/tasks/{task_id}")
@@ -289,22 +308,118 @@ def get_task(task_id: int, db: Session = Depends(get_db), user: User = Depends(_
     task = db.query(CodeTask).filter(CodeTask.id == task_id).first()
     if not task:
         raise HTTPException(404, "Task not found")
+    limits = sandbox.limits_for(task)
     return {
         "id": task.id, "title": task.title, "description": task.description,
         "difficulty": task.difficulty, "starter_code": task.starter_code,
-        "test_case_count": len(task.test_cases),
+        "test_case_count": testcases.case_count(task),
+        "mode": task.mode or "output",
+        "time_limit_seconds": limits["timeout"],
+        "memory_limit_mb": limits["memory_mb"],
     }
 
 
+@router.get("/tasks/{task_id}/fastest")
+def fastest_solutions(task_id: int, limit: int = 10, db: Session = Depends(get_db), user: User = Depends(_student)):
+    """Fastest fully-passing solutions of a performance task, by total CPU time."""
+    task = db.query(CodeTask).filter(CodeTask.id == task_id).first()
+    if not task:
+        raise HTTPException(404, "Task not found")
+    if not perf.is_performance(task):
+        raise HTTPException(400, "Not a performance task")
+    return perf.fastest(db, task_id, min(max(limit, 1), 50))
+
+
+def _busy(e: Busy):
+    return HTTPException(429, "Server busy, try again shortly",
+                         headers={"Retry-After": str(e.retry_after)})
+
+
 @router.post("/code/run")
 def run_code(req: dict, user: User = Depends(_student)):
     """Run code with provided stdin and return output immediately."""
     code = req.get("code", "")
     stdin = req.get("stdin", "")
-    passed, output, error = _run_code_safe(code, stdin)
+    try:
+        passed, output, error = run_snippet(code, stdin, user_id=user.id)
+    except Busy as e:
+        raise _busy(e)
     return {"output": output, "error": error, "passed": passed}
 
 
+def _ws_student(token: str) -> User | None:
+    db = SessionLocal()
+    try:
+        user = user_from_token(db, token)
+        return user if user is not None and user.role == "student" else None
+    finally:
+        db.close()
+
+
+@router.websocket("/code/run/ws")
+async def run_code_stream(websocket: WebSocket, token: str = ""):
+    """Streaming /code/run.
+
+    Client sends {"type": "run", "code", "stdin"} or {"type": "cancel"}; server
+    sends {"type": "stdout"|"stderr", "data"} while the code runs, then
+    {"type": "done", "output", "error", "passed", "cancelled"} or
+    {"type": "busy", "retry_after"}. Closing the socket cancels the run too.
+    """
+    user = await run_in_threadpool(_ws_student, token)
+    if user is None:
+        await websocket.close(code=4401)
+        return
+    await websocket.accept()
+
+    loop = asyncio.get_running_loop()
+    outbox = asyncio.Queue()
+    cancel = None
+    running = None
+
+    def on_chunk(stream: str, text: str):
+        loop.call_soon_threadsafe(outbox.put_nowait, {"type": stream, "data": text})
+
+    async def execute(code: str, stdin: str, flag: threading.Event):
+        try:
+            passed, output, error = await run_in_threadpool(stream_snippet, code, stdin, on_chunk, flag, user.id)
+            outbox.put_nowait({"type": "done", "output": output, "error": error,
+                               "passed": passed, "cancelled": flag.is_set()})
+        except Busy as e:
+            outbox.put_nowait({"type": "busy", "retry_after": e.retry_after})
+
+    async def send_loop():
+        while True:
+            await websocket.send_json(await outbox.get())
+
+    sender = asyncio.create_task(send_loop())
+    try:
+        while True:
+            try:
+                msg = await websocket.receive_json()
+            except (ValueError, KeyError):
+                continue
+            kind = msg.get("type") if isinstance(msg, dict) else None
+            if kind == "cancel":
+                if cancel is not None:
+                    cancel.set()
+            elif kind == "run":
+                if running is not None and not running.done():
+                    outbox.put_nowait({"type": "error", "detail": "A run is already in progress"})
+                    continue
+                cancel = threading.Event()
+                running = asyncio.create_task(execute(msg.get("code", ""), msg.get("stdin", ""), cancel))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Kill the sandbox now instead of letting it run to the time limit
+        if cancel is not None:
+            cancel.set()
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        if running is not None:
+            await running
+
+
 @router.post("/tasks/{task_id}/submit", response_model=CodeAttemptOut)
 def submit_code(task_id: int, req: CodeSubmit, user: User = Depends(_student), db: Session = Depends(get_db)):
     """Submit code for auto-check. Runs against test cases server-side with sandboxing."""
@@ -312,47 +427,74 @@ def submit_code(task_id: int, req: CodeSubmit, user: User = Depends(_student), d
     if not task:
         raise HTTPException(404, "Task not found")
 
-    results = []
-    score = 0
-    for i, tc in enumerate(task.test_cases):
-        passed, output, error = _run_code_safe(req.code, tc.get("input", ""))
-        expected = tc.get("expected_output", "").strip()
-        actual = output.strip() if output else ""
-        is_pass = passed and actual == expected
-
-        if is_pass:
-            score += 1
-
-        results.append({
-            "case": i + 1,
-            "input": tc.get("input", ""),
-            "expected": expected,
-            "actual": actual,
-            "passed": is_pass,
-            "error": error,
-        })
+    try:
+        results, score = grade_task(task, req.code, fail_fast=req.fail_fast, user_id=user.id)
+    except Busy as e:
+        raise _busy(e)
+    return record_code_attempt(db, user, task, req.code, results, score)
 
-    error_type = _categorize_error_type(req.code, results)
-    points_earned = int(score / len(task.test_cases) * 15) if task.test_cases else 0
-    user.points += points_earned
 
-    attempt = CodeAttempt(
-        user_id=user.id, task_id=task_id,
-        code=req.code, score=score, max_score=len(task.test_cases),
-        results=results, error_type=error_type,
-    )
-    db.add(attempt)
-    db.commit()
-    db.refresh(attempt)
+@router.post("/tasks/{task_id}/submit-async", status_code=202)
+def submit_code_async(task_id: int, req: CodeSubmit, user: User = Depends(_student), db: Session = Depends(get_db)):
+    """Queue code for auto-check and return a job id right away."""
+    task = db.query(CodeTask).filter(CodeTask.id == task_id).first()
+    if not task:
+        raise HTTPException(404, "Task not found")
+    # Same per-student fairness as interactive runs: a few jobs in flight at most
+    if submission_queue.active_jobs(db, user.id) >= settings.EXEC_MAX_PER_USER:
+        raise HTTPException(429, "Too many submissions in progress", headers={"Retry-After": "2"})
+    job = submission_queue.enqueue(db, user, task, req.code, fail_fast=req.fail_fast)
+    return {"job_id": job.id, "status": job.status}
 
-    check_and_award_badges(db, user)
-    return attempt
+
+def _load_job(job_id: int, user_id: int) -> dict | None:
+    db = SessionLocal()
+    try:
+        job = db.query(SubmissionJob).filter(
+            SubmissionJob.id == job_id, SubmissionJob.user_id == user_id
+        ).first()
+        return submission_queue.job_status(job) if job else None
+    finally:
+        db.close()
+
+
+@router.get("/jobs/{job_id}")
+def get_submission_job(job_id: int, user: User = Depends(_student)):
+    """Poll a queued submission: status, per-case progress and the attempt id when done."""
+    status = _load_job(job_id, user.id)
+    if not status:
+        raise HTTPException(404, "Job not found")
+    return status
+
+
+@router.get("/jobs/{job_id}/events")
+async def submission_job_events(job_id: int, user: User = Depends(_student)):
+    """Server-sent events: one `case` event per finished test case, then `done`."""
+    user_id = user.id
+    if not await run_in_threadpool(_load_job, job_id, user_id):
+        raise HTTPException(404, "Job not found")
+
+    async def events():
+        sent = set()
+        while True:
+            status = await run_in_threadpool(_load_job, job_id, user_id)
+            for r in status["results"]:
+                if r["case"] not in sent:
+                    sent.add(r["case"])
+                    yield f"event: case\ndata: {json.dumps(r)}\n\n"
+            if status["status"] in ("done", "failed"):
+                yield f"event: {status['status']}\ndata: {json.dumps(status)}\n\n"
+                return
+            await asyncio.sleep(0.3)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
 
 
 @router.get("/task-history")
-def task_history(user: User = Depends(_student), db: Session = Depends(get_db)):
-    attempts = db.query(CodeAttempt).filter(CodeAttempt.user_id == user.id)\
-        .order_by(CodeAttempt.created_at.desc()).all()
+async def task_history(user: User = Depends(_async_student), db: AsyncSession = Depends(get_async_read_db)):
+    attempts = (await db.scalars(select(CodeAttempt).where(CodeAttempt.user_id == user.id)
+                                 .order_by(CodeAttempt.created_at.desc()))).all()
     return [
         {
             "id": a.id, "task_id": a.task_id, "score": a.score,
@@ -382,35 +524,6 @@ _ERROR_KEYWORDS = {
 }
 
 
-def _categorize_error_type(code: str, results: list) -> str | None:
-    """Determine the dominant error type from submission results."""
-    if not results or all(r.get("passed") for r in results):
-        return None
-    failed = [r for r in results if not r.get("passed")]
-    errors = " ".join((r.get("error") or "") for r in failed).lower()
-
-    if "syntaxerror" in errors or "indentationerror" in errors:
-        return "syntax"
-    if "nameerror" in errors or "unboundlocalerror" in errors or "attributeerror" in errors:
-        return "variable"
-    if "timeout" in errors or "time limit" in errors:
-        return "loop"
-    if "typeerror" in errors or "valueerror" in errors:
-        return "io"
-    if "indexerror" in errors or "keyerror" in errors:
-        return "variable"
-
-    # Wrong answer — infer from code structure
-    c = code.lower()
-    if "for " in c or "while " in c:
-        return "loop"
-    if " if " in c or "\nif " in c or "elif " in c:
-        return "condition"
-    if "input(" in c or "print(" in c:
-        return "io"
-    return "logic"
-
-
 @router.get("/error-map")
 def error_map(user: User = Depends(_student), db: Session = Depends(get_db)):
     """Return student's error type statistics."""
@@ -497,61 +610,35 @@ def recommendations(user: User = Depends(_student), db: Session = Depends(get_db
     }
 
 
-def _run_code_safe(code: str, stdin_input: str) -> tuple:
-    """Execute code in a restricted subprocess with timeout."""
-    import subprocess, tempfile, os
-    # Basic safety checks
-    forbidden = ["import os", "import sys", "import subprocess", "import shutil",
-                 "open(", "__import__", "eval(", "exec(", "compile("]
-    for f in forbidden:
-        if f in code:
-            return False, "", f"Forbidden operation: {f}"
-
-    with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=False) as tmp:
-        tmp.write(code)
-        tmp_path = tmp.name
-
-    try:
-        result = subprocess.run(
-            ["python3", tmp_path],
-            input=stdin_input, capture_output=True, text=True, timeout=5,
-        )
-        return result.returncode == 0, result.stdout, result.stderr
-    except subprocess.TimeoutExpired:
-        return False, "", "Time limit exceeded (5s)"
-    except Exception as e:
-        return False, "", str(e)
-    finally:
-        os.unlink(tmp_path)
-
-
 # ── Chat / AI ──────────────────────────────────────────
 
 @router.post("/chat")
-def chat(req: ChatSend, user: User = Depends(_student), db: Session = Depends(get_db)):
+async def chat(req: ChatSend, user: User = Depends(_async_student), db: AsyncSession = Depends(get_async_db)):
     # Save user message
     user_msg = ChatMessage(user_id=user.id, role="user", content=req.message)
     db.add(user_msg)
-    db.flush()
+    await db.flush()
 
     # Build history for GPT context
-    recent = db.query(ChatMessage).filter(ChatMessage.user_id == user.id)\
-        .order_by(ChatMessage.created_at.desc()).limit(12).all()
+    recent = (await db.scalars(select(ChatMessage).where(ChatMessage.user_id == user.id)
+                               .order_by(ChatMessage.created_at.desc()).limit(12))).all()
     history = [{"role": m.role, "content": m.content} for m in reversed(recent)]
+    # Give the connection back while the model answers
+    await db.commit()
 
     # Generate response (GPT if API key set, else rule-based)
-    response_text = generate_response(req.message, history=history)
+    response_text = await run_in_threadpool(generate_response, req.message, history=history)
     assistant_msg = ChatMessage(user_id=user.id, role="assistant", content=response_text)
     db.add(assistant_msg)
-    db.commit()
+    await db.commit()
 
     return {"response": response_text, "id": assistant_msg.id}
 
 
 @router.get("/chat/history")
-def chat_history(user: User = Depends(_student), db: Session = Depends(get_db)):
-    messages = db.query(ChatMessage).filter(ChatMessage.user_id == user.id)\
-        .order_by(ChatMessage.created_at).all()
+async def chat_history(user: User = Depends(_async_student), db: AsyncSession = Depends(get_async_db)):
+    messages = (await db.scalars(select(ChatMessage).where(ChatMessage.user_id == user.id)
+                                 .order_by(ChatMessage.created_at))).all()
     return [
         {"id": m.id, "role": m.role, "content": m.content,
          "created_at": m.created_at.isoformat() if m.created_at else None}
@@ -562,18 +649,19 @@ def chat_history(user: User = Depends(_student), db: Session = Depends(get_db)):
 # ── Feedback / Inbox ───────────────────────────────────
 
 @router.get("/feedback")
-def my_feedback(user: User = Depends(_student), db: Session = Depends(get_db)):
-    items = db.query(Feedback).filter(Feedback.student_id == user.id)\
-        .order_by(Feedback.created_at.desc()).all()
-    result = []
-    for f in items:
-        teacher = db.query(User).filter(User.id == f.teacher_id).first()
-        result.append({
+async def my_feedback(user: User = Depends(_async_student), db: AsyncSession = Depends(get_async_db)):
+    rows = await db.execute(
+        select(Feedback, User.full_name).outerjoin(User, User.id == Feedback.teacher_id)
+        .where(Feedback.student_id == user.id).order_by(Feedback.created_at.desc())
+    )
+    return [
+        {
             "id": f.id, "message": f.message, "is_read": f.is_read,
-            "teacher_name": teacher.full_name if teacher else "Teacher",
+            "teacher_name": teacher or "Teacher",
             "created_at": f.created_at.isoformat() if f.created_at else None,
-        })
-    return result
+        }
+        for f, teacher in rows
+    ]
 
 
 @router.post("/feedback/{feedback_id}/read")
@@ -589,9 +677,9 @@ def mark_read(feedback_id: int, user: User = Depends(_student), db: Session = De
 # ── Leaderboard ────────────────────────────────────────
 
 @router.get("/leaderboard")
-def leaderboard(db: Session = Depends(get_db), _user: User = Depends(_student)):
-    users = db.query(User).filter(User.role == "student")\
-        .order_by(User.points.desc()).limit(10).all()
+async def leaderboard(db: AsyncSession = Depends(get_async_read_db), _user: User = Depends(_async_student)):
+    users = (await db.scalars(select(User).where(User.role == "student")
+                              .order_by(User.points.desc()).limit(10))).all()
     return [
         {"rank": i + 1, "full_name": u.full_name, "points": u.points,
          "level": u.level, "grade": u.grade}
@@ -790,81 +878,61 @@ async def upload_file(file: UploadFile = File(...), user: User = Depends(_studen
     return {"url": f"/static/uploads/{filename}", "filename": file.filename}
 
 
+@router.websocket("/messages/ws")
+async def messenger_socket(websocket: WebSocket, token: str = ""):
+    """Live messages, read receipts and typing; see app.utils.messenger_hub."""
+    user = await run_in_threadpool(_ws_student, token)
+    if user is None:
+        await websocket.close(code=4401)
+        return
+    await messenger_hub.serve(websocket, user)
+
+
 @router.get("/messages/contacts")
-def messenger_contacts(user: User = Depends(_student), db: Session = Depends(get_db)):
+async def messenger_contacts(user: User = Depends(_async_student), db: AsyncSession = Depends(get_async_db)):
     """Get classmates (same grade) and teachers for messaging."""
-    contacts = []
-
-    # Classmates (same grade)
+    conv = conversations.summaries_for(user.id)
+    visible = User.role == "teacher"
     if user.grade:
-        classmates = db.query(User).filter(
-            User.grade == user.grade, User.role == "student", User.id != user.id
-        ).order_by(User.full_name).all()
-        for c in classmates:
-            last = db.query(DirectMessage).filter(
-                ((DirectMessage.sender_id == user.id) & (DirectMessage.receiver_id == c.id)) |
-                ((DirectMessage.sender_id == c.id) & (DirectMessage.receiver_id == user.id))
-            ).order_by(DirectMessage.created_at.desc()).first()
-            unread = db.query(DirectMessage).filter(
-                DirectMessage.sender_id == c.id, DirectMessage.receiver_id == user.id,
-                DirectMessage.is_read == False
-            ).count()
-            contacts.append({
-                "id": c.id, "full_name": c.full_name, "role": c.role,
-                "grade": c.grade,
-                "last_message": last.content[:50] if last and last.content else (last.message_type if last else None),
-                "last_time": last.created_at.isoformat() if last else None,
-                "unread": unread,
-            })
-
-    # Teachers
-    teachers = db.query(User).filter(User.role == "teacher").order_by(User.full_name).all()
-    for t in teachers:
-        last = db.query(DirectMessage).filter(
-            ((DirectMessage.sender_id == user.id) & (DirectMessage.receiver_id == t.id)) |
-            ((DirectMessage.sender_id == t.id) & (DirectMessage.receiver_id == user.id))
-        ).order_by(DirectMessage.created_at.desc()).first()
-        unread = db.query(DirectMessage).filter(
-            DirectMessage.sender_id == t.id, DirectMessage.receiver_id == user.id,
-            DirectMessage.is_read == False
-        ).count()
-        contacts.append({
-            "id": t.id, "full_name": t.full_name, "role": t.role,
-            "grade": None,
-            "last_message": last.content[:50] if last and last.content else (last.message_type if last else None),
-            "last_time": last.created_at.isoformat() if last else None,
-            "unread": unread,
-        })
-
-    return contacts
+        visible |= (User.grade == user.grade) & (User.role == "student") & (User.id != user.id)
+    rows = (await db.execute(
+        select(User, conv).outerjoin(conv, conv.c.other_id == User.id).where(visible)
+        # Classmates first, then teachers
+        .order_by(User.role == "teacher", User.full_name)
+    )).all()
+    return [conversations.contact(row.User, row) for row in rows]
 
 
 @router.get("/messages/direct/{other_id}")
-def get_direct_messages(other_id: int, user: User = Depends(_student), db: Session = Depends(get_db)):
-    """Get DM history with another user."""
-    messages = db.query(DirectMessage).filter(
-        ((DirectMessage.sender_id == user.id) & (DirectMessage.receiver_id == other_id)) |
-        ((DirectMessage.sender_id == other_id) & (DirectMessage.receiver_id == user.id))
-    ).order_by(DirectMessage.created_at).all()
-
-    # Mark incoming as read
-    db.query(DirectMessage).filter(
-        DirectMessage.sender_id == other_id, DirectMessage.receiver_id == user.id,
-        DirectMessage.is_read == False
-    ).update({"is_read": True})
-    db.commit()
-
-    return [
+def get_direct_messages(other_id: int, before_id: int = None, after_id: int = None, since_id: int = None,
+                        limit: int = 50, user: User = Depends(_student), db: Session = Depends(get_db)):
+    """Get DM history with another user: the newest page, or the page before/after (since) a message id."""
+    messages = message_pages.direct(db, user.id, other_id, before_id,
+                                    after_id if after_id is not None else since_id, limit)
+    read = conversations.watermarks(db, user.id, other_id)
+    # Mark incoming as read up to the newest message returned (not when
+    # scrolling back through old pages); a delta page may stop short of the end
+    upto = None
+    if before_id is None and messages:
+        upto = conversations.mark_read(db, user.id, other_id, upto=messages[-1].id)
+    if upto is not None:
+        read[user.id] = upto
+    out = [
         {
             "id": m.id, "sender_id": m.sender_id,
             "sender_name": m.sender.full_name,
             "content": m.content, "is_mine": m.sender_id == user.id,
+            "is_read": m.id <= (read.get(m.receiver_id) or 0),
             "message_type": m.message_type or "text",
             "file_url": m.file_url,
             "created_at": m.created_at.isoformat() if m.created_at else None,
         }
         for m in messages
     ]
+    if upto is not None:
+        db.commit()
+        messenger_hub.publish_read(user.id, other_id, upto)
+    return out
 
 
 @router.post("/messages/direct/{other_id}")
@@ -878,19 +946,21 @@ def send_direct_message(other_id: int, req: DirectMessageSend, user: User = Depe
         content=req.content, message_type=req.message_type, file_url=req.file_url,
     )
     db.add(msg)
+    db.flush()
+    conversations.record_message(db, msg)
+    message = messenger_hub.direct_message(msg, user)
     db.commit()
-    db.refresh(msg)
-    return {"id": msg.id, "ok": True}
+    messenger_hub.publish_direct(message)
+    return {"id": message["id"], "ok": True}
 
 
 @router.get("/messages/group")
-def get_group_messages(user: User = Depends(_student), db: Session = Depends(get_db)):
-    """Get group chat for student's grade."""
+def get_group_messages(before_id: int = None, after_id: int = None, since_id: int = None, limit: int = 50,
+                       user: User = Depends(_student), db: Session = Depends(get_db)):
+    """Get group chat for student's grade, paged like the DM history."""
     if not user.grade:
         return []
-    messages = db.query(GroupMessage).filter(
-        GroupMessage.grade == user.grade
-    ).order_by(GroupMessage.created_at).limit(200).all()
+    messages = message_pages.group(db, user.grade, before_id, after_id if after_id is not None else since_id, limit)
     return [
         {
             "id": m.id, "sender_id": m.sender_id,
@@ -915,6 +985,8 @@ def send_group_message(req: GroupMessageSend, user: User = Depends(_student), db
         content=req.content, message_type=req.message_type, file_url=req.file_url,
     )
     db.add(msg)
+    db.flush()
+    message = messenger_hub.group_message(msg, user)
     db.commit()
-    db.refresh(msg)
-    return {"id": msg.id, "ok": True}
+    messenger_hub.publish_group(message)
+    return {"id": message["id"], "ok": True}
@@ -4,24 +4,34 @@ import os
 import uuid
 from datetime import datetime
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, WebSocket
 from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import case, func, select
 
-from app.database import get_db
+from app.config import settings
+from app.database import get_db, get_async_db, SessionLocal, pool_stats, async_pool_stats, replica_stats
 from app.models.models import (
     User, Module, Lesson, LessonProgress, Test, Question,
     TestAttempt, CodeTask, CodeAttempt, Feedback,
-    DirectMessage, GroupMessage, Topic,
+    DirectMessage, GroupMessage, Topic, RegradeJob,
 )
 from app.schemas.schemas import (
     LessonCreate, LessonUpdate, ModuleCreate, TestCreate, TestUpdate,
     CodeTaskCreate, CodeTaskUpdate, FeedbackCreate,
     DirectMessageSend, GroupMessageSend,
-    TopicCreate, TopicUpdate, TopicOut, StudentUpdate,
+    TopicCreate, TopicUpdate, TopicOut, StudentUpdate, RegradeStart,
 )
-from app.utils.auth import get_current_user
+from app.utils.auth import (
+    get_current_user, get_async_current_user, get_read_db, get_async_read_db, user_from_token,
+)
+from app.utils import (
+    conversations, curriculum, grading_cache, message_pages, messenger_hub, perf, preflight, query_stats,
+    regrade, sandbox, similarity, sqlite_mode, testcases,
+)
+from app.utils.scheduler import scheduler
 
 router = APIRouter(prefix="/api/teacher", tags=["teacher"])
 
@@ -32,24 +42,34 @@ def _teacher(user: User = Depends(get_current_user)):
     return user
 
 
+async def _async_teacher(user: User = Depends(get_async_current_user)):
+    if user.role != "teacher":
+        raise HTTPException(403, "Teachers only")
+    return user
+
+
 # ── Dashboard ──────────────────────────────────────────
 
 @router.get("/dashboard")
-def dashboard(user: User = Depends(_teacher), db: Session = Depends(get_db)):
-    num_students = db.query(User).filter(User.role == "student").count()
-    avg_score = db.query(func.avg(TestAttempt.score)).scalar() or 0
-
-    recent = db.query(TestAttempt).order_by(TestAttempt.completed_at.desc()).limit(10).all()
-    activity = []
-    for a in recent:
-        student = db.query(User).filter(User.id == a.user_id).first()
-        test = db.query(Test).filter(Test.id == a.test_id).first()
-        activity.append({
-            "student": student.full_name if student else "Unknown",
-            "test": test.title if test else "Unknown",
+async def dashboard(user: User = Depends(_async_teacher), db: AsyncSession = Depends(get_async_read_db)):
+    num_students = await db.scalar(select(func.count(User.id)).where(User.role == "student"))
+    avg_score = await db.scalar(select(func.avg(TestAttempt.score))) or 0
+
+    recent = await db.execute(
+        select(TestAttempt, User.full_name, Test.title)
+        .outerjoin(User, User.id == TestAttempt.user_id)
+        .outerjoin(Test, Test.id == TestAttempt.test_id)
+        .order_by(TestAttempt.completed_at.desc()).limit(10)
+    )
+    activity = [
+        {
+            "student": student or "Unknown",
+            "test": test or "Unknown",
             "score": a.score, "max_score": a.max_score,
             "date": a.completed_at.isoformat() if a.completed_at else None,
-        })
+        }
+        for a, student, test in recent
+    ]
 
     return {
         "num_students": num_students,
@@ -61,34 +81,38 @@ def dashboard(user: User = Depends(_teacher), db: Session = Depends(get_db)):
 # ── Student Management ─────────────────────────────────
 
 @router.get("/students")
-def list_students(grade: str = None, db: Session = Depends(get_db), user: User = Depends(_teacher)):
-    q = db.query(User).filter(User.role == "student")
+async def list_students(grade: str = None, db: AsyncSession = Depends(get_async_read_db),
+                        user: User = Depends(_async_teacher)):
+    # Completed lessons and average test percentage per student, grouped in the same query
+    completed = select(LessonProgress.user_id, func.count(LessonProgress.id).label("n"))\
+        .where(LessonProgress.completed == True).group_by(LessonProgress.user_id).subquery()
+    percent = case((TestAttempt.max_score > 0, TestAttempt.score * 100.0 / TestAttempt.max_score), else_=0)
+    scores = select(TestAttempt.user_id, func.avg(percent).label("avg"))\
+        .group_by(TestAttempt.user_id).subquery()
+    q = select(User, func.coalesce(completed.c.n, 0), func.coalesce(scores.c.avg, 0))\
+        .outerjoin(completed, completed.c.user_id == User.id)\
+        .outerjoin(scores, scores.c.user_id == User.id)\
+        .where(User.role == "student")
     if grade:
-        q = q.filter(User.grade == grade)
-    students = q.order_by(User.full_name).all()
-
-    result = []
-    total_lessons = db.query(Lesson).count()
-    for s in students:
-        completed = db.query(LessonProgress).filter(
-            LessonProgress.user_id == s.id, LessonProgress.completed == True
-        ).count()
-        attempts = db.query(TestAttempt).filter(TestAttempt.user_id == s.id).all()
-        avg = (sum(a.score / a.max_score * 100 if a.max_score else 0 for a in attempts) / len(attempts)) if attempts else 0
+        q = q.where(User.grade == grade)
+    rows = (await db.execute(q.order_by(User.full_name))).all()
+    total_lessons = await db.scalar(select(func.count(Lesson.id)))
 
-        result.append({
+    return [
+        {
             "id": s.id, "username": s.username, "full_name": s.full_name,
             "grade": s.grade, "points": s.points, "level": s.level,
-            "completed_lessons": completed, "total_lessons": total_lessons,
-            "progress_percent": round(completed / total_lessons * 100, 1) if total_lessons else 0,
-            "avg_test_score": round(avg, 1),
+            "completed_lessons": done, "total_lessons": total_lessons,
+            "progress_percent": round(done / total_lessons * 100, 1) if total_lessons else 0,
+            "avg_test_score": round(float(avg), 1),
             "streak_days": s.streak_days,
-        })
-    return result
+        }
+        for s, done, avg in rows
+    ]
 
 
 @router.get("/students/{student_id}")
-def student_detail(student_id: int, db: Session = Depends(get_db), user: User = Depends(_teacher)):
+def student_detail(student_id: int, db: Session = Depends(get_read_db), user: User = Depends(_teacher)):
     student = db.query(User).filter(User.id == student_id, User.role == "student").first()
     if not student:
         raise HTTPException(404, "Student not found")
@@ -191,6 +215,7 @@ def create_module(req: ModuleCreate, db: Session = Depends(get_db), user: User =
     m = Module(title=req.title, order=req.order, description=req.description)
     db.add(m)
     db.commit()
+    curriculum.invalidate()
     db.refresh(m)
     return {"id": m.id, "title": m.title}
 
@@ -214,6 +239,7 @@ def create_lesson(req: LessonCreate, db: Session = Depends(get_db), user: User =
     lesson = Lesson(**req.model_dump())
     db.add(lesson)
     db.commit()
+    curriculum.invalidate()
     db.refresh(lesson)
     return {"id": lesson.id, "title": lesson.title}
 
@@ -226,6 +252,7 @@ def update_lesson(lesson_id: int, req: LessonUpdate, db: Session = Depends(get_d
     for key, val in req.model_dump(exclude_unset=True).items():
         setattr(lesson, key, val)
     db.commit()
+    curriculum.invalidate()
     return {"ok": True}
 
 
@@ -236,6 +263,7 @@ def delete_lesson(lesson_id: int, db: Session = Depends(get_db), user: User = De
         raise HTTPException(404, "Lesson not found")
     db.delete(lesson)
     db.commit()
+    curriculum.invalidate()
     return {"ok": True}
 
 
@@ -303,14 +331,40 @@ def update_test(test_id: int, req: TestUpdate, db: Session = Depends(get_db), us
         if val is not None:
             setattr(test, field, val)
 
-    # Always replace questions (teacher has full control)
+    # Questions are matched by id and edited in place, so stored answers (keyed
+    # by question id) still belong to the same questions after a reorder, and
+    # existing attempts can be re-scored. No id: a new question; left out: deleted.
+    regrade_needed = False
     if req.questions is not None:
-        db.query(Question).filter(Question.test_id == test_id).delete()
-        for q in req.questions:
-            db.add(Question(test_id=test_id, **q.model_dump()))
+        existing = {q.id: q for q in db.query(Question).filter(Question.test_id == test_id)}
+        unknown = [new.id for new in req.questions if new.id is not None and new.id not in existing]
+        if unknown:
+            raise HTTPException(400, f"Question {unknown[0]} is not in this test")
+        before = {q.id: (q.question_type, q.correct_answer) for q in existing.values()}
+        kept = set()
+        for new in req.questions:
+            fields = new.model_dump(exclude={"id"})
+            if new.id is None:
+                db.add(Question(test_id=test_id, **fields))
+                regrade_needed = True
+                continue
+            q = existing[new.id]
+            for field, val in fields.items():
+                setattr(q, field, val)
+            kept.add(q.id)
+        for q in existing.values():
+            if q.id not in kept:
+                db.delete(q)
+        regrade_needed = regrade_needed or kept != set(before) or any(
+            before[i] != (existing[i].question_type, existing[i].correct_answer) for i in kept)
 
     db.commit()
-    return {"ok": True, "attempts_preserved": False}
+    attempt_count = regrade.attempt_count(db, regrade.TEST, test_id)
+    job = None
+    if regrade_needed and attempt_count:
+        job = regrade.enqueue(db, regrade.TEST, test_id, user)
+    return {"ok": True, "attempts_preserved": True, "attempt_count": attempt_count,
+            "regrade_job_id": job.id if job else None}
 
 
 @router.delete("/tests/{test_id}")
@@ -334,15 +388,45 @@ def list_code_tasks(db: Session = Depends(get_db), user: User = Depends(_teacher
         {
             "id": t.id, "title": t.title, "difficulty": t.difficulty,
             "module_id": t.module_id, "grade": t.grade or 6, "topic_id": t.topic_id,
-            "test_case_count": len(t.test_cases),
+            "test_case_count": testcases.case_count(t), "mode": t.mode or "output",
         }
         for t in tasks
     ]
 
 
+_PERF_FIELDS = {"mode", "input_generator", "reference_solution", "generated_case_count"}
+
+
+def _build_generated_cases(task: CodeTask, user: User):
+    """(Re)generate the inputs of a performance task before it is saved."""
+    if task.mode not in ("output", perf.PERFORMANCE):
+        raise HTTPException(400, "Unknown task mode")
+    if not perf.is_performance(task):
+        task.generated_cases = None
+        return
+    try:
+        task.generated_cases = perf.generate_cases(task, user.id)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+def _store_cases(task: CodeTask):
+    try:
+        testcases.store(task)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+def _grading_inputs(task: CodeTask) -> tuple:
+    """Everything a stored attempt's score depends on."""
+    return perf.task_cases(task), perf.run_limits(task)
+
+
 @router.post("/code-tasks")
 def create_code_task(req: CodeTaskCreate, db: Session = Depends(get_db), user: User = Depends(_teacher)):
     task = CodeTask(**req.model_dump())
+    _build_generated_cases(task, user)
+    _store_cases(task)
     db.add(task)
     db.commit()
     db.refresh(task)
@@ -360,6 +444,14 @@ def get_code_task(task_id: int, db: Session = Depends(get_db), user: User = Depe
         "grade": task.grade or 6, "topic_id": task.topic_id,
         "starter_code": task.starter_code or "",
         "test_cases": task.test_cases or [],
+        "time_limit_seconds": task.time_limit_seconds,
+        "memory_limit_mb": task.memory_limit_mb,
+        "output_limit_kb": task.output_limit_kb,
+        "mode": task.mode or "output",
+        "input_generator": task.input_generator,
+        "reference_solution": task.reference_solution,
+        "generated_case_count": task.generated_case_count,
+        "generated_cases": [testcases.summary(tc) for tc in task.generated_cases or []],
         "deadline": task.deadline.isoformat() if task.deadline else None,
     }
 
@@ -369,10 +461,54 @@ def update_code_task(task_id: int, req: CodeTaskUpdate, db: Session = Depends(ge
     task = db.query(CodeTask).filter(CodeTask.id == task_id).first()
     if not task:
         raise HTTPException(404, "Task not found")
-    for field, val in req.model_dump(exclude_unset=True).items():
+    changes = req.model_dump(exclude_unset=True)
+    before = _grading_inputs(task)
+    # Regenerating inputs runs the teacher's programs, so only do it when they change
+    regenerate = any(getattr(task, f) != changes[f] for f in _PERF_FIELDS & changes.keys())
+    for field, val in changes.items():
         setattr(task, field, val)
+    if regenerate or (perf.is_performance(task) and not task.generated_cases):
+        _build_generated_cases(task, user)
+    _store_cases(task)
+    regrade_needed = _grading_inputs(task) != before
     db.commit()
-    return {"ok": True}
+    grading_cache.cache.invalidate_task(task_id)
+
+    job = None
+    if regrade_needed and regrade.attempt_count(db, regrade.CODE_TASK, task_id):
+        job = regrade.enqueue(db, regrade.CODE_TASK, task_id, user)
+    return {"ok": True, "regrade_job_id": job.id if job else None}
+
+
+# ── Regrade ────────────────────────────────────────────
+
+@router.post("/regrade", status_code=202)
+def start_regrade(req: RegradeStart, db: Session = Depends(get_db), user: User = Depends(_teacher)):
+    if req.kind not in regrade.KINDS:
+        raise HTTPException(400, "Unknown regrade kind")
+    target = CodeTask if req.kind == regrade.CODE_TASK else Test
+    if not db.query(target.id).filter(target.id == req.target_id).first():
+        raise HTTPException(404, "Task not found" if target is CodeTask else "Test not found")
+    return regrade.job_status(regrade.enqueue(db, req.kind, req.target_id, user))
+
+
+@router.get("/regrade")
+def list_regrades(kind: str = None, target_id: int = None, limit: int = 20,
+                  db: Session = Depends(get_db), user: User = Depends(_teacher)):
+    q = db.query(RegradeJob)
+    if kind:
+        q = q.filter(RegradeJob.kind == kind)
+    if target_id is not None:
+        q = q.filter(RegradeJob.target_id == target_id)
+    return [regrade.job_status(j) for j in q.order_by(RegradeJob.id.desc()).limit(min(limit, 100)).all()]
+
+
+@router.get("/regrade/{job_id}")
+def get_regrade(job_id: int, db: Session = Depends(get_db), user: User = Depends(_teacher)):
+    job = db.query(RegradeJob).filter(RegradeJob.id == job_id).first()
+    if not job:
+        raise HTTPException(404, "Regrade job not found")
+    return regrade.job_status(job)
 
 
 # ── Topics Management ──────────────────────────────────
@@ -424,15 +560,33 @@ def delete_code_task(task_id: int, db: Session = Depends(get_db), user: User = D
     task = db.query(CodeTask).filter(CodeTask.id == task_id).first()
     if not task:
         raise HTTPException(404, "Task not found")
+    similarity.drop_task(db, task_id)
     db.delete(task)
     db.commit()
+    grading_cache.cache.invalidate_task(task_id)
     return {"ok": True}
 
 
+@router.get("/code-tasks/{task_id}/similar")
+def similar_submissions(task_id: int, threshold: float = None, db: Session = Depends(get_db),
+                        user: User = Depends(_teacher)):
+    """Clusters of students whose submissions look copied from each other."""
+    if not db.query(CodeTask.id).filter(CodeTask.id == task_id).first():
+        raise HTTPException(404, "Task not found")
+    if threshold is not None and not similarity.MIN_THRESHOLD <= threshold <= 1:
+        raise HTTPException(400, f"Threshold must be between {similarity.MIN_THRESHOLD} and 1")
+    return {
+        "task_id": task_id,
+        "threshold": threshold if threshold is not None else settings.SIMILARITY_THRESHOLD,
+        "indexed_submissions": similarity.indexed_count(db, task_id),
+        "clusters": similarity.clusters(db, task_id, threshold),
+    }
+
+
 # ── Analytics ──────────────────────────────────────────
 
 @router.get("/analytics")
-def analytics(db: Session = Depends(get_db), user: User = Depends(_teacher)):
+def analytics(db: Session = Depends(get_read_db), user: User = Depends(_teacher)):
     modules = db.query(Module).order_by(Module.order).all()
     module_stats = []
     for m in modules:
@@ -461,10 +615,30 @@ def analytics(db: Session = Depends(get_db), user: User = Depends(_teacher)):
     }
 
 
+# ── Runtime Metrics ────────────────────────────────────
+
+@router.get("/metrics")
+def runtime_metrics(user: User = Depends(_teacher)):
+    """Counters of this API process: scheduler, sandbox pool, grading cache, pre-flight, database, queries."""
+    pool = sandbox.get_pool() if sandbox.pool_enabled() else None
+    return {
+        "scheduler": scheduler.stats(),
+        "grading_cache": grading_cache.cache.stats(),
+        "preflight": dict(preflight.stats),
+        "sandbox_pool": dict(pool.stats, size=pool.size) if pool else None,
+        "db_pool": pool_stats(),
+        "db_async_pool": async_pool_stats(),
+        "db_replicas": replica_stats(),
+        "queries_by_route": query_stats.stats(),
+        "messenger_sockets": messenger_hub.hub.connections,
+        "sqlite_writer": sqlite_mode.stats(),
+    }
+
+
 # ── Reports Export ─────────────────────────────────────
 
 @router.get("/export/csv")
-def export_csv(db: Session = Depends(get_db), user: User = Depends(_teacher)):
+def export_csv(db: Session = Depends(get_read_db), user: User = Depends(_teacher)):
     students = db.query(User).filter(User.role == "student").all()
     total_lessons = db.query(Lesson).count()
 
@@ -492,7 +666,7 @@ def export_csv(db: Session = Depends(get_db), user: User = Depends(_teacher)):
 
 
 @router.get("/export/pdf")
-def export_pdf(db: Session = Depends(get_db), user: User = Depends(_teacher)):
+def export_pdf(db: Session = Depends(get_read_db), user: User = Depends(_teacher)):
     from reportlab.lib.pagesizes import A4
     from reportlab.lib import colors
     from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
@@ -660,28 +834,34 @@ async def upload_file(file: UploadFile = File(...), user: User = Depends(_teache
     return {"url": f"/static/uploads/{filename}", "filename": file.filename}
 
 
+def _ws_teacher(token: str) -> User | None:
+    db = SessionLocal()
+    try:
+        user = user_from_token(db, token)
+        return user if user is not None and user.role == "teacher" else None
+    finally:
+        db.close()
+
+
+@router.websocket("/messages/ws")
+async def messenger_socket(websocket: WebSocket, token: str = ""):
+    """Live messages, read receipts and typing; send {"type": "subscribe", "grade"} to follow a grade chat."""
+    user = await run_in_threadpool(_ws_teacher, token)
+    if user is None:
+        await websocket.close(code=4401)
+        return
+    await messenger_hub.serve(websocket, user)
+
+
 @router.get("/messages/contacts")
-def messenger_contacts(user: User = Depends(_teacher), db: Session = Depends(get_db)):
+async def messenger_contacts(user: User = Depends(_async_teacher), db: AsyncSession = Depends(get_async_db)):
     """List all students grouped by grade for messaging."""
-    students = db.query(User).filter(User.role == "student").order_by(User.grade, User.full_name).all()
-    contacts = []
-    for s in students:
-        last = db.query(DirectMessage).filter(
-            ((DirectMessage.sender_id == user.id) & (DirectMessage.receiver_id == s.id)) |
-            ((DirectMessage.sender_id == s.id) & (DirectMessage.receiver_id == user.id))
-        ).order_by(DirectMessage.created_at.desc()).first()
-        unread = db.query(DirectMessage).filter(
-            DirectMessage.sender_id == s.id, DirectMessage.receiver_id == user.id,
-            DirectMessage.is_read == False
-        ).count()
-        contacts.append({
-            "id": s.id, "full_name": s.full_name, "role": s.role,
-            "grade": s.grade,
-            "last_message": last.content[:50] if last and last.content else (last.message_type if last else None),
-            "last_time": last.created_at.isoformat() if last else None,
-            "unread": unread,
-        })
-    return contacts
+    conv = conversations.summaries_for(user.id)
+    rows = (await db.execute(
+        select(User, conv).outerjoin(conv, conv.c.other_id == User.id)
+        .where(User.role == "student").order_by(User.grade, User.full_name)
+    )).all()
+    return [conversations.contact(row.User, row) for row in rows]
 
 
 @router.get("/messages/grades")
@@ -694,31 +874,35 @@ def messenger_grades(user: User = Depends(_teacher), db: Session = Depends(get_d
 
 
 @router.get("/messages/direct/{user_id}")
-def get_direct_messages(user_id: int, user: User = Depends(_teacher), db: Session = Depends(get_db)):
-    """Get DM history with a student."""
-    messages = db.query(DirectMessage).filter(
-        ((DirectMessage.sender_id == user.id) & (DirectMessage.receiver_id == user_id)) |
-        ((DirectMessage.sender_id == user_id) & (DirectMessage.receiver_id == user.id))
-    ).order_by(DirectMessage.created_at).all()
-
-    # Mark incoming as read
-    db.query(DirectMessage).filter(
-        DirectMessage.sender_id == user_id, DirectMessage.receiver_id == user.id,
-        DirectMessage.is_read == False
-    ).update({"is_read": True})
-    db.commit()
-
-    return [
+def get_direct_messages(user_id: int, before_id: int = None, after_id: int = None, since_id: int = None,
+                        limit: int = 50, user: User = Depends(_teacher), db: Session = Depends(get_db)):
+    """Get DM history with a student: the newest page, or the page before/after (since) a message id."""
+    messages = message_pages.direct(db, user.id, user_id, before_id,
+                                    after_id if after_id is not None else since_id, limit)
+    read = conversations.watermarks(db, user.id, user_id)
+    # Mark incoming as read up to the newest message returned (not when
+    # scrolling back through old pages); a delta page may stop short of the end
+    upto = None
+    if before_id is None and messages:
+        upto = conversations.mark_read(db, user.id, user_id, upto=messages[-1].id)
+    if upto is not None:
+        read[user.id] = upto
+    out = [
         {
             "id": m.id, "sender_id": m.sender_id,
             "sender_name": m.sender.full_name,
             "content": m.content, "is_mine": m.sender_id == user.id,
+            "is_read": m.id <= (read.get(m.receiver_id) or 0),
             "message_type": m.message_type or "text",
             "file_url": m.file_url,
             "created_at": m.created_at.isoformat() if m.created_at else None,
         }
         for m in messages
     ]
+    if upto is not None:
+        db.commit()
+        messenger_hub.publish_read(user.id, user_id, upto)
+    return out
 
 
 @router.post("/messages/direct/{user_id}")
@@ -732,17 +916,19 @@ def send_direct_message(user_id: int, req: DirectMessageSend, user: User = Depen
         content=req.content, message_type=req.message_type, file_url=req.file_url,
     )
     db.add(msg)
+    db.flush()
+    conversations.record_message(db, msg)
+    message = messenger_hub.direct_message(msg, user)
     db.commit()
-    db.refresh(msg)
-    return {"id": msg.id, "ok": True}
+    messenger_hub.publish_direct(message)
+    return {"id": message["id"], "ok": True}
 
 
 @router.get("/messages/group/{grade}")
-def get_group_messages(grade: str, user: User = Depends(_teacher), db: Session = Depends(get_db)):
-    """Get group chat for a specific grade."""
-    messages = db.query(GroupMessage).filter(
-        GroupMessage.grade == grade
-    ).order_by(GroupMessage.created_at).limit(200).all()
+def get_group_messages(grade: str, before_id: int = None, after_id: int = None, since_id: int = None,
+                       limit: int = 50, user: User = Depends(_teacher), db: Session = Depends(get_db)):
+    """Get group chat for a specific grade, paged like the DM history."""
+    messages = message_pages.group(db, grade, before_id, after_id if after_id is not None else since_id, limit)
     return [
         {
             "id": m.id, "sender_id": m.sender_id,
@@ -765,6 +951,8 @@ def send_group_message(grade: str, req: GroupMessageSend, user: User = Depends(_
         content=req.content, message_type=req.message_type, file_url=req.file_url,
     )
     db.add(msg)
+    db.flush()
+    message = messenger_hub.group_message(msg, user)
     db.commit()
-    db.refresh(msg)
-    return {"id": msg.id, "ok": True}
+    messenger_hub.publish_group(message)
+    return {"id": message["id"], "ok": True}
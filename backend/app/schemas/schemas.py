@@ -202,6 +202,10 @@ class TestCreate(BaseModel):
     questions: list[QuestionCreate] = []
 
 
+class QuestionUpdate(QuestionCreate):
+    id: Optional[int] = None  # existing question to edit; None adds a new one
+
+
 class TestUpdate(BaseModel):
     title: Optional[str] = None
     module_id: Optional[int] = None
@@ -209,7 +213,7 @@ class TestUpdate(BaseModel):
     grade: Optional[int] = None
     topic_id: Optional[int] = None
     deadline: Optional[datetime] = None
-    questions: Optional[list[QuestionCreate]] = None
+    questions: Optional[list[QuestionUpdate]] = None  # the full list: questions left out are deleted
 
 
 class TestOut(BaseModel):
@@ -270,6 +274,13 @@ class CodeTaskCreate(BaseModel):
     topic_id: Optional[int] = None
     starter_code: str = ""
     test_cases: list[dict]
+    time_limit_seconds: Optional[float] = None
+    memory_limit_mb: Optional[int] = None
+    output_limit_kb: Optional[int] = None
+    mode: str = "output"  # output|performance
+    input_generator: Optional[str] = None
+    reference_solution: Optional[str] = None
+    generated_case_count: Optional[int] = None
     deadline: Optional[datetime] = None
 
 
@@ -301,11 +312,19 @@ class CodeTaskUpdate(BaseModel):
     topic_id: Optional[int] = None
     starter_code: Optional[str] = None
     test_cases: Optional[list[dict]] = None
+    time_limit_seconds: Optional[float] = None
+    memory_limit_mb: Optional[int] = None
+    output_limit_kb: Optional[int] = None
+    mode: Optional[str] = None
+    input_generator: Optional[str] = None
+    reference_solution: Optional[str] = None
+    generated_case_count: Optional[int] = None
     deadline: Optional[datetime] = None
 
 
 class CodeSubmit(BaseModel):
     code: str
+    fail_fast: bool = False  # stop running cases after the first failure
 
 
 class CodeAttemptOut(BaseModel):
@@ -322,6 +341,11 @@ class CodeAttemptOut(BaseModel):
         from_attributes = True
 
 
+class RegradeStart(BaseModel):
+    kind: str  # code_task|test
+    target_id: int
+
+
 # ── Chat ───────────────────────────────────────────────
 
 class ChatSend(BaseModel):
@@ -5,10 +5,11 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app.config import settings
-from app.database import get_db
+from app.database import get_db, get_async_db, read_session, async_read_session
 from app.models.models import User
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -30,30 +31,75 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
-) -> User:
-    credentials_exception = HTTPException(
+def _token_user_id(token: str) -> Optional[int]:
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        sub = payload.get("sub")
+        return int(sub) if sub is not None else None
+    except (JWTError, ValueError):
+        return None
+
+
+def user_from_token(db: Session, token: str) -> Optional[User]:
+    """Resolve a JWT to its user, or None when the token is invalid."""
+    user_id = _token_user_id(token)
+    if user_id is None:
+        return None
+    return db.query(User).filter(User.id == user_id).first()
+
+
+async def async_user_from_token(db: AsyncSession, token: str) -> Optional[User]:
+    user_id = _token_user_id(token)
+    if user_id is None:
+        return None
+    return await db.get(User, user_id)
+
+
+def _credentials_error() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        sub = payload.get("sub")
-        if sub is None:
-            raise credentials_exception
-        user_id = int(sub)
-    except JWTError:
-        raise credentials_exception
 
-    user = db.query(User).filter(User.id == user_id).first()
+
+def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db),
+) -> User:
+    user = user_from_token(db, token)
+    if user is None:
+        raise _credentials_error()
+    db.info["user_id"] = user.id  # writes on this session start the user's read-your-writes window
+    return user
+
+
+async def get_async_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db),
+) -> User:
+    """get_current_user for async handlers; the user belongs to the request's AsyncSession."""
+    user = await async_user_from_token(db, token)
     if user is None:
-        raise credentials_exception
+        raise _credentials_error()
+    db.info["user_id"] = user.id
     return user
 
 
+def get_read_db(user: User = Depends(get_current_user)):
+    """Session for read-only handlers: a replica, unless this user wrote moments ago."""
+    db = read_session(user.id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db(user: User = Depends(get_async_current_user)):
+    async with async_read_session(user.id) as db:
+        yield db
+
+
 def require_role(role: str):
     def checker(user: User = Depends(get_current_user)):
         if user.role != role:
@@ -0,0 +1,117 @@
+"""Conversation summaries: what the messenger contact lists show, kept per user pair.
+
+Every sent direct message updates its pair's ConversationSummary row (last
+message preview and time, the receiver's unread count) in the sender's
+transaction. Read state is a watermark per side, the id of the last message
+that side has read: mark_read() moves it with one update of the summary row,
+instead of flagging each message. Unread counts are the other side's messages
+above the watermark; the unread_a/unread_b counters only cache whether there
+are any, so conversations with nothing unread are never counted. The contact
+lists read the summaries with one query instead of two per contact.
+"""
+
+from sqlalchemy import case, func, insert, select, union_all, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.models import ConversationSummary, DirectMessage
+
+S = ConversationSummary
+
+
+def pair(user_id: int, other_id: int) -> tuple:
+    """(user_a, user_b) of a conversation: the lower id first."""
+    return (user_id, other_id) if user_id <= other_id else (other_id, user_id)
+
+
+def _unread_column(reader_id: int, user_a: int):
+    return S.unread_a if reader_id == user_a else S.unread_b
+
+
+def _read_column(reader_id: int, user_a: int):
+    return S.read_a if reader_id == user_a else S.read_b
+
+
+def record_message(db: Session, msg: DirectMessage):
+    """Fold a flushed message into its conversation summary; the caller commits."""
+    a, b = pair(msg.sender_id, msg.receiver_id)
+    unread = _unread_column(msg.receiver_id, a)
+    last = {
+        "last_message_id": msg.id, "last_sender_id": msg.sender_id,
+        "last_preview": msg.content[:50] if msg.content else None,
+        "last_message_type": msg.message_type or "text",
+        "last_at": msg.created_at,
+    }
+    bump = update(S).where(S.user_a == a, S.user_b == b).values({**last, unread.key: unread + 1})
+    if db.execute(bump).rowcount:
+        return
+    try:
+        with db.begin_nested():
+            db.execute(insert(S).values({**last, "user_a": a, "user_b": b, "unread_a": 0, "unread_b": 0,
+                                         unread.key: 1}))
+    except IntegrityError:
+        # The other side's first message created the row meanwhile
+        db.execute(bump)
+
+
+def mark_read(db: Session, reader_id: int, other_id: int, upto: int = None) -> int | None:
+    """Move reader_id's watermark up to message upto (default: the last one); returns the new watermark.
+
+    Returns None and writes nothing when there is nothing unread below upto,
+    so polling an open conversation stays read-only. The caller commits.
+    """
+    a, b = pair(reader_id, other_id)
+    unread = _unread_column(reader_id, a)
+    read = _read_column(reader_id, a)
+    in_pair = (S.user_a == a) & (S.user_b == b)
+    if not db.execute(select(unread).where(in_pair)).scalar():
+        return None
+    if upto is None:
+        # Watermark and counter come from the same row version, so a message
+        # sent meanwhile is either below the watermark or still counted
+        moved = update(S).where(in_pair, unread != 0).values({read.key: S.last_message_id, unread.key: 0})
+    else:
+        # The counter only clears once the watermark reaches the last message
+        moved = update(S).where(in_pair, unread != 0, func.coalesce(read, 0) < upto).values({
+            read.key: upto, unread.key: case((S.last_message_id <= upto, 0), else_=unread),
+        })
+    if not db.execute(moved).rowcount:
+        return None
+    return db.execute(select(read).where(in_pair)).scalar()
+
+
+def watermarks(db: Session, user_id: int, other_id: int) -> dict:
+    """{user_id: watermark, other_id: watermark} of a conversation; None where nothing was read."""
+    a, b = pair(user_id, other_id)
+    row = db.execute(select(S.read_a, S.read_b).where(S.user_a == a, S.user_b == b)).first()
+    read_a, read_b = row if row else (None, None)
+    return {a: read_a, b: read_b}
+
+
+def _unread_count(me, other, counter, read):
+    """Messages from other to me above my watermark; 0 without a query when the counter says so."""
+    above = select(func.count()).select_from(DirectMessage).where(
+        DirectMessage.sender_id == other, DirectMessage.receiver_id == me,
+        DirectMessage.id > func.coalesce(read, 0),
+    ).scalar_subquery()
+    return case((counter == 0, 0), else_=above)
+
+
+def summaries_for(user_id: int):
+    """Subquery of user_id's conversations: other_id, last_preview, last_message_type, last_at, unread."""
+    def side(me, other, counter, read):
+        return select(other.label("other_id"), S.last_preview, S.last_message_type, S.last_at,
+                      _unread_count(me, other, counter, read).label("unread")).where(me == user_id)
+    return union_all(side(S.user_a, S.user_b, S.unread_a, S.read_a),
+                     side(S.user_b, S.user_a, S.unread_b, S.read_b)).subquery("conversations")
+
+
+def contact(user, summary) -> dict:
+    """Contact list entry for a row carrying user columns and a summaries_for() row (maybe all None)."""
+    return {
+        "id": user.id, "full_name": user.full_name, "role": user.role,
+        "grade": user.grade if user.role == "student" else None,
+        "last_message": summary.last_preview or summary.last_message_type,
+        "last_time": summary.last_at.isoformat() if summary.last_at else None,
+        "unread": summary.unread or 0,
+    }
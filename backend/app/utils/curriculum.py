@@ -0,0 +1,76 @@
+"""Module -> lesson tree for the student curriculum page, cached per grade.
+
+The tree is the same for every student who has unlocked the same grade, so it
+is built with one query and kept for CURRICULUM_CACHE_SECONDS; students only
+add their own completion flags (one more query). Teacher edits to modules and
+lessons call invalidate(). Other API processes notice those edits when their
+copy expires. Trees are built on the primary, so a lagging replica can't put
+a pre-edit tree back into the cache.
+"""
+
+import threading
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models.models import Module, Lesson, LessonProgress
+
+_lock = threading.Lock()
+_trees = {}  # max unlocked grade -> (built at, tree)
+_generation = 0  # bumped by invalidate(); a tree built across an edit is not kept
+
+
+def invalidate():
+    global _generation
+    with _lock:
+        _trees.clear()
+        _generation += 1
+
+
+async def _build(max_grade: int) -> list:
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(Module.id, Module.title, Module.order, Module.description,
+                   Lesson.id, Lesson.title, Lesson.order, func.coalesce(Lesson.grade, 6), Lesson.topic_id)
+            .join(Lesson, Lesson.module_id == Module.id)
+            .where(func.coalesce(Lesson.grade, 6) <= max_grade)
+            .order_by(Module.order, Module.id, Lesson.order, Lesson.id)
+        )).all()
+    tree, by_id = [], {}
+    for m_id, m_title, m_order, m_desc, l_id, l_title, l_order, l_grade, topic_id in rows:
+        module = by_id.get(m_id)
+        if module is None:
+            module = by_id[m_id] = {"id": m_id, "title": m_title, "order": m_order,
+                                    "description": m_desc, "lessons": []}
+            tree.append(module)
+        module["lessons"].append({"id": l_id, "title": l_title, "order": l_order,
+                                  "grade": l_grade, "topic_id": topic_id})
+    return tree
+
+
+async def tree(max_grade: int) -> list:
+    """Modules with their lessons up to max_grade; modules without such lessons are left out.
+
+    The result is shared: copy before changing it.
+    """
+    now = time.monotonic()
+    with _lock:
+        cached = _trees.get(max_grade)
+        generation = _generation
+    if cached and now - cached[0] < settings.CURRICULUM_CACHE_SECONDS:
+        return cached[1]
+    built = await _build(max_grade)
+    with _lock:
+        if generation == _generation:
+            _trees[max_grade] = (now, built)
+    return built
+
+
+async def completed_lessons(db: AsyncSession, user_id: int) -> set:
+    rows = await db.execute(select(LessonProgress.lesson_id).where(
+        LessonProgress.user_id == user_id, LessonProgress.completed == True
+    ))
+    return {lesson_id for (lesson_id,) in rows}
@@ -0,0 +1,297 @@
+"""Grade code submissions against a task's test cases, and test answers against their key."""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.models import User, CodeTask, CodeAttempt
+from app.utils import sandbox, grading_cache, preflight, perf, similarity, testcases
+from app.utils.scheduler import scheduler
+from app.utils.badges import check_and_award_badges
+
+SKIPPED_ERROR = "Skipped: an earlier test case failed"
+
+# Points for a perfect attempt; partial scores get a proportional share
+CODE_TASK_POINTS = 15
+TEST_POINTS = 20
+
+# Threads only dispatch cases; the sandbox pool bounds the actual processes
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, settings.GRADING_MAX_PARALLEL_CASES),
+                thread_name_prefix="grading",
+            )
+        return _executor
+
+
+def run_case(code: str, index: int, tc: dict, limits: dict = None) -> dict:
+    """Run one test case and build its result entry (as stored in CodeAttempt.results)."""
+    io = testcases.case_io(tc)
+    run = sandbox.run_code_safe(code, io["stdin"], limits, files=io["files"])
+    expected = io["expected"]
+    actual = run.stdout.strip() if run.stdout else ""
+    usage = run.usage or {}
+    # Blob-backed expected output was already compared by the worker
+    correct = run.matched if run.matched is not None else actual == expected
+    passed, error = run.ok and correct, run.stderr
+    entry = {
+        "case": index + 1,
+        "input": io["input"],
+        "expected": expected,
+        "actual": actual,
+        "passed": passed,
+        "error": error,
+        "cpu_time_ms": usage.get("cpu_time_ms"),
+        "peak_rss_kb": usage.get("peak_rss_kb"),
+        "wall_time_ms": usage.get("wall_time_ms"),
+    }
+    if tc.get("generated"):
+        cpu_limit = (limits or {}).get("cpu_limit_ms")
+        if passed and cpu_limit and (usage.get("cpu_time_ms") or 0) > cpu_limit:
+            entry["passed"] = False
+            entry["error"] = f"Time limit exceeded (CPU {usage['cpu_time_ms']:g} ms > {cpu_limit:g} ms)"
+        entry["generated"] = True
+    if tc.get("generated") or run.matched is not None:
+        entry["actual"] = perf.preview(actual)
+    return entry
+
+
+def _not_run(index: int, tc: dict, error: str) -> dict:
+    io = testcases.case_io(tc)
+    entry = {
+        "case": index + 1,
+        "input": io["input"],
+        "expected": io["expected"],
+        "actual": "",
+        "passed": False,
+        "error": error,
+    }
+    if tc.get("generated"):
+        entry["generated"] = True
+    return entry
+
+
+def _skipped(index: int, tc: dict) -> dict:
+    return _not_run(index, tc, SKIPPED_ERROR)
+
+
+def _run_sequential(code: str, test_cases: list, fail_fast: bool, on_result, limits) -> list:
+    results = []
+    for i, tc in enumerate(test_cases):
+        if fail_fast and results and not results[-1]["passed"]:
+            results.append(_skipped(i, tc))
+        else:
+            results.append(run_case(code, i, tc, limits))
+        if on_result:
+            on_result(results[-1])
+    return results
+
+
+def _run_parallel(code: str, test_cases: list, fail_fast: bool, on_result, limits) -> list:
+    executor = _get_executor()
+    futures = {executor.submit(run_case, code, i, tc, limits): i for i, tc in enumerate(test_cases)}
+    results = [None] * len(test_cases)
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        failed = False
+        for f in done:
+            r = results[futures[f]] = f.result()
+            failed = failed or not r["passed"]
+            if on_result:
+                on_result(r)
+        if fail_fast and failed:
+            # Cases already running finish on their own; queued ones never start
+            for f in pending:
+                f.cancel()
+            for f in pending:
+                i = futures[f]
+                r = results[i] = f.result() if not f.cancelled() else _skipped(i, test_cases[i])
+                if on_result:
+                    on_result(r)
+            break
+    return results
+
+
+def grade_cases(code: str, test_cases: list, parallel: bool = None, fail_fast: bool = False,
+                on_result=None, limits: dict = None) -> tuple:
+    """Run all cases and return (results, score), results in case order.
+
+    on_result(entry) is called as each case finishes, in completion order.
+    Code rejected by pre-flight fails every case without starting a sandbox.
+    """
+    verdict = preflight.check(code)
+    if not verdict.ok:
+        results = [_not_run(i, tc, verdict.error) for i, tc in enumerate(test_cases)]
+        if on_result:
+            for r in results:
+                on_result(r)
+        return results, 0
+
+    if parallel is None:
+        parallel = settings.GRADING_PARALLEL
+    if parallel and len(test_cases) > 1:
+        results = _run_parallel(code, test_cases, fail_fast, on_result, limits)
+    else:
+        results = _run_sequential(code, test_cases, fail_fast, on_result, limits)
+    return results, sum(1 for r in results if r["passed"])
+
+
+def grade_task(task: CodeTask, code: str, fail_fast: bool = False, on_result=None,
+               user_id: int = None, background: bool = False) -> tuple:
+    """grade_cases() for a task, served from the grading cache when possible.
+
+    Cache misses run under an execution slot; raises scheduler.Busy when the
+    wait queue is full (never for background jobs, which just wait).
+    """
+    cases = perf.task_cases(task)
+    limits = perf.run_limits(task)
+    key = grading_cache.submission_key(task.id, code, cases, limits)
+    cached = grading_cache.cache.get(key)
+    if cached is not None:
+        if on_result:
+            for r in cached:
+                on_result(r)
+        return cached, sum(1 for r in cached if r["passed"])
+
+    with scheduler.acquire(user_id, background=background):
+        start = time.monotonic()
+        results, score = grade_cases(code, cases, fail_fast=fail_fast,
+                                     on_result=on_result, limits=limits)
+        elapsed = time.monotonic() - start
+    skipped = any(r["error"] == SKIPPED_ERROR for r in results)
+    if not skipped and grading_cache.results_cacheable(code, results):
+        grading_cache.cache.put(key, results, elapsed, task_id=task.id)
+    return results, score
+
+
+def run_snippet(code: str, stdin_input: str, user_id: int = None) -> tuple:
+    """Run code once for /code/run, served from the grading cache when possible."""
+    key = grading_cache.run_key(code, stdin_input)
+    cached = grading_cache.cache.get(key)
+    if cached is not None:
+        return tuple(cached)
+
+    with scheduler.acquire(user_id):
+        start = time.monotonic()
+        run = sandbox.run_code_safe(code, stdin_input)
+        elapsed = time.monotonic() - start
+    if grading_cache.run_cacheable(code, run.stderr):
+        grading_cache.cache.put(key, [run.ok, run.stdout, run.stderr], elapsed)
+    return run.ok, run.stdout, run.stderr
+
+
+def stream_snippet(code: str, stdin_input: str, on_chunk, cancel: threading.Event,
+                   user_id: int = None) -> tuple:
+    """run_snippet() that hands output to on_chunk(stream, text) as it is printed.
+
+    Setting `cancel` kills the run at once, which also frees its execution slot.
+    """
+    key = grading_cache.run_key(code, stdin_input)
+    cached = grading_cache.cache.get(key)
+    if cached is not None:
+        passed, output, error = cached
+        if output:
+            on_chunk("stdout", output)
+        return passed, output, error
+
+    with scheduler.acquire(user_id):
+        if cancel.is_set():
+            return False, "", "Cancelled"
+        start = time.monotonic()
+        run = sandbox.run_code_safe(code, stdin_input, on_chunk=on_chunk, cancel=cancel)
+        elapsed = time.monotonic() - start
+    if not cancel.is_set() and grading_cache.run_cacheable(code, run.stderr):
+        grading_cache.cache.put(key, [run.ok, run.stdout, run.stderr], elapsed)
+    return run.ok, run.stdout, run.stderr
+
+
+def categorize_error_type(code: str, results: list, verdict: preflight.Verdict = None) -> str | None:
+    """Determine the dominant error type from submission results."""
+    if not results or all(r.get("passed") for r in results):
+        return None
+    if verdict is not None and verdict.error_type:
+        return verdict.error_type
+    failed = [r for r in results if not r.get("passed")]
+    errors = " ".join((r.get("error") or "") for r in failed).lower()
+
+    if "syntaxerror" in errors or "indentationerror" in errors:
+        return "syntax"
+    if "nameerror" in errors or "unboundlocalerror" in errors or "attributeerror" in errors:
+        return "variable"
+    if "timeout" in errors or "time limit" in errors:
+        return "loop"
+    if "typeerror" in errors or "valueerror" in errors:
+        return "io"
+    if "indexerror" in errors or "keyerror" in errors:
+        return "variable"
+
+    # Wrong answer — infer from code structure
+    c = code.lower()
+    if "for " in c or "while " in c:
+        return "loop"
+    if " if " in c or "\nif " in c or "elif " in c:
+        return "condition"
+    if "input(" in c or "print(" in c:
+        return "io"
+    return "logic"
+
+
+def award_points(score: float, max_score: float, weight: int) -> int:
+    return int(score / max_score * weight) if max_score else 0
+
+
+def score_test(questions: list, answers: dict) -> tuple:
+    """Score test answers ({str(question_id): answer}). Returns (score, wrong_answers)."""
+    score = 0
+    wrong = []
+    for q in questions:
+        student_answer = (answers or {}).get(str(q.id))
+        if student_answer == q.correct_answer:
+            score += 1
+        else:
+            wrong.append({
+                "question_id": q.id, "text": q.text,
+                "your_answer": student_answer,
+                "correct_answer": q.correct_answer,
+                "explanation": q.explanation,
+            })
+    return score, wrong
+
+
+def record_code_attempt(db: Session, user: User, task: CodeTask, code: str,
+                        results: list, score: int, commit: bool = True) -> CodeAttempt:
+    """Store a graded attempt, award points and badges.
+
+    With commit=False the attempt and points are only flushed: the caller
+    commits them with its own changes, then runs check_and_award_badges().
+    """
+    error_type = categorize_error_type(code, results, preflight.check(code))
+    user.points += award_points(score, len(results), CODE_TASK_POINTS)
+
+    attempt = CodeAttempt(
+        user_id=user.id, task_id=task.id,
+        code=code, score=score, max_score=len(results),
+        results=results, error_type=error_type,
+    )
+    db.add(attempt)
+    db.flush()
+    perf.record_best_runtime(db, user, task, attempt)
+    similarity.index_attempt(db, attempt)
+    if not commit:
+        return attempt
+    db.commit()
+    db.refresh(attempt)
+
+    check_and_award_badges(db, user)
+    return attempt
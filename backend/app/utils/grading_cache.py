@@ -0,0 +1,128 @@
+"""Content-addressed cache of sandbox outcomes.
+
+Submissions are keyed by (normalized code hash, test_cases hash) and hold the
+full per-case results; /code/run outcomes are keyed by (code hash, stdin hash).
+Both share one LRU with a size cap. Entries are per process.
+"""
+
+import copy
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from app.config import settings
+
+# Code whose output can change from run to run is never cached
+_NONDETERMINISTIC = re.compile(r"\b(random|time|datetime|secrets|uuid)\b")
+# Outcomes that depend on machine load rather than on the code
+_TRANSIENT_ERRORS = ("Time limit exceeded", "Sandbox error", "Killed by signal")
+
+
+def normalize_code(code: str) -> str:
+    return code.replace("\r\n", "\n").replace("\r", "\n").rstrip()
+
+
+def _digest(data: str) -> str:
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def code_hash(code: str) -> str:
+    return _digest(normalize_code(code))
+
+
+def cases_hash(test_cases: list) -> str:
+    return _digest(json.dumps(test_cases or [], sort_keys=True, ensure_ascii=False))
+
+
+def is_cacheable(code: str) -> bool:
+    return not _NONDETERMINISTIC.search(code)
+
+
+def _is_transient(error: str) -> bool:
+    return bool(error) and error.startswith(_TRANSIENT_ERRORS)
+
+
+class GradingCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (value, run_seconds)
+        self._by_task = {}              # task_id -> set of keys
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += entry[1]
+            return copy.deepcopy(entry[0])
+
+    def put(self, key, value, run_seconds: float, task_id: int = None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (copy.deepcopy(value), run_seconds)
+            self._entries.move_to_end(key)
+            if task_id is not None:
+                self._by_task.setdefault(task_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                if old_key[0] == "task":
+                    keys = self._by_task.get(old_key[1])
+                    if keys:
+                        keys.discard(old_key)
+
+    def invalidate_task(self, task_id: int) -> int:
+        with self._lock:
+            keys = self._by_task.pop(task_id, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_task.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "sandbox_seconds_saved": round(self.saved_seconds, 2),
+            }
+
+
+cache = GradingCache(settings.GRADING_CACHE_MAX_ENTRIES)
+
+
+def submission_key(task_id: int, code: str, test_cases: list, limits: dict = None) -> tuple:
+    limits_key = json.dumps(limits or {}, sort_keys=True)
+    return ("task", task_id, code_hash(code), cases_hash(test_cases), limits_key)
+
+
+def run_key(code: str, stdin_input: str) -> tuple:
+    return ("run", code_hash(code), _digest(stdin_input or ""))
+
+
+def results_cacheable(code: str, results: list) -> bool:
+    return is_cacheable(code) and not any(_is_transient(r.get("error") or "") for r in results)
+
+
+def run_cacheable(code: str, error: str) -> bool:
+    return is_cacheable(code) and not _is_transient(error or "")
@@ -0,0 +1,54 @@
+"""Keyset pages of direct and group message history.
+
+A page is at most `limit` messages, oldest first. Without a cursor it is the
+newest messages; before_id pages back from a message, after_id returns what
+came after one (delta sync). Cursors compare (created_at, id), so every page
+is a range scan of the (sender_id, receiver_id, created_at) or
+(grade, created_at) index, however long the history is.
+"""
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, joinedload
+
+from app.models.models import DirectMessage, GroupMessage
+
+MAX_PAGE = 200
+
+
+def _page(db: Session, model, scopes: list, before_id: int = None, after_id: int = None, limit: int = 50) -> list:
+    """Messages matching any of scopes (each one an index prefix), one query per scope."""
+    limit = min(max(limit, 1), MAX_PAGE)
+    newer = after_id is not None
+    cursor = after_id if newer else before_id
+    bounds = []
+    if cursor is not None:
+        at = db.query(model.created_at).filter(model.id == cursor).scalar()
+        if at is None:  # unknown cursor: ids still grow with time
+            bounds = [model.id > cursor if newer else model.id < cursor]
+        elif newer:
+            bounds = [model.created_at >= at, or_(model.created_at > at, model.id > cursor)]
+        else:
+            bounds = [model.created_at <= at, or_(model.created_at < at, model.id < cursor)]
+    order = (model.created_at, model.id) if newer else (model.created_at.desc(), model.id.desc())
+
+    rows = []
+    for scope in scopes:
+        rows += db.query(model).options(joinedload(model.sender)).filter(scope, *bounds) \
+            .order_by(*order).limit(limit).all()
+    rows.sort(key=lambda m: (m.created_at, m.id), reverse=not newer)
+    rows = rows[:limit]
+    return rows if newer else rows[::-1]
+
+
+def direct(db: Session, user_id: int, other_id: int, before_id: int = None, after_id: int = None,
+           limit: int = 50) -> list:
+    """A page of the conversation between two users."""
+    scopes = [and_(DirectMessage.sender_id == user_id, DirectMessage.receiver_id == other_id)]
+    if other_id != user_id:
+        scopes.append(and_(DirectMessage.sender_id == other_id, DirectMessage.receiver_id == user_id))
+    return _page(db, DirectMessage, scopes, before_id, after_id, limit)
+
+
+def group(db: Session, grade: str, before_id: int = None, after_id: int = None, limit: int = 50) -> list:
+    """A page of a grade's group chat."""
+    return _page(db, GroupMessage, [GroupMessage.grade == grade], before_id, after_id, limit)
@@ -0,0 +1,269 @@
+"""Live messenger events over a WebSocket, instead of polling the history endpoints.
+
+Each socket is subscribed to its user's channel; a student's socket also to the
+group chat of their grade, a teacher's to the one grade chat they have open.
+The HTTP endpoints publish after they commit: new direct and group messages,
+and read receipts when a conversation is marked read.
+
+Server -> client:
+    {"type": "direct", "message": {id, sender_id, receiver_id, sender_name, content, ...}}
+    {"type": "group", "grade", "message": {..., sender_role}}
+    {"type": "read", "reader_id", "other_id", "read_upto"}    reader_id has read other_id's messages up to id read_upto
+    {"type": "typing", "from_id", "from_name", "grade"}    grade is None in direct chats
+    {"type": "ping"}
+Client -> server:
+    {"type": "typing", "to": user_id} or {"type": "typing", "grade": grade}    students may omit grade;
+        "to" must be a contact: a classmate or a teacher for students, a student for teachers
+    {"type": "read", "with": user_id}    mark the conversation read, like opening it
+    {"type": "subscribe", "grade": grade}    teachers: switch the open grade chat
+    {"type": "pong"}
+
+The server pings every WS_HEARTBEAT_SECONDS; a client that has sent nothing
+(pongs included) for WS_IDLE_TIMEOUT_SECONDS is disconnected, and so is one
+that lets WS_OUTBOX_SIZE events pile up unsent. Channels live in the API
+process: with several worker processes a socket only receives events
+published by its own process.
+"""
+
+import asyncio
+import time
+
+from fastapi import WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.models import User
+from app.utils import conversations
+
+_CLOSE_IDLE = 4408
+_CLOSE_SLOW = 1013  # "try again later"
+
+
+def user_channel(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def grade_channel(grade: str) -> str:
+    return f"grade:{grade}"
+
+
+class _Connection:
+    def __init__(self, websocket: WebSocket, user):
+        self.websocket = websocket
+        self.user_id = user.id
+        self.name = user.full_name
+        self.role = user.role
+        self.grade = user.grade
+        # Events to send; an int in the queue is a close code
+        self.outbox = asyncio.Queue(settings.WS_OUTBOX_SIZE)
+        self.channels = set()
+        self.contacts = {}  # user id -> whether it is one of ours, looked up once
+        self.last_seen = time.monotonic()
+
+    def push(self, event) -> bool:
+        try:
+            self.outbox.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            # Too slow to keep up: drop what is queued and disconnect
+            while not self.outbox.empty():
+                self.outbox.get_nowait()
+            self.outbox.put_nowait(_CLOSE_SLOW)
+            return False
+
+
+class _Hub:
+    """Channel subscriptions. Only touched on the event loop; publish() may be called from any thread."""
+
+    def __init__(self):
+        self._channels = {}
+        self._loop = None
+        self.connections = 0  # open sockets, for /metrics
+
+    def join(self, conn: _Connection, channel: str):
+        self._channels.setdefault(channel, set()).add(conn)
+        conn.channels.add(channel)
+
+    def leave(self, conn: _Connection, channel: str = None):
+        for ch in [channel] if channel else list(conn.channels):
+            members = self._channels.get(ch)
+            if members is not None:
+                members.discard(conn)
+                if not members:
+                    del self._channels[ch]
+            conn.channels.discard(ch)
+
+    def attach(self, loop):
+        self._loop = loop
+
+    def publish(self, channel: str, event: dict, skip_user: int = None):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return  # nobody has connected yet
+        try:
+            loop.call_soon_threadsafe(self._deliver, channel, event, skip_user)
+        except RuntimeError:
+            pass  # loop shut down meanwhile
+
+    def _deliver(self, channel: str, event: dict, skip_user: int):
+        for conn in list(self._channels.get(channel, ())):
+            if conn.user_id != skip_user and not conn.push(event):
+                self.leave(conn)
+
+
+hub = _Hub()
+
+
+# ── Publishing (HTTP endpoints, after commit) ──────────
+
+def direct_message(msg, sender) -> dict:
+    """Event payload of a flushed DirectMessage; build it before commit expires msg."""
+    return {
+        "id": msg.id, "sender_id": msg.sender_id, "receiver_id": msg.receiver_id,
+        "sender_name": sender.full_name,
+        "content": msg.content, "message_type": msg.message_type or "text",
+        "file_url": msg.file_url,
+        "created_at": msg.created_at.isoformat() if msg.created_at else None,
+    }
+
+
+def group_message(msg, sender) -> dict:
+    """Event payload of a flushed GroupMessage."""
+    return {
+        "id": msg.id, "sender_id": msg.sender_id, "grade": msg.grade,
+        "sender_name": sender.full_name, "sender_role": sender.role,
+        "content": msg.content, "message_type": msg.message_type or "text",
+        "file_url": msg.file_url,
+        "created_at": msg.created_at.isoformat() if msg.created_at else None,
+    }
+
+
+def publish_direct(message: dict):
+    event = {"type": "direct", "message": message}
+    hub.publish(user_channel(message["receiver_id"]), event)
+    if message["sender_id"] != message["receiver_id"]:
+        hub.publish(user_channel(message["sender_id"]), event)  # the sender's other tabs
+
+
+def publish_group(message: dict):
+    hub.publish(grade_channel(message["grade"]), {"type": "group", "grade": message["grade"], "message": message})
+
+
+def publish_read(reader_id: int, other_id: int, read_upto: int):
+    event = {"type": "read", "reader_id": reader_id, "other_id": other_id, "read_upto": read_upto}
+    hub.publish(user_channel(other_id), event)
+    hub.publish(user_channel(reader_id), event)  # clears the badge in the reader's other tabs
+
+
+# ── Socket ─────────────────────────────────────────────
+
+def _mark_read(reader_id: int, other_id: int) -> int | None:
+    db = SessionLocal()
+    try:
+        upto = conversations.mark_read(db, reader_id, other_id)
+        db.commit()
+        return upto
+    finally:
+        db.close()
+
+
+def _user_role_grade(user_id: int):
+    db = SessionLocal()
+    try:
+        return db.query(User.role, User.grade).filter(User.id == user_id).first()
+    finally:
+        db.close()
+
+
+async def _is_contact(conn: _Connection, user_id: int) -> bool:
+    """The messenger contact rules: classmates and teachers for students, students for teachers."""
+    if user_id not in conn.contacts:
+        other = await run_in_threadpool(_user_role_grade, user_id)
+        if other is None:
+            ok = False
+        elif conn.role == "teacher":
+            ok = other.role == "student"
+        else:
+            ok = other.role == "teacher" or (
+                other.role == "student" and bool(conn.grade) and other.grade == conn.grade and user_id != conn.user_id)
+        conn.contacts[user_id] = ok
+    return conn.contacts[user_id]
+
+
+async def _handle(conn: _Connection, msg: dict):
+    kind = msg.get("type")
+    if kind == "typing":
+        event = {"type": "typing", "from_id": conn.user_id, "from_name": conn.name, "grade": None}
+        if isinstance(msg.get("to"), int):
+            if await _is_contact(conn, msg["to"]):
+                hub.publish(user_channel(msg["to"]), event)
+        else:
+            grade = msg.get("grade") or (conn.grade if conn.role == "student" else None)
+            if grade and grade_channel(grade) in conn.channels:
+                hub.publish(grade_channel(grade), dict(event, grade=grade), skip_user=conn.user_id)
+    elif kind == "read" and isinstance(msg.get("with"), int):
+        upto = await run_in_threadpool(_mark_read, conn.user_id, msg["with"])
+        if upto is not None:
+            publish_read(conn.user_id, msg["with"], upto)
+    elif kind == "subscribe" and conn.role == "teacher" and isinstance(msg.get("grade"), str):
+        for channel in [ch for ch in conn.channels if ch.startswith("grade:")]:
+            hub.leave(conn, channel)
+        if msg["grade"]:
+            hub.join(conn, grade_channel(msg["grade"]))
+
+
+async def _receive(conn: _Connection):
+    while True:
+        try:
+            msg = await conn.websocket.receive_json()
+        except (ValueError, KeyError):
+            continue
+        except (WebSocketDisconnect, RuntimeError):
+            # The client left, or _send already closed the socket (idle or slow client)
+            return
+        conn.last_seen = time.monotonic()
+        if isinstance(msg, dict):
+            await _handle(conn, msg)
+
+
+async def _send(conn: _Connection):
+    while True:
+        event = await conn.outbox.get()
+        if isinstance(event, int):
+            hub.leave(conn)
+            await conn.websocket.close(code=event)
+            return
+        await conn.websocket.send_json(event)
+
+
+async def _heartbeat(conn: _Connection):
+    while True:
+        await asyncio.sleep(settings.WS_HEARTBEAT_SECONDS)
+        if time.monotonic() - conn.last_seen > settings.WS_IDLE_TIMEOUT_SECONDS:
+            conn.push(_CLOSE_IDLE)
+            return
+        if not conn.push({"type": "ping"}):
+            return
+
+
+async def serve(websocket: WebSocket, user):
+    """Run a messenger socket for an authenticated user until either side closes it."""
+    await websocket.accept()
+    hub.attach(asyncio.get_running_loop())
+    conn = _Connection(websocket, user)
+    hub.connections += 1
+    hub.join(conn, user_channel(user.id))
+    if user.role == "student" and user.grade:
+        hub.join(conn, grade_channel(user.grade))
+
+    sender = asyncio.create_task(_send(conn))
+    heartbeat = asyncio.create_task(_heartbeat(conn))
+    try:
+        await _receive(conn)
+    finally:
+        hub.leave(conn)
+        hub.connections -= 1
+        sender.cancel()
+        heartbeat.cancel()
+        await asyncio.gather(sender, heartbeat, return_exceptions=True)
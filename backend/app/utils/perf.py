@@ -0,0 +1,151 @@
+"""Performance-judged code tasks.
+
+A task in "performance" mode keeps its normal test cases for correctness and
+adds large inputs produced by a teacher-written generator; the expected
+outputs come from the teacher's reference solution. Generated cases must also
+finish within the task's CPU-time limit, measured per run from the sandbox
+child's rusage. Each student's best fully-passing run lands in
+task_best_runtimes, which serves the "fastest solutions" leaderboard.
+"""
+
+import datetime
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
+
+from app.config import settings
+from app.models.models import User, CodeTask, CodeAttempt, TaskBestRuntime
+from app.utils import sandbox
+from app.utils.scheduler import scheduler
+
+PERFORMANCE = "performance"
+
+# Generated inputs can be megabytes; results only keep a preview
+_PREVIEW_CHARS = 200
+
+
+def is_performance(task: CodeTask) -> bool:
+    return task is not None and task.mode == PERFORMANCE
+
+
+def task_cases(task: CodeTask) -> list:
+    """Every case a submission is graded on: test cases, then generated ones."""
+    cases = list(task.test_cases or [])
+    if is_performance(task):
+        cases += [dict(tc, generated=True) for tc in task.generated_cases or []]
+    return cases
+
+
+def run_limits(task: CodeTask) -> dict:
+    """Sandbox limits for grading a task.
+
+    For performance tasks CPU time is the judge, so the wall-clock limit gets
+    headroom and a load spike on the server does not fail a fast solution.
+    """
+    limits = sandbox.limits_for(task)
+    if is_performance(task):
+        limits["cpu_limit_ms"] = limits["timeout"] * 1000
+        limits["timeout"] = limits["timeout"] * 2 + 1
+    return limits
+
+
+def preview(text: str) -> str:
+    if len(text) <= _PREVIEW_CHARS:
+        return text
+    return f"{text[:_PREVIEW_CHARS]}… ({len(text)} chars)"
+
+
+# ── Generated inputs ───────────────────────────────────
+
+def _generator_limits() -> dict:
+    return {
+        "timeout": settings.PERF_GENERATOR_TIMEOUT_SECONDS,
+        "memory_mb": max(settings.SANDBOX_MEMORY_LIMIT_MB, 512),
+        "output_kb": settings.PERF_INPUT_MAX_KB,
+    }
+
+
+def generate_cases(task: CodeTask, user_id: int) -> list:
+    """Run the generator and the reference solution to build the generated cases.
+
+    Each case takes an execution slot like a queued submission, on behalf of
+    user_id, so generation waits its turn instead of running beside the
+    scheduler's cap. Raises ValueError with a teacher-facing message when
+    either program fails.
+    """
+    if not task.input_generator or not task.reference_solution:
+        raise ValueError("Performance tasks need an input generator and a reference solution")
+
+    limits = _generator_limits()
+    count = task.generated_case_count or settings.PERF_GENERATED_CASES
+    cases = []
+    for i in range(count):
+        with scheduler.acquire(user_id, background=True):
+            gen = sandbox.run_code(task.input_generator, str(i + 1), limits)
+            ref = sandbox.run_code(task.reference_solution, gen.stdout, limits) if gen.ok else None
+        if not gen.ok:
+            raise ValueError(f"Input generator failed on case {i + 1}: {gen.stderr.strip()}")
+        if not ref.ok:
+            raise ValueError(f"Reference solution failed on case {i + 1}: {ref.stderr.strip()}")
+        cases.append({"input": gen.stdout, "expected_output": ref.stdout.strip()})
+    return cases
+
+
+# ── Best runtimes ──────────────────────────────────────
+
+def runtime_of(results: list) -> tuple:
+    """(total CPU ms, peak RSS KB) over the generated cases, or (None, None)."""
+    generated = [r for r in results if r.get("generated")]
+    if not generated or any(r.get("cpu_time_ms") is None for r in generated):
+        return None, None
+    cpu = round(sum(r["cpu_time_ms"] for r in generated), 1)
+    rss = max((r.get("peak_rss_kb") or 0) for r in generated) or None
+    return cpu, rss
+
+
+def record_best_runtime(db: Session, user: User, task: CodeTask, attempt: CodeAttempt):
+    """Keep the student's fastest fully-passing run. Caller commits."""
+    if not is_performance(task) or attempt.score < attempt.max_score:
+        return
+    cpu, rss = runtime_of(attempt.results or [])
+    if cpu is not None:
+        offer_best_runtime(db, task.id, user.id, attempt.id, cpu, rss)
+
+
+def offer_best_runtime(db: Session, task_id: int, user_id: int, attempt_id: int, cpu: float, rss):
+    best = _best_of(db, task_id, user_id)
+    if best is None:
+        try:
+            with db.begin_nested():
+                db.add(TaskBestRuntime(task_id=task_id, user_id=user_id, best_cpu_ms=cpu,
+                                       peak_rss_kb=rss, attempt_id=attempt_id))
+            return
+        except IntegrityError:
+            # A concurrent submission of the same student inserted it first
+            best = _best_of(db, task_id, user_id)
+    if cpu < best.best_cpu_ms:
+        best.best_cpu_ms = cpu
+        best.peak_rss_kb = rss
+        best.attempt_id = attempt_id
+        best.updated_at = datetime.datetime.utcnow()
+
+
+def _best_of(db: Session, task_id: int, user_id: int):
+    return db.query(TaskBestRuntime).filter(
+        TaskBestRuntime.task_id == task_id, TaskBestRuntime.user_id == user_id
+    ).first()
+
+
+def fastest(db: Session, task_id: int, limit: int = 10) -> list:
+    rows = db.query(TaskBestRuntime).options(joinedload(TaskBestRuntime.user))\
+        .filter(TaskBestRuntime.task_id == task_id)\
+        .order_by(TaskBestRuntime.best_cpu_ms, TaskBestRuntime.updated_at).limit(limit).all()
+    return [
+        {
+            "rank": i + 1, "user_id": r.user_id,
+            "full_name": r.user.full_name if r.user else None,
+            "cpu_time_ms": r.best_cpu_ms, "peak_rss_kb": r.peak_rss_kb,
+            "achieved_at": r.updated_at.isoformat() if r.updated_at else None,
+        }
+        for i, r in enumerate(rows)
+    ]
@@ -0,0 +1,71 @@
+"""Connection pool with checkout instrumentation.
+
+Counts how long requests wait for a connection, how many are in use, and how
+often the pool has to open overflow connections or gives up (pool timeout),
+so a burst that queues on the pool shows up in /api/teacher/metrics.
+"""
+
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+
+class InstrumentedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connections_opened = 0
+        self.overflow_events = 0
+        self.invalidated = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        event.listen(self, "connect", self._on_connect)
+        event.listen(self, "invalidate", self._on_invalidate)
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            conn = super().connect()
+        except PoolTimeout:
+            with self._lock:
+                self.timeouts += 1
+            raise
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connections_opened += 1
+            # overflow() counts connections beyond pool_size (negative while filling)
+            if self.overflow() > 0:
+                self.overflow_events += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidated += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pool_size": self.size(),
+                "max_overflow": self._max_overflow,
+                "in_use": self.checkedout(),
+                "idle": self.checkedin(),
+                "overflow": max(0, self.overflow()),
+                "checkouts": self.checkouts,
+                "avg_wait_ms": round(self._wait_total / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 2),
+                "timeouts": self.timeouts,
+                "connections_opened": self.connections_opened,
+                "overflow_events": self.overflow_events,
+                "invalidated": self.invalidated,
+            }
@@ -0,0 +1,171 @@
+"""Per-request query counting and N+1 detection.
+
+Engine events count every statement a request runs and the time spent in the
+database. The middleware reports both as X-DB-Queries / X-DB-Time-Ms response
+headers and adds them to per-route totals for /api/teacher/metrics. When one
+request runs the same statement QUERY_REPEAT_THRESHOLD times or more (one
+query per row of a list, usually), a warning names the route; in strict mode
+the statement that crosses the threshold raises NPlusOneError instead, so a
+test exercising the endpoint fails.
+
+Statements from background workers (no request around them) are not counted.
+"""
+
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import event
+
+from app.config import settings
+
+log = logging.getLogger(__name__)
+
+
+class NPlusOneError(RuntimeError):
+    pass
+
+
+class QueryStats:
+    """Queries of one request (or of a track() block)."""
+
+    def __init__(self, route: str = "", strict: bool = False, threshold: int = None):
+        self.route = route
+        self.strict = strict
+        self.threshold = threshold or settings.QUERY_REPEAT_THRESHOLD
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.queries += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+        if self.strict and self.statements[statement] == self.threshold:
+            raise NPlusOneError(f"{self.route or 'block'} ran the same statement {self.threshold} times: "
+                                f"{_short(statement)}")
+
+    def repeated(self) -> list:
+        """(statement, count) of statements run at least threshold times, most frequent first."""
+        return [(s, n) for s, n in self.statements.most_common() if n >= self.threshold]
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("query_stats", default=None)
+
+
+def _short(statement: str, limit: int = 200) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= limit else statement[:limit] + "..."
+
+
+@contextlib.contextmanager
+def track(route: str = "", strict: bool = None, threshold: int = None):
+    """Count the queries run inside the block, e.g. to assert on them in a test."""
+    stats = QueryStats(route, settings.QUERY_STRICT if strict is None else strict, threshold)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+# ── Engine events ──────────────────────────────────────
+
+# The start time lives on the statement's execution context, which goes away
+# with it: a statement that raises leaves nothing behind on the connection
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None and context is not None:
+        context._query_stats_start = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None:
+        return
+    start = getattr(context, "_query_stats_start", None)
+    stats.record(statement, time.perf_counter() - start if start is not None else 0.0)
+
+
+def instrument(engine):
+    """Count queries of a sync engine (for an AsyncEngine, pass its sync_engine)."""
+    event.listen(engine, "before_cursor_execute", _before_execute)
+    event.listen(engine, "after_cursor_execute", _after_execute)
+
+
+# ── Per-route totals ───────────────────────────────────
+
+class _RouteTotals:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def add(self, route: str, stats: QueryStats, n_plus_one: bool):
+        with self._lock:
+            r = self._routes.setdefault(route, {"requests": 0, "queries": 0, "db_ms": 0.0,
+                                                "max_queries": 0, "n_plus_one": 0})
+            r["requests"] += 1
+            r["queries"] += stats.queries
+            r["db_ms"] += stats.seconds * 1000
+            r["max_queries"] = max(r["max_queries"], stats.queries)
+            r["n_plus_one"] += n_plus_one
+
+    def stats(self, limit: int = 20) -> list:
+        with self._lock:
+            rows = [dict(r, route=route) for route, r in self._routes.items()]
+        rows.sort(key=lambda r: -r["queries"])
+        for r in rows:
+            r["avg_queries"] = round(r["queries"] / r["requests"], 1)
+            r["avg_db_ms"] = round(r["db_ms"] / r["requests"], 2)
+            r["db_ms"] = round(r["db_ms"], 1)
+        return rows[:limit]
+
+
+totals = _RouteTotals()
+
+
+def stats() -> list:
+    return totals.stats()
+
+
+# ── Middleware ─────────────────────────────────────────
+
+def _route_name(scope) -> str:
+    # The router stores the matched route in the scope; unmatched paths share one entry
+    route = scope.get("route")
+    return f"{scope['method']} {route.path if route is not None else '(no route)'}"
+
+
+class QueryStatsMiddleware:
+    """ASGI middleware: count each HTTP request's queries and report them."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.QUERY_STATS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        with track(scope["path"]) as stats:
+            async def send_with_headers(message):
+                if message["type"] == "http.response.start":
+                    stats.route = _route_name(scope)
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-db-queries", str(stats.queries).encode()))
+                    headers.append((b"x-db-time-ms", f"{stats.seconds * 1000:.1f}".encode()))
+                    message = dict(message, headers=headers)
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_headers)
+            finally:
+                stats.route = _route_name(scope)
+                repeated = stats.repeated()
+                for statement, count in repeated[:3]:
+                    log.warning("possible N+1 in %s: same statement ran %d times: %s",
+                                stats.route, count, _short(statement))
+                totals.add(stats.route, stats, bool(repeated))
@@ -0,0 +1,339 @@
+"""Batch regrading of stored attempts after a teacher edits a code task or test.
+
+A regrade job is a row in regrade_jobs. Worker threads claim jobs the same way
+the submission queue does, then walk the target's attempts in id order, one
+chunk per transaction: re-run the stored code (or re-score the stored test
+answers), bulk-update the changed attempts, apply the point differences to
+the students in one statement, and advance the job's cursor. A crashed job is
+picked up again from its cursor; editing the target again while a job runs
+supersedes it with a fresh one.
+
+Code is graded through grade_task() like a live submission, so it runs on the
+sandbox worker processes under the execution scheduler, as one background
+"user" that cannot crowd out students. Identical submissions (very common for
+short tasks) are graded once per job.
+"""
+
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import update, func, bindparam, or_
+from sqlalchemy.orm import undefer
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.models import (
+    User, CodeTask, CodeAttempt, Test, Question, TestAttempt, RegradeJob, TaskBestRuntime,
+)
+from app.utils import grading_cache, perf, preflight
+from app.utils.badges import check_and_award_badges
+from app.utils.grading import (
+    grade_task, score_test, award_points, categorize_error_type, CODE_TASK_POINTS, TEST_POINTS,
+)
+
+CODE_TASK = "code_task"
+TEST = "test"
+KINDS = (CODE_TASK, TEST)
+
+_POLL_SECONDS = 1.0
+
+_wakeup = threading.Event()
+_stop = threading.Event()
+_threads = []
+
+
+class _Superseded(Exception):
+    """The job was superseded or taken over by another worker."""
+
+
+def enqueue(db, kind: str, target_id: int, user: User = None) -> RegradeJob:
+    """Queue a regrade of every attempt on the target.
+
+    A job still queued for the same target is reused (it reads the target when
+    it starts); a running one is superseded, since it grades the old version.
+    """
+    queued = db.query(RegradeJob).filter(
+        RegradeJob.kind == kind, RegradeJob.target_id == target_id, RegradeJob.status == "queued"
+    ).order_by(RegradeJob.id).first()
+    if queued:
+        return queued
+
+    db.execute(
+        update(RegradeJob)
+        .where(RegradeJob.kind == kind, RegradeJob.target_id == target_id, RegradeJob.status == "running")
+        .values(status="superseded", finished_at=datetime.datetime.utcnow())
+    )
+    job = RegradeJob(kind=kind, target_id=target_id, status="queued",
+                     created_by=user.id if user else None)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    _wakeup.set()
+    return job
+
+
+def attempt_count(db, kind: str, target_id: int) -> int:
+    model, column = _attempts_of(kind)
+    return db.query(func.count(model.id)).filter(column == target_id).scalar()
+
+
+def job_status(job: RegradeJob) -> dict:
+    return {
+        "job_id": job.id, "kind": job.kind, "target_id": job.target_id, "status": job.status,
+        "total": job.total, "processed": job.processed,
+        "progress": round(job.processed / job.total, 3) if job.total else (1.0 if job.status == "done" else 0.0),
+        "changed": job.changed, "points_delta": job.points_delta, "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def _attempts_of(kind: str):
+    if kind == CODE_TASK:
+        return CodeAttempt, CodeAttempt.task_id
+    return TestAttempt, TestAttempt.test_id
+
+
+# ── Claiming ───────────────────────────────────────────
+
+def _claim_next(db) -> int | None:
+    """Atomically move the oldest queued job to running. Returns its id."""
+    while True:
+        job_id = db.query(RegradeJob.id).filter(RegradeJob.status == "queued")\
+            .order_by(RegradeJob.id).limit(1).scalar()
+        if job_id is None:
+            return None
+        now = datetime.datetime.utcnow()
+        claimed = db.execute(
+            update(RegradeJob)
+            .where(RegradeJob.id == job_id, RegradeJob.status == "queued")
+            .values(status="running", started_at=func.coalesce(RegradeJob.started_at, now), updated_at=now)
+        ).rowcount
+        db.commit()
+        if claimed:
+            return job_id
+
+
+def _requeue_stale(db):
+    """Jobs left running by a crashed process resume from their cursor."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=settings.REGRADE_JOB_STALE_SECONDS)
+    db.execute(
+        update(RegradeJob)
+        .where(RegradeJob.status == "running", RegradeJob.updated_at < cutoff)
+        .values(status="queued")
+    )
+    db.commit()
+
+
+# ── Processing ─────────────────────────────────────────
+
+def _snapshot(db, job: RegradeJob):
+    """Fix the set of attempts to regrade when the job first starts."""
+    if job.upto_id is not None:
+        return
+    model, column = _attempts_of(job.kind)
+    upto_id, total = db.query(func.max(model.id), func.count(model.id)).filter(column == job.target_id).one()
+    job.upto_id = upto_id or 0
+    job.total = total
+    db.commit()
+
+
+def _next_chunk(db, job: RegradeJob, *columns) -> list:
+    model, column = _attempts_of(job.kind)
+    return db.query(model.id, model.user_id, *columns).filter(
+        column == job.target_id, model.id > job.cursor, model.id <= job.upto_id
+    ).order_by(model.id).limit(max(1, settings.REGRADE_CHUNK_SIZE)).all()
+
+
+def _commit_chunk(db, job: RegradeJob, last_id: int, rows: list, changed: int, deltas: dict, apply):
+    """Write one chunk: claim the cursor step first, then the attempts and points."""
+    advanced = db.execute(
+        update(RegradeJob)
+        .where(RegradeJob.id == job.id, RegradeJob.status == "running", RegradeJob.cursor == job.cursor)
+        .values(cursor=last_id, processed=RegradeJob.processed + len(rows),
+                changed=RegradeJob.changed + changed,
+                points_delta=RegradeJob.points_delta + sum(deltas.values()),
+                updated_at=datetime.datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not advanced:
+        db.rollback()
+        raise _Superseded()
+
+    apply()
+    moved = [{"uid": uid, "delta": d} for uid, d in deltas.items() if d]
+    if moved:
+        users = User.__table__
+        db.execute(users.update().where(users.c.id == bindparam("uid"))
+                   .values(points=users.c.points + bindparam("delta")), moved)
+    db.commit()
+    db.refresh(job)
+
+    for uid, d in deltas.items():
+        if d > 0:
+            user = db.get(User, uid)
+            if user:
+                check_and_award_badges(db, user)
+
+
+def _regrade_code_task(db, job: RegradeJob):
+    task = db.query(CodeTask).options(undefer(CodeTask.test_cases), undefer(CodeTask.generated_cases))\
+        .filter(CodeTask.id == job.target_id).first()
+    if not task:
+        raise ValueError("Task not found")
+    # Grading threads read the task; keep it out of the session so commits don't expire it
+    perf.task_cases(task)
+    perf.run_limits(task)
+    db.expunge(task)
+
+    if perf.is_performance(task) and job.cursor == 0:
+        # Rebuilt below from the regraded attempts; rows from newer attempts stay
+        db.query(TaskBestRuntime).filter(
+            TaskBestRuntime.task_id == task.id,
+            or_(TaskBestRuntime.attempt_id.is_(None), TaskBestRuntime.attempt_id <= job.upto_id),
+        ).delete(synchronize_session=False)
+        db.commit()
+
+    memo = {}  # code hash -> (results, score), shared by identical submissions
+    runner = f"regrade:{job.id}"
+
+    def grade(code):
+        return grade_task(task, code, user_id=runner, background=True)
+
+    with ThreadPoolExecutor(max_workers=max(1, settings.REGRADE_PARALLEL_ATTEMPTS),
+                            thread_name_prefix=f"regrade-{job.id}") as executor:
+        while not _stop.is_set():
+            rows = _next_chunk(db, job, CodeAttempt.code, CodeAttempt.score, CodeAttempt.max_score)
+            if not rows:
+                return True
+
+            todo = {}
+            for r in rows:
+                h = grading_cache.code_hash(r.code)
+                if h not in memo and h not in todo:
+                    todo[h] = r.code
+            for h, outcome in zip(todo, executor.map(grade, todo.values())):
+                memo[h] = outcome
+
+            updates, deltas, best = [], {}, []
+            changed = 0
+            for r in rows:
+                results, score = memo[grading_cache.code_hash(r.code)]
+                max_score = len(results)
+                delta = (award_points(score, max_score, CODE_TASK_POINTS)
+                         - award_points(r.score or 0, r.max_score or 0, CODE_TASK_POINTS))
+                deltas[r.user_id] = deltas.get(r.user_id, 0) + delta
+                changed += (score, max_score) != (r.score, r.max_score)
+                updates.append({
+                    "id": r.id, "score": score, "max_score": max_score, "results": results,
+                    "error_type": categorize_error_type(r.code, results, preflight.check(r.code)),
+                })
+                if perf.is_performance(task) and score == max_score:
+                    cpu, rss = perf.runtime_of(results)
+                    if cpu is not None:
+                        best.append((r.user_id, r.id, cpu, rss))
+
+            def apply():
+                db.execute(update(CodeAttempt), updates)
+                for user_id, attempt_id, cpu, rss in best:
+                    perf.offer_best_runtime(db, task.id, user_id, attempt_id, cpu, rss)
+
+            _commit_chunk(db, job, rows[-1].id, rows, changed, deltas, apply)
+    return False
+
+
+def _regrade_test(db, job: RegradeJob):
+    test = db.query(Test).filter(Test.id == job.target_id).first()
+    if not test:
+        raise ValueError("Test not found")
+    questions = db.query(Question).filter(Question.test_id == test.id).order_by(Question.order, Question.id).all()
+    max_score = len(questions)
+
+    while not _stop.is_set():
+        rows = _next_chunk(db, job, TestAttempt.answers, TestAttempt.score, TestAttempt.max_score)
+        if not rows:
+            return True
+
+        updates, deltas = [], {}
+        changed = 0
+        for r in rows:
+            score, wrong = score_test(questions, r.answers)
+            delta = (award_points(score, max_score, TEST_POINTS)
+                     - award_points(r.score or 0, r.max_score or 0, TEST_POINTS))
+            deltas[r.user_id] = deltas.get(r.user_id, 0) + delta
+            changed += (score, max_score) != (r.score, r.max_score)
+            updates.append({"id": r.id, "score": score, "max_score": max_score, "wrong_answers": wrong})
+
+        _commit_chunk(db, job, rows[-1].id, rows, changed, deltas,
+                      lambda: db.execute(update(TestAttempt), updates))
+    return False
+
+
+def process_job(job_id: int):
+    db = SessionLocal()
+    try:
+        job = db.query(RegradeJob).filter(RegradeJob.id == job_id).first()
+        _snapshot(db, job)
+        run = _regrade_code_task if job.kind == CODE_TASK else _regrade_test
+        if run(db, job):
+            now = datetime.datetime.utcnow()
+            values = {"status": "done", "finished_at": now, "updated_at": now}
+        else:
+            # Shutting down: hand the job back so the next process resumes it
+            values = {"status": "queued"}
+        db.execute(update(RegradeJob)
+                   .where(RegradeJob.id == job_id, RegradeJob.status == "running").values(**values))
+        db.commit()
+    except _Superseded:
+        pass
+    except Exception as e:
+        db.rollback()
+        db.execute(
+            update(RegradeJob).where(RegradeJob.id == job_id, RegradeJob.status == "running")
+            .values(status="failed", error=str(e), finished_at=datetime.datetime.utcnow())
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _worker_loop():
+    while not _stop.is_set():
+        db = SessionLocal()
+        try:
+            job_id = _claim_next(db)
+        except Exception:
+            job_id = None
+        finally:
+            db.close()
+
+        if job_id is None:
+            _wakeup.wait(_POLL_SECONDS)
+            _wakeup.clear()
+            continue
+        process_job(job_id)
+
+
+def start_workers():
+    if _threads or settings.REGRADE_WORKERS <= 0:
+        return
+    db = SessionLocal()
+    try:
+        _requeue_stale(db)
+    finally:
+        db.close()
+    _stop.clear()
+    for i in range(settings.REGRADE_WORKERS):
+        t = threading.Thread(target=_worker_loop, name=f"regrade-worker-{i}", daemon=True)
+        t.start()
+        _threads.append(t)
+
+
+def stop_workers():
+    _stop.set()
+    _wakeup.set()
+    for t in _threads:
+        t.join(timeout=10)
+    _threads.clear()
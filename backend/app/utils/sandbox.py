@@ -0,0 +1,344 @@
+"""Code execution sandbox — warm worker pool with a cold-spawn fallback.
+
+Every job runs in its own forked child of a pre-started worker interpreter
+(see sandbox_worker.py), so a submission no longer pays Python startup per
+test case. Workers are recycled after SANDBOX_WORKER_MAX_JOBS jobs, and
+immediately after a crash or a timeout.
+
+The child runs under CPU-time, address-space and output-size limits, and
+every run reports its CPU time, peak RSS and wall time. Runs can stream
+their output as it is produced and be cancelled midway.
+"""
+
+import json
+import os
+import select
+import subprocess
+import tempfile
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from app.config import settings
+from app.utils import preflight
+
+PYTHON = "python3"
+DEFAULT_TIMEOUT = 5
+WORKER_SCRIPT = os.path.join(os.path.dirname(__file__), "sandbox_worker.py")
+
+# Extra time the pool waits for a worker's answer beyond the job's own limit
+_WORKER_GRACE = 2.0
+_CANCEL_POLL = 0.05  # how often a streamed run checks its cancel flag
+
+
+class WorkerError(Exception):
+    """The worker process died or stopped answering."""
+
+
+class RunResult(NamedTuple):
+    ok: bool
+    stdout: str
+    stderr: str
+    usage: Optional[dict] = None  # cpu_time_ms, peak_rss_kb, wall_time_ms
+    matched: Optional[bool] = None  # set when stdout was compared against an expected-output file
+
+
+def default_limits() -> dict:
+    return {
+        "timeout": settings.SANDBOX_TIME_LIMIT_SECONDS,
+        "memory_mb": settings.SANDBOX_MEMORY_LIMIT_MB,
+        "output_kb": settings.SANDBOX_OUTPUT_LIMIT_KB,
+    }
+
+
+def limits_for(task) -> dict:
+    """Per-task limits (CodeTask columns), falling back to the global defaults."""
+    limits = default_limits()
+    if task is not None:
+        if task.time_limit_seconds:
+            limits["timeout"] = task.time_limit_seconds
+        if task.memory_limit_mb:
+            limits["memory_mb"] = task.memory_limit_mb
+        if task.output_limit_kb:
+            limits["output_kb"] = task.output_limit_kb
+    return limits
+
+
+def _job(code: str, stdin_input: str, limits: dict, files: dict = None) -> dict:
+    timeout = limits.get("timeout") or DEFAULT_TIMEOUT
+    job = {
+        "code": code, "stdin": stdin_input, "timeout": timeout,
+        # CPU budget matches the wall limit; wall time still catches sleeping code
+        "cpu_seconds": max(1, int(timeout + 0.999)),
+        "memory_mb": limits.get("memory_mb"),
+        "output_bytes": (limits.get("output_kb") or 0) * 1024,
+    }
+    if files:
+        job.update((k, v) for k, v in files.items() if k in ("stdin_path", "expected_path") and v)
+    return job
+
+
+def _result(result: dict) -> RunResult:
+    return RunResult(result["ok"], result["stdout"], result["stderr"], result.get("usage"), result.get("matched"))
+
+
+class _Worker:
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            [PYTHON, WORKER_SCRIPT],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+        self.jobs = 0
+
+    def run(self, job: dict, on_chunk=None, cancel: threading.Event = None) -> dict:
+        """Send one job and wait for its result line.
+
+        With on_chunk the job is streamed: on_chunk(stream, text) is called for
+        every piece of output as it arrives. Setting `cancel` asks the worker
+        to kill the child right away.
+        """
+        self.jobs += 1
+        if on_chunk is not None:
+            job = dict(job, stream=True)
+        try:
+            self._send(job)
+        except OSError as e:
+            raise WorkerError(str(e))
+
+        # CPU-limited code can run past its wall limit until the hard rlimit hits
+        deadline = time.monotonic() + max(job["timeout"], job.get("cpu_seconds") or 0) + _WORKER_GRACE
+        fd = self.proc.stdout.fileno()
+        buf = b""
+        cancel_sent = False
+        while True:
+            while b"\n" in buf:
+                line, _, buf = buf.partition(b"\n")
+                message = json.loads(line)
+                if "chunk" not in message:
+                    return message
+                if on_chunk is not None:
+                    on_chunk(message["stream"], message["chunk"])
+
+            if cancel is not None and cancel.is_set() and not cancel_sent:
+                cancel_sent = True
+                try:
+                    self._send({"cancel": True})
+                except OSError as e:
+                    raise WorkerError(str(e))
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise WorkerError("worker did not answer")
+            wait = remaining if cancel is None or cancel_sent else min(remaining, _CANCEL_POLL)
+            ready, _, _ = select.select([fd], [], [], wait)
+            if ready:
+                data = os.read(fd, 65536)
+                if not data:
+                    raise WorkerError("worker exited")
+                buf += data
+
+    def _send(self, message: dict):
+        self.proc.stdin.write(json.dumps(message).encode() + b"\n")
+        self.proc.stdin.flush()
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        for pipe in (self.proc.stdin, self.proc.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+
+class SandboxPool:
+    """Fixed-size pool of warm sandbox workers, safe to share between threads."""
+
+    def __init__(self, size: int, max_jobs: int):
+        self.size = size
+        self.max_jobs = max_jobs
+        self._idle = []
+        self._total = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.stats = {"jobs": 0, "recycled": 0, "crashed": 0}
+
+    def start(self):
+        """Pre-start all workers so the first submissions are warm too."""
+        with self._cond:
+            while self._total < self.size:
+                self._idle.append(_Worker())
+                self._total += 1
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._total -= len(idle)
+            self._cond.notify_all()
+        for w in idle:
+            w.close()
+
+    def _acquire(self) -> _Worker:
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise WorkerError("sandbox pool is shut down")
+                if self._idle:
+                    return self._idle.pop()
+                if self._total < self.size:
+                    self._total += 1
+                    break
+                self._cond.wait()
+        try:
+            return _Worker()
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, worker: _Worker, healthy: bool):
+        recycle = not healthy or worker.jobs >= self.max_jobs
+        if recycle:
+            worker.close()
+            # Popen returns right away; the replacement warms up in the background
+            try:
+                worker = _Worker()
+            except Exception:
+                worker = None
+        with self._cond:
+            if recycle:
+                self.stats["recycled"] += 1
+            if worker is None or self._closed:
+                self._total -= 1
+                if worker is not None:
+                    worker.close()
+            else:
+                self._idle.append(worker)
+            self._cond.notify()
+
+    def run(self, code: str, stdin_input: str, limits: dict = None,
+            on_chunk=None, cancel: threading.Event = None, files: dict = None) -> RunResult:
+        worker = self._acquire()
+        healthy = False
+        try:
+            result = worker.run(_job(code, stdin_input, limits or default_limits(), files), on_chunk, cancel)
+            healthy = not result.get("timed_out")
+            return _result(result)
+        except WorkerError as e:
+            with self._cond:
+                self.stats["crashed"] += 1
+            return RunResult(False, "", f"Sandbox error: {e}")
+        finally:
+            with self._cond:
+                self.stats["jobs"] += 1
+            self._release(worker, healthy)
+
+
+def run_cold(code: str, stdin_input: str, limits: dict = None,
+             on_chunk=None, cancel: threading.Event = None, files: dict = None) -> RunResult:
+    """One interpreter per run: start a worker for a single job, then stop it."""
+    limits = limits or default_limits()
+    if hasattr(os, "fork"):
+        worker = _Worker()
+        try:
+            return _result(worker.run(_job(code, stdin_input, limits, files), on_chunk, cancel))
+        except WorkerError as e:
+            return RunResult(False, "", f"Sandbox error: {e}")
+        finally:
+            worker.close()
+    result = _run_plain(code, stdin_input, limits, files or {})
+    if on_chunk is not None:
+        # No streaming here: hand over the whole output at the end
+        for stream, text in (("stdout", result.stdout), ("stderr", result.stderr)):
+            if text:
+                on_chunk(stream, text)
+    return result
+
+
+def _run_plain(code: str, stdin_input: str, limits: dict, files: dict) -> RunResult:
+    """Platforms without fork/rlimits: plain subprocess, output trimmed afterwards."""
+    timeout = limits.get("timeout") or DEFAULT_TIMEOUT
+    if files.get("stdin_path"):
+        with open(files["stdin_path"], encoding="utf-8") as f:
+            stdin_input = f.read()
+    with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=False) as tmp:
+        tmp.write(code)
+        tmp_path = tmp.name
+
+    started = time.monotonic()
+    try:
+        result = subprocess.run(
+            [PYTHON, tmp_path],
+            input=stdin_input, capture_output=True, text=True, timeout=timeout,
+        )
+        cap = (limits.get("output_kb") or 0) * 1024 or None
+        usage = {"cpu_time_ms": None, "peak_rss_kb": None,
+                 "wall_time_ms": round((time.monotonic() - started) * 1000, 1)}
+        matched = None
+        if files.get("expected_path"):
+            with open(files["expected_path"], encoding="utf-8") as f:
+                matched = result.stdout.strip() == f.read().strip()
+        return RunResult(result.returncode == 0, result.stdout[:cap], result.stderr[:cap], usage, matched)
+    except subprocess.TimeoutExpired:
+        return RunResult(False, "", f"Time limit exceeded ({timeout:g}s)")
+    except Exception as e:
+        return RunResult(False, "", str(e))
+    finally:
+        os.unlink(tmp_path)
+
+
+# ── Shared pool ───────────────────────────────────────
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool_enabled() -> bool:
+    # Workers isolate jobs with fork(), which Windows does not have
+    return settings.SANDBOX_POOL_SIZE > 0 and hasattr(os, "fork")
+
+
+def get_pool() -> SandboxPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool(settings.SANDBOX_POOL_SIZE, settings.SANDBOX_WORKER_MAX_JOBS)
+        return _pool
+
+
+def start_pool():
+    if pool_enabled():
+        get_pool().start()
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def run_code(code: str, stdin_input: str, limits: dict = None,
+             on_chunk=None, cancel: threading.Event = None, files: dict = None) -> RunResult:
+    """Run code under the given limits (global defaults when omitted).
+
+    on_chunk(stream, text) receives output while the code runs; setting
+    `cancel` kills the run and returns what it printed so far. `files` may
+    hold stdin_path (read instead of stdin_input) and expected_path (stdout
+    is compared against it; see RunResult.matched).
+    """
+    if pool_enabled():
+        return get_pool().run(code, stdin_input, limits, on_chunk, cancel, files)
+    return run_cold(code, stdin_input, limits, on_chunk, cancel, files)
+
+
+def run_code_safe(code: str, stdin_input: str, limits: dict = None,
+                  on_chunk=None, cancel: threading.Event = None, files: dict = None) -> RunResult:
+    """Execute student code in the sandbox once it passes pre-flight."""
+    verdict = preflight.check(code)
+    if not verdict.ok:
+        return RunResult(False, "", verdict.error)
+    return run_code(code, stdin_input, limits, on_chunk, cancel, files)
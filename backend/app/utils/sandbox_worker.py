@@ -0,0 +1,347 @@
+"""Long-lived sandbox worker process.
+
+Started by app.utils.sandbox.SandboxPool and never imported by the API itself.
+Reads one JSON job per line on stdin, forks a fresh child for every job so
+student code never shares state with the worker or with other jobs, and
+answers with one JSON line on stdout.
+
+Jobs with "stream": true also get {"chunk", "stream"} lines while the child
+runs, and can be stopped early by sending {"cancel": true} on stdin.
+
+Large test cases arrive as file paths: "stdin_path" becomes the child's fd 0,
+and with "expected_path" stdout is compared against that file as it streams
+in, so neither side is ever held in memory whole.
+"""
+import codecs
+import io
+import json
+import linecache
+import os
+import resource
+import select
+import signal
+import sys
+import time
+import traceback
+
+FILENAME = "main.py"
+# stdout kept for display when it is compared against an expected-output file
+_PREVIEW_BYTES = 4096
+
+
+def _apply_limits(job: dict):
+    cpu = job.get("cpu_seconds")
+    if cpu:
+        # Soft limit sends SIGXCPU, hard limit one second later SIGKILL
+        resource.setrlimit(resource.RLIMIT_CPU, (int(cpu), int(cpu) + 1))
+    memory_mb = job.get("memory_mb")
+    if memory_mb:
+        limit = int(memory_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    # Student code has no business creating files
+    resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))
+
+
+def _exec_child(job: dict, out_w: int, err_w: int):
+    """Runs inside the forked child. Never returns."""
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    _apply_limits(job)
+
+    stdin_path = job.get("stdin_path")
+    stdin_fd = os.open(stdin_path or os.devnull, os.O_RDONLY)
+    os.dup2(stdin_fd, 0)
+    os.dup2(out_w, 1)
+    os.dup2(err_w, 2)
+    for fd in (stdin_fd, out_w, err_w):
+        os.close(fd)
+
+    if stdin_path:
+        sys.stdin = open(0, "r", encoding="utf-8", closefd=False)
+    else:
+        sys.stdin = io.StringIO(job.get("stdin") or "")
+    sys.stdout = open(1, "w", encoding="utf-8", closefd=False)
+    sys.stderr = open(2, "w", encoding="utf-8", closefd=False)
+    sys.argv = [FILENAME]
+
+    code = job.get("code") or ""
+    # Lets tracebacks show the offending source line, like a real script
+    linecache.cache[FILENAME] = (len(code), None, code.splitlines(True), FILENAME)
+
+    status = 0
+    try:
+        compiled = compile(code, FILENAME, "exec")
+        exec(compiled, {"__name__": "__main__", "__builtins__": __builtins__})
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except SyntaxError as e:
+        traceback.print_exception(type(e), e, None)
+        status = 1
+    except BaseException as e:
+        # Drop the worker's own frame so the traceback starts at student code
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        status = 1
+
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(status & 0xFF)
+
+
+class _Stripper:
+    """Streaming equivalent of bytes.strip() over a sequence of chunks."""
+
+    def __init__(self):
+        self.started = False
+        self.held = b""  # trailing whitespace, emitted only if more content follows
+
+    def feed(self, data: bytes) -> bytes:
+        if not self.started:
+            data = data.lstrip()
+            if not data:
+                return b""
+            self.started = True
+        data = self.held + data
+        body = data.rstrip()
+        self.held = data[len(body):]
+        return body
+
+
+class _Matcher:
+    """Compares stripped stdout against a stripped expected-output file, chunk by chunk."""
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        self.actual = _Stripper()
+        self.expected = _Stripper()
+        self.pending = b""  # stripped expected bytes not yet matched
+        self.eof = False
+        self.mismatch = False
+
+    def _want(self, n: int):
+        while len(self.pending) < n and not self.eof:
+            chunk = self.file.read(65536)
+            if not chunk:
+                self.eof = True
+            else:
+                self.pending += self.expected.feed(chunk)
+
+    def feed(self, data: bytes):
+        if self.mismatch:
+            return
+        data = self.actual.feed(data)
+        if not data:
+            return
+        self._want(len(data))
+        if self.pending[:len(data)] != data:
+            self.mismatch = True
+        self.pending = self.pending[len(data):]
+
+    def matched(self) -> bool:
+        self._want(1)
+        self.file.close()
+        return not self.mismatch and not self.pending
+
+
+def _kill(pid: int):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def _usage(rusage, wall: float) -> dict:
+    maxrss = rusage.ru_maxrss if rusage else 0
+    if sys.platform == "darwin":
+        maxrss //= 1024  # bytes there, kilobytes on Linux
+    return {
+        "cpu_time_ms": round((rusage.ru_utime + rusage.ru_stime) * 1000, 1) if rusage else None,
+        "peak_rss_kb": maxrss or None,
+        "wall_time_ms": round(wall * 1000, 1),
+    }
+
+
+class _Control:
+    """Unbuffered line reader for the protocol stdin, so select() sees every line."""
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.buf = b""
+        self.eof = False
+
+    def has_line(self) -> bool:
+        return b"\n" in self.buf
+
+    def fill(self):
+        data = os.read(self.fd, 65536)
+        if not data:
+            self.eof = True
+        self.buf += data
+
+    def readline(self) -> bytes:
+        while not self.has_line() and not self.eof:
+            self.fill()
+        line, sep, self.buf = self.buf.partition(b"\n")
+        return line + sep
+
+
+_control = _Control(0)
+
+
+def _emit(message: dict):
+    out = sys.stdout.buffer
+    out.write(json.dumps(message).encode() + b"\n")
+    out.flush()
+
+
+def _cancel_requested() -> bool:
+    """Consume control lines that arrived while a streamed job runs."""
+    if not _control.has_line():
+        _control.fill()
+    while _control.has_line():
+        try:
+            if json.loads(_control.readline()).get("cancel"):
+                return True
+        except ValueError:
+            pass
+    return _control.eof  # the pool went away; nobody is waiting for the result
+
+
+def run_job(job: dict) -> dict:
+    """Fork a child for one job, collect its output, exit status and resource usage."""
+    timeout = float(job.get("timeout") or 5)
+    output_limit = int(job.get("output_bytes") or 0)
+    stream = bool(job.get("stream"))
+    matcher = None
+    if job.get("expected_path"):
+        matcher = _Matcher(job["expected_path"])
+        # Nothing is retained, so only stop output that is clearly too long
+        output_limit = max(output_limit, os.path.getsize(job["expected_path"]) + 65536)
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+
+    started = time.monotonic()
+    pid = os.fork()
+    if pid == 0:
+        os.close(out_r)
+        os.close(err_r)
+        _exec_child(job, out_w, err_w)
+    os.close(out_w)
+    os.close(err_w)
+
+    deadline = started + timeout
+    chunks = {out_r: [], err_r: []}
+    names = {out_r: "stdout", err_r: "stderr"}
+    decoders = {fd: codecs.getincrementaldecoder("utf-8")("replace") for fd in names}
+    open_fds = [out_r, err_r]
+    control = [_control.fd] if stream else []
+    received = 0
+    timed_out = output_exceeded = cancelled = False
+    if stream and _control.has_line():
+        cancelled = _cancel_requested()
+
+    while open_fds and not cancelled:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            break
+        ready, _, _ = select.select(open_fds + control, [], [], remaining)
+        for fd in ready:
+            if fd in control:
+                cancelled = _cancel_requested()
+                if cancelled:
+                    break
+                continue
+            data = os.read(fd, 65536)
+            if not data:
+                open_fds.remove(fd)
+                continue
+            if output_limit and received + len(data) > output_limit:
+                # Keep what fits and stop reading: the child is killed below
+                data = data[:output_limit - received]
+                output_exceeded = True
+            received += len(data)
+            if matcher is not None and fd == out_r:
+                matcher.feed(data)
+                kept = sum(map(len, chunks[fd]))
+                if kept < _PREVIEW_BYTES:
+                    chunks[fd].append(data[:_PREVIEW_BYTES - kept])
+            else:
+                chunks[fd].append(data)
+            if stream and data:
+                _emit({"chunk": decoders[fd].decode(data), "stream": names[fd]})
+            if output_exceeded:
+                break
+        if output_exceeded or cancelled:
+            break
+
+    status = rusage = None
+    while not (timed_out or output_exceeded or cancelled):
+        done, status, rusage = os.wait4(pid, os.WNOHANG)
+        if done:
+            break
+        if time.monotonic() >= deadline:
+            timed_out = True
+            break
+        time.sleep(0.002)
+
+    if timed_out or output_exceeded or cancelled:
+        _kill(pid)
+        _, status, rusage = os.wait4(pid, 0)
+    wall = time.monotonic() - started
+    os.close(out_r)
+    os.close(err_r)
+
+    stdout = b"".join(chunks[out_r]).decode("utf-8", errors="replace")
+    stderr = b"".join(chunks[err_r]).decode("utf-8", errors="replace")
+    usage = _usage(rusage, wall)
+    matched = matcher.matched() if matcher is not None else None
+    if cancelled:
+        return {"ok": False, "stdout": stdout, "stderr": stderr + "Cancelled\n", "timed_out": False,
+                "cancelled": True, "usage": usage}
+    if timed_out:
+        return {"ok": False, "stdout": "", "stderr": f"Time limit exceeded ({timeout:g}s)",
+                "timed_out": True, "usage": usage}
+    if output_exceeded:
+        return {"ok": False, "stdout": stdout, "stderr": f"Output limit exceeded ({output_limit // 1024} KB)",
+                "timed_out": False, "usage": usage}
+
+    if os.WIFSIGNALED(status):
+        sig = os.WTERMSIG(status)
+        cpu = job.get("cpu_seconds")
+        if sig == signal.SIGXCPU or (sig == signal.SIGKILL and cpu and usage["cpu_time_ms"] >= cpu * 1000):
+            stderr = "Time limit exceeded (CPU time)"
+        else:
+            stderr += f"Killed by signal {sig}\n"
+        return {"ok": False, "stdout": stdout, "stderr": stderr, "timed_out": False, "usage": usage}
+    exit_code = os.waitstatus_to_exitcode(status)
+    return {"ok": exit_code == 0, "stdout": stdout, "stderr": stderr, "timed_out": False,
+            "matched": matched, "usage": usage}
+
+
+def main():
+    # The pool kills us explicitly; Ctrl+C in a dev server must not spew tracebacks here
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        line = _control.readline()
+        if not line:
+            break
+        job = json.loads(line)
+        if "cancel" in job:
+            continue  # arrived after its job had already finished
+        try:
+            result = run_job(job)
+        except Exception as e:
+            result = {"ok": False, "stdout": "", "stderr": str(e), "timed_out": False, "usage": None}
+        _emit(result)
+
+
+if __name__ == "__main__":
+    main()
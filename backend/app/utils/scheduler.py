@@ -0,0 +1,171 @@
+"""Admission control for code execution.
+
+One process-wide scheduler caps how many runs/submissions execute at once,
+keeps a bounded wait queue, hands free slots to waiting users round-robin
+(so one student clicking "Run" repeatedly can't starve the class), and
+rejects fast with a retry hint when the queue is full.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from app.config import settings
+
+
+class Busy(Exception):
+    """No slot and no room in the wait queue (or waited too long)."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server busy, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ("user_id", "granted", "enqueued_at")
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+class _Slot:
+    def __init__(self, scheduler, user_id):
+        self._scheduler = scheduler
+        self._user_id = user_id
+        self._started = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._scheduler._release(self._user_id, time.monotonic() - self._started)
+
+
+class ExecutionScheduler:
+    def __init__(self, capacity: int, max_queue: int, per_user: int, queue_timeout: float):
+        self.capacity = max(1, capacity)
+        self.max_queue = max_queue
+        self.per_user = max(1, per_user)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._running = 0
+        self._running_by_user = {}
+        self._waiting = OrderedDict()  # user_id -> deque of tickets, in round-robin order
+        self._queued = 0
+        # metrics
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_avg = 1.0  # EWMA of slot hold time, for the retry hint
+
+    def _can_run(self, user_id) -> bool:
+        return (self._running < self.capacity
+                and self._running_by_user.get(user_id, 0) < self.per_user)
+
+    def _grant(self, user_id):
+        self._running += 1
+        self._running_by_user[user_id] = self._running_by_user.get(user_id, 0) + 1
+        self.admitted += 1
+
+    def _dispatch(self):
+        """Hand free slots to waiting users, one ticket per user per round."""
+        progressed = True
+        while progressed and self._running < self.capacity and self._waiting:
+            progressed = False
+            for user_id in list(self._waiting):
+                if self._running >= self.capacity:
+                    break
+                if not self._can_run(user_id):
+                    continue
+                tickets = self._waiting[user_id]
+                ticket = tickets.popleft()
+                if tickets:
+                    self._waiting.move_to_end(user_id)
+                else:
+                    del self._waiting[user_id]
+                self._queued -= 1
+                ticket.granted = True
+                self._grant(user_id)
+                progressed = True
+        self._cond.notify_all()
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self._run_avg * (self._queued + 1) / self.capacity))
+
+    def _record_wait(self, waited: float):
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+    def acquire(self, user_id, background: bool = False) -> _Slot:
+        """Block until a slot is free and return it as a context manager.
+
+        Interactive callers get Busy when the queue is full or after
+        queue_timeout. Background callers (queued jobs) wait as long as needed.
+        """
+        with self._cond:
+            if not self._waiting and self._can_run(user_id):
+                self._grant(user_id)
+                self._record_wait(0.0)
+                return _Slot(self, user_id)
+
+            if not background and self._queued >= self.max_queue:
+                self.rejected += 1
+                raise Busy(self._retry_after())
+
+            ticket = _Ticket(user_id)
+            self._waiting.setdefault(user_id, deque()).append(ticket)
+            self._queued += 1
+            self._dispatch()
+
+            deadline = None if background else ticket.enqueued_at + self.queue_timeout
+            while not ticket.granted:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._waiting[user_id].remove(ticket)
+                    if not self._waiting[user_id]:
+                        del self._waiting[user_id]
+                    self._queued -= 1
+                    self.timed_out += 1
+                    raise Busy(self._retry_after())
+                self._cond.wait(remaining)
+
+            self._record_wait(time.monotonic() - ticket.enqueued_at)
+            return _Slot(self, user_id)
+
+    def _release(self, user_id, held: float):
+        with self._cond:
+            self._running -= 1
+            left = self._running_by_user.get(user_id, 1) - 1
+            if left:
+                self._running_by_user[user_id] = left
+            else:
+                self._running_by_user.pop(user_id, None)
+            self._run_avg = 0.8 * self._run_avg + 0.2 * held
+            self._dispatch()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "capacity": self.capacity,
+                "running": self._running,
+                "queue_depth": self._queued,
+                "max_queue": self.max_queue,
+                "waiting_users": len(self._waiting),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "avg_wait_ms": round(self._wait_total / self.admitted * 1000, 1) if self.admitted else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 1),
+                "avg_run_ms": round(self._run_avg * 1000, 1),
+            }
+
+
+scheduler = ExecutionScheduler(
+    settings.EXEC_MAX_CONCURRENT, settings.EXEC_MAX_QUEUE,
+    settings.EXEC_MAX_PER_USER, settings.EXEC_QUEUE_TIMEOUT_SECONDS,
+)
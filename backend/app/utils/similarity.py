@@ -0,0 +1,258 @@
+"""Near-duplicate detection for code submissions (MinHash + LSH).
+
+Each distinct submission is reduced to a token stream with identifiers,
+numbers and strings replaced by placeholders (so renaming variables does not
+hide a copy), cut into overlapping shingles and summarized by a MinHash
+signature. The signature is split into bands; submissions that agree on a
+whole band land in the same bucket of code_lsh_buckets.
+
+A new fingerprint is compared only with the other students' fingerprints in
+its own buckets, and pairs that look alike are kept in code_similar_pairs.
+Listing likely copies for a task then reads those pairs, instead of comparing
+every pair of attempts.
+"""
+
+import builtins
+import hashlib
+import io
+import keyword
+import random
+import re
+import threading
+import tokenize
+import zlib
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.models import User, CodeAttempt, CodeFingerprint, CodeLshBucket, CodeSimilarPair
+from app.utils import grading_cache
+
+SHINGLE_SIZE = 5
+BANDS = 16
+ROWS = 4  # BANDS * ROWS permutations; pairs from ~50% similarity become candidates
+_MIN_SHINGLES = 8  # shorter programs look alike no matter who wrote them
+MIN_THRESHOLD = 0.5  # pairs below this are not stored
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240501)  # fixed seed: signatures must be stable across restarts
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(BANDS * ROWS)]
+
+# Names that carry the program's structure are kept; everything else is renamed
+_KEPT_NAMES = set(keyword.kwlist) | set(dir(builtins))
+_SKIPPED = {tokenize.COMMENT, tokenize.NL, tokenize.ENCODING, tokenize.ENDMARKER}
+_FALLBACK_TOKEN = re.compile(r"[A-Za-z_]\w*|\d+(?:\.\d+)?|'[^']*'|\"[^\"]*\"|\S")
+
+
+# ── Signatures ─────────────────────────────────────────
+
+def _normalize(kind: int, text: str) -> str:
+    if kind == tokenize.NAME:
+        return text if text in _KEPT_NAMES else "V"
+    if kind == tokenize.NUMBER:
+        return "N"
+    if kind == tokenize.STRING:
+        return "S"
+    if kind in (tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT):
+        return tokenize.tok_name[kind]
+    return text
+
+
+def tokens(code: str) -> list:
+    try:
+        return [_normalize(t.type, t.string)
+                for t in tokenize.generate_tokens(io.StringIO(code).readline) if t.type not in _SKIPPED]
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        # Broken code is still worth comparing; fall back to a plain scanner
+        out = []
+        for word in _FALLBACK_TOKEN.findall(code):
+            if word[0].isdigit():
+                out.append("N")
+            elif word[0] in "'\"":
+                out.append("S")
+            elif word[0].isalpha() or word[0] == "_":
+                out.append(word if word in _KEPT_NAMES else "V")
+            else:
+                out.append(word)
+        return out
+
+
+def shingles(code: str) -> set:
+    toks = tokens(code)
+    return {zlib.crc32(" ".join(toks[i:i + SHINGLE_SIZE]).encode("utf-8"))
+            for i in range(len(toks) - SHINGLE_SIZE + 1)}
+
+
+def signature(hashes: set) -> list:
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def jaccard(sig_a: list, sig_b: list) -> float:
+    """Estimated Jaccard similarity of the two submissions' shingle sets."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+def _buckets(sig: list) -> list:
+    out = []
+    for band in range(BANDS):
+        rows = ",".join(map(str, sig[band * ROWS:(band + 1) * ROWS]))
+        out.append(int.from_bytes(hashlib.blake2b(rows.encode(), digest_size=8).digest(), "big", signed=True))
+    return out
+
+
+# ── Index ──────────────────────────────────────────────
+
+def index_attempt(db: Session, attempt: CodeAttempt) -> CodeFingerprint | None:
+    """Fingerprint a new attempt unless the student already sent the same code. Caller commits."""
+    code_hash = grading_cache.code_hash(attempt.code)
+    exists = db.query(CodeFingerprint.id).filter(
+        CodeFingerprint.task_id == attempt.task_id, CodeFingerprint.user_id == attempt.user_id,
+        CodeFingerprint.code_hash == code_hash,
+    ).first()
+    if exists:
+        return None
+    hashes = shingles(attempt.code)
+    if len(hashes) < _MIN_SHINGLES:
+        return None
+
+    sig = signature(hashes)
+    buckets = _buckets(sig)
+    fp = CodeFingerprint(task_id=attempt.task_id, user_id=attempt.user_id, attempt_id=attempt.id,
+                         code_hash=code_hash, signature=sig, shingle_count=len(hashes))
+    try:
+        with db.begin_nested():
+            db.add(fp)
+            db.flush()
+            _link_candidates(db, fp, buckets)
+            db.add_all([CodeLshBucket(task_id=fp.task_id, band=band, bucket=bucket,
+                                      fingerprint_id=fp.id, user_id=fp.user_id)
+                        for band, bucket in enumerate(buckets)])
+    except IntegrityError:
+        # A concurrent submission of the same code indexed it first
+        return None
+    return fp
+
+
+def _link_candidates(db: Session, fp: CodeFingerprint, buckets: list):
+    """Store pairs with other students' fingerprints that share a bucket with fp."""
+    lb = CodeLshBucket
+    # A student's versions of a solution tend to share buckets; cap the rows read per bucket
+    cap = settings.SIMILARITY_MAX_BUCKET_USERS * 10
+    others = {}
+    for band, bucket in enumerate(buckets):
+        rows = db.query(lb.fingerprint_id, lb.user_id).filter(
+            lb.task_id == fp.task_id, lb.band == band, lb.bucket == bucket,
+        ).limit(cap + 1).all()
+        members = {fp_id: user_id for fp_id, user_id in rows if user_id != fp.user_id}
+        # Buckets shared by very many students hold the textbook solution, not a copy
+        if len(rows) > cap or len(set(members.values())) >= settings.SIMILARITY_MAX_BUCKET_USERS:
+            continue
+        others.update(members)
+    if not others:
+        return
+
+    pairs = []
+    for other in db.query(CodeFingerprint.id, CodeFingerprint.signature)\
+            .filter(CodeFingerprint.id.in_(others)).all():
+        score = jaccard(fp.signature, other.signature)
+        if score >= MIN_THRESHOLD:
+            pairs.append(CodeSimilarPair(task_id=fp.task_id, fingerprint_a=other.id, fingerprint_b=fp.id,
+                                         user_a=others[other.id], user_b=fp.user_id,
+                                         similarity=round(score, 3)))
+    db.add_all(pairs)
+
+
+def drop_task(db: Session, task_id: int):
+    db.query(CodeSimilarPair).filter(CodeSimilarPair.task_id == task_id).delete(synchronize_session=False)
+    db.query(CodeLshBucket).filter(CodeLshBucket.task_id == task_id).delete(synchronize_session=False)
+    db.query(CodeFingerprint).filter(CodeFingerprint.task_id == task_id).delete(synchronize_session=False)
+
+
+def index_task(db: Session, task_id: int, chunk: int = 500) -> int:
+    """Fingerprint all stored attempts of a task, oldest first. Returns the number indexed."""
+    indexed, cursor = 0, 0
+    while True:
+        attempts = db.query(CodeAttempt).filter(CodeAttempt.task_id == task_id, CodeAttempt.id > cursor)\
+            .order_by(CodeAttempt.id).limit(chunk).all()
+        if not attempts:
+            return indexed
+        for a in attempts:
+            indexed += index_attempt(db, a) is not None
+        cursor = attempts[-1].id
+        db.commit()
+
+
+def index_missing():
+    """Index tasks that have attempts but no fingerprints (attempts made before this index existed)."""
+    db = SessionLocal()
+    try:
+        indexed = db.query(CodeFingerprint.task_id).distinct()
+        task_ids = [t for (t,) in db.query(CodeAttempt.task_id).distinct()
+                    .filter(CodeAttempt.task_id.notin_(indexed)).all()]
+        for task_id in task_ids:
+            index_task(db, task_id)
+    finally:
+        db.close()
+
+
+def start_backfill():
+    threading.Thread(target=index_missing, name="similarity-backfill", daemon=True).start()
+
+
+# ── Clusters ───────────────────────────────────────────
+
+def clusters(db: Session, task_id: int, threshold: float = None) -> list:
+    """Groups of students whose submissions to a task are likely copies of each other."""
+    threshold = settings.SIMILARITY_THRESHOLD if threshold is None else threshold
+    fa, fb = aliased(CodeFingerprint), aliased(CodeFingerprint)
+    rows = db.query(CodeSimilarPair.user_a, CodeSimilarPair.user_b, CodeSimilarPair.similarity,
+                    fa.attempt_id, fb.attempt_id)\
+        .join(fa, fa.id == CodeSimilarPair.fingerprint_a).join(fb, fb.id == CodeSimilarPair.fingerprint_b)\
+        .filter(CodeSimilarPair.task_id == task_id, CodeSimilarPair.similarity >= threshold).all()
+
+    # Closest pair of submissions for every pair of students
+    best = {}
+    for user_a, user_b, score, attempt_a, attempt_b in rows:
+        if user_a > user_b:
+            user_a, user_b, attempt_a, attempt_b = user_b, user_a, attempt_b, attempt_a
+        key = (user_a, user_b)
+        if key not in best or score > best[key]["similarity"]:
+            best[key] = {"user_ids": [user_a, user_b], "attempt_ids": [attempt_a, attempt_b],
+                         "similarity": score}
+    if not best:
+        return []
+
+    parent = {}
+
+    def find(u):
+        parent.setdefault(u, u)
+        while parent[u] != u:
+            parent[u] = parent[parent[u]]
+            u = parent[u]
+        return u
+
+    for ua, ub in best:
+        parent[find(ua)] = find(ub)
+    groups = {}
+    for pair in best.values():
+        groups.setdefault(find(pair["user_ids"][0]), []).append(pair)
+
+    user_ids = {u for key in best for u in key}
+    names = dict(db.query(User.id, User.full_name).filter(User.id.in_(user_ids)).all())
+    out = []
+    for pairs in groups.values():
+        members = sorted({u for p in pairs for u in p["user_ids"]})
+        out.append({
+            "students": [{"user_id": u, "full_name": names.get(u)} for u in members],
+            "max_similarity": max(p["similarity"] for p in pairs),
+            "pairs": sorted(pairs, key=lambda p: -p["similarity"]),
+        })
+    out.sort(key=lambda c: (-c["max_similarity"], -len(c["students"])))
+    return out
+
+
+def indexed_count(db: Session, task_id: int) -> int:
+    return db.query(func.count(CodeFingerprint.id)).filter(CodeFingerprint.task_id == task_id).scalar()
@@ -0,0 +1,163 @@
+"""SQLite production mode: WAL, connection pragmas and a single-writer queue.
+
+WAL lets readers run alongside the one writer instead of blocking it. SQLite
+still allows only one write transaction at a time, and writers that collide
+spin in SQLite's busy handler (sleep, retry, and eventually "database is
+locked"). Here every write transaction first takes a process-wide FIFO lock,
+so writers line up in arrival order and hold the database only while they
+actually write; reads never touch the lock. The lock is re-entrant per
+thread, so code that writes through a second session while its first one
+holds the lock doesn't wait on itself.
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event
+
+from app.config import settings
+
+# Statements that start (or belong to) a write transaction
+_WRITE = re.compile(r"^\s*(INSERT|UPDATE|DELETE|REPLACE|SAVEPOINT|CREATE|DROP|ALTER)\b", re.IGNORECASE)
+
+
+class WriterQueue:
+    """FIFO mutex for write transactions, re-entrant per thread, with wait-time counters."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._owner = None  # thread holding the lock
+        self._depth = 0     # connections of that thread holding it
+        self.acquired = 0
+        self.timed_out = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def acquire(self, timeout: float) -> bool:
+        start = time.monotonic()
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner == me:
+                self._depth += 1
+                return True
+            ticket = object()
+            self._waiting.append(ticket)
+            deadline = start + timeout
+            while self._owner is not None or self._waiting[0] is not ticket:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    self._cond.notify_all()
+                    self.timed_out += 1
+                    return False
+                self._cond.wait(remaining)
+            self._waiting.popleft()
+            self._owner, self._depth = me, 1
+            waited = time.monotonic() - start
+            self.acquired += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            return True
+
+    def release(self):
+        with self._cond:
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "writes": self.acquired,
+                "waiting": len(self._waiting),
+                "timed_out": self.timed_out,
+                "avg_wait_ms": round(self._wait_total / self.acquired * 1000, 2) if self.acquired else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 2),
+            }
+
+
+writer_queue = WriterQueue()
+_active = False
+
+
+class _QueuedConnection(sqlite3.Connection):
+    """sqlite3 connection that gives the writer lock back when its transaction ends."""
+
+    writer = None   # WriterQueue while this connection holds it
+    queue = writer_queue
+
+    def _release(self):
+        if self.writer is not None:
+            self.writer, queue = None, self.writer
+            queue.release()
+
+    def commit(self):
+        try:
+            super().commit()
+        finally:
+            self._release()
+
+    def rollback(self):
+        try:
+            super().rollback()
+        finally:
+            self._release()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._release()
+
+
+def connect_args() -> dict:
+    """Extra sqlite3.connect() arguments for production mode."""
+    args = {"timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000}
+    if settings.SQLITE_SINGLE_WRITER:
+        args["factory"] = _QueuedConnection
+    return args
+
+
+def _set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints; safe with WAL
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_SIZE_KB)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE_MB) * 1024 * 1024}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+
+def _queue_writes(conn, cursor, statement, parameters, context, executemany):
+    dbapi_connection = conn.connection.dbapi_connection
+    if dbapi_connection.writer is None and _WRITE.match(statement):
+        # Writing without the lock would break the single-writer guarantee
+        if not dbapi_connection.queue.acquire(settings.SQLITE_BUSY_TIMEOUT_MS / 1000):
+            raise sqlite3.OperationalError("database is locked (writer queue timeout)")
+        dbapi_connection.writer = dbapi_connection.queue
+
+
+def configure(engine):
+    """Apply production mode to a file-backed SQLite engine."""
+    global _active
+    event.listen(engine, "connect", _set_pragmas)
+    if settings.SQLITE_SINGLE_WRITER:
+        event.listen(engine, "before_cursor_execute", _queue_writes)
+        _active = True
+
+
+def configure_async(async_engine):
+    """Pragmas for the async engine; its writes are not queued (see app.database)."""
+    event.listen(async_engine.sync_engine, "connect", _set_pragmas)
+
+
+def stats() -> dict | None:
+    return writer_queue.stats() if _active else None
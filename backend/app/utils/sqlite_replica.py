@@ -0,0 +1,73 @@
+"""Local stand-in for replication: copy a SQLite primary into SQLite replicas.
+
+With SQLITE_REPLICA_SYNC_SECONDS > 0 and file-backed SQLite URLs for both
+DATABASE_URL and DATABASE_REPLICA_URLS, a thread copies the primary into every
+replica with SQLite's online backup API at that interval. Replica routing, and
+the lag that read-your-writes stickiness has to cover, can then be tried
+without a database server.
+"""
+
+import sqlite3
+import threading
+
+from sqlalchemy.engine import make_url
+
+from app.config import settings
+from app.database import engine, replica_urls
+
+_stop = threading.Event()
+_thread = None
+
+
+def _file(url) -> str | None:
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite" or not parsed.database or parsed.database == ":memory:":
+        return None
+    return parsed.database
+
+
+def targets() -> tuple:
+    """(primary file, replica files), or (None, []) when this setup can't be synced."""
+    primary = _file(engine.url)
+    replicas = [path for path in map(_file, replica_urls) if path]
+    if not primary or not replicas:
+        return None, []
+    return primary, replicas
+
+
+def sync_once(primary: str, replicas: list):
+    src = sqlite3.connect(primary, timeout=settings.SQLITE_BUSY_TIMEOUT_MS / 1000)
+    try:
+        for path in replicas:
+            dst = sqlite3.connect(path, timeout=settings.SQLITE_BUSY_TIMEOUT_MS / 1000)
+            try:
+                src.backup(dst)
+            finally:
+                dst.close()
+    finally:
+        src.close()
+
+
+def _loop(primary: str, replicas: list):
+    while not _stop.wait(settings.SQLITE_REPLICA_SYNC_SECONDS):
+        try:
+            sync_once(primary, replicas)
+        except sqlite3.Error:
+            pass  # e.g. a replica kept busy past the timeout; next round copies again
+
+
+def start():
+    global _thread
+    primary, replicas = targets()
+    if settings.SQLITE_REPLICA_SYNC_SECONDS <= 0 or not primary:
+        return
+    sync_once(primary, replicas)  # replicas need the schema before the first read
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, args=(primary, replicas), name="sqlite-replica-sync", daemon=True)
+    _thread.start()
+
+
+def stop():
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=5)
@@ -0,0 +1,194 @@
+"""Asynchronous code submissions backed by the submission_jobs table.
+
+The submit endpoint only inserts a queued row. Background worker threads claim
+rows with a conditional UPDATE (safe with several API processes on the same
+database), grade them, write per-case progress back to the row, and record the
+CodeAttempt and points in the same commit that marks the job done. Progress
+writes double as a heartbeat: only jobs nobody has touched for
+SUBMISSION_JOB_STALE_SECONDS are requeued.
+"""
+
+import datetime
+import threading
+
+from sqlalchemy import func, update
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.models import SubmissionJob, CodeTask, User
+from app.utils import testcases
+from app.utils.badges import check_and_award_badges
+from app.utils.grading import grade_task, record_code_attempt
+
+_POLL_SECONDS = 1.0
+
+_wakeup = threading.Event()
+_stop = threading.Event()
+_threads = []
+
+
+def enqueue(db, user: User, task: CodeTask, code: str, fail_fast: bool = False) -> SubmissionJob:
+    job = SubmissionJob(
+        user_id=user.id, task_id=task.id, code=code, fail_fast=fail_fast,
+        status="queued", cases_total=testcases.case_count(task), cases_done=0, results=[],
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    _wakeup.set()
+    return job
+
+
+def active_jobs(db, user_id: int) -> int:
+    return db.query(SubmissionJob).filter(
+        SubmissionJob.user_id == user_id, SubmissionJob.status.in_(("queued", "running"))
+    ).count()
+
+
+def job_status(job: SubmissionJob) -> dict:
+    a = job.attempt
+    return {
+        "job_id": job.id, "task_id": job.task_id, "status": job.status,
+        "cases_total": job.cases_total, "cases_done": job.cases_done,
+        "results": sorted(job.results or [], key=lambda r: r["case"]),
+        "attempt_id": job.attempt_id, "error": job.error,
+        # Same fields as the synchronous submit response once the job is done
+        "attempt": {
+            "id": a.id, "task_id": a.task_id, "code": a.code,
+            "score": a.score, "max_score": a.max_score,
+            "results": a.results, "error_type": a.error_type,
+            "created_at": a.created_at.isoformat() if a.created_at else None,
+        } if a else None,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def _claim_next(db) -> int | None:
+    """Atomically move the oldest queued job to running. Returns its id."""
+    while True:
+        job_id = db.query(SubmissionJob.id).filter(SubmissionJob.status == "queued")\
+            .order_by(SubmissionJob.id).limit(1).scalar()
+        if job_id is None:
+            return None
+        now = datetime.datetime.utcnow()
+        claimed = db.execute(
+            update(SubmissionJob)
+            .where(SubmissionJob.id == job_id, SubmissionJob.status == "queued")
+            .values(status="running", started_at=now, updated_at=now)
+        ).rowcount
+        db.commit()
+        if claimed:
+            return job_id
+        # another worker got it first — try the next one
+
+
+def _requeue_stale(db):
+    """Jobs left running by a crashed process go back to the queue.
+
+    A job is abandoned when its heartbeat is stale; one that already has its
+    attempt was recorded and is never graded again.
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=settings.SUBMISSION_JOB_STALE_SECONDS)
+    db.execute(
+        update(SubmissionJob)
+        .where(SubmissionJob.status == "running", SubmissionJob.attempt_id.is_(None),
+               func.coalesce(SubmissionJob.updated_at, SubmissionJob.started_at) < cutoff)
+        .values(status="queued", cases_done=0, results=[])
+    )
+    db.commit()
+
+
+def _save_progress(job_id: int, results: list):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(SubmissionJob).where(SubmissionJob.id == job_id)
+            .values(results=list(results), cases_done=len(results), updated_at=datetime.datetime.utcnow())
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def process_job(job_id: int):
+    db = SessionLocal()
+    try:
+        job = db.query(SubmissionJob).filter(SubmissionJob.id == job_id).first()
+        task = db.query(CodeTask).filter(CodeTask.id == job.task_id).first()
+        user = db.query(User).filter(User.id == job.user_id).first()
+        if not task or not user:
+            job.status, job.error = "failed", "Task not found"
+            job.finished_at = datetime.datetime.utcnow()
+            db.commit()
+            return
+
+        done = []
+        lock = threading.Lock()
+
+        def on_result(entry):
+            with lock:
+                done.append(entry)
+                _save_progress(job_id, done)
+
+        results, score = grade_task(task, job.code, fail_fast=job.fail_fast, on_result=on_result,
+                                    user_id=user.id, background=True)
+        # Attempt, points and the finished job in one commit: a crash can't
+        # leave a recorded attempt behind a job that gets requeued
+        attempt = record_code_attempt(db, user, task, job.code, results, score, commit=False)
+        job.status = "done"
+        job.results = results
+        job.cases_done = len(results)
+        job.attempt_id = attempt.id
+        job.finished_at = datetime.datetime.utcnow()
+        db.commit()
+        check_and_award_badges(db, user)
+    except Exception as e:
+        db.rollback()
+        db.execute(
+            update(SubmissionJob).where(SubmissionJob.id == job_id, SubmissionJob.status == "running")
+            .values(status="failed", error=str(e), finished_at=datetime.datetime.utcnow())
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _worker_loop():
+    while not _stop.is_set():
+        db = SessionLocal()
+        try:
+            job_id = _claim_next(db)
+        except Exception:
+            job_id = None
+        finally:
+            db.close()
+
+        if job_id is None:
+            _wakeup.wait(_POLL_SECONDS)
+            _wakeup.clear()
+            continue
+        process_job(job_id)
+
+
+def start_workers():
+    if _threads or settings.SUBMISSION_WORKERS <= 0:
+        return
+    db = SessionLocal()
+    try:
+        _requeue_stale(db)
+    finally:
+        db.close()
+    _stop.clear()
+    for i in range(settings.SUBMISSION_WORKERS):
+        t = threading.Thread(target=_worker_loop, name=f"submission-worker-{i}", daemon=True)
+        t.start()
+        _threads.append(t)
+
+
+def stop_workers():
+    _stop.set()
+    _wakeup.set()
+    for t in _threads:
+        t.join(timeout=10)
+    _threads.clear()
@@ -0,0 +1,128 @@
+"""Storage of CodeTask test-case payloads.
+
+Inputs and expected outputs above TESTCASE_INLINE_MAX_BYTES are moved out of
+the JSON columns into content-addressed files (named by SHA-256, so identical
+payloads are stored once). The row keeps a reference, the size and a short
+preview:
+
+    {"input_ref": {"sha256": "...", "size": 1048576}, "input_preview": "...",
+     "expected_output": "42"}
+
+The sandbox child reads a referenced input straight from its file, and the
+worker compares stdout against a referenced expected output as it streams.
+"""
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from sqlalchemy.orm import Session, undefer
+
+from app.config import settings
+from app.models.models import CodeTask
+from app.utils import perf
+
+_DEFAULT_DIR = Path(__file__).resolve().parent.parent.parent / "data" / "testcases"
+
+# (inline field, reference field, preview field)
+_FIELDS = (
+    ("input", "input_ref", "input_preview"),
+    ("expected_output", "expected_ref", "expected_preview"),
+)
+
+
+def blob_dir() -> Path:
+    return Path(settings.TESTCASE_BLOB_DIR) if settings.TESTCASE_BLOB_DIR else _DEFAULT_DIR
+
+
+def blob_path(ref: dict) -> str:
+    digest = ref["sha256"]
+    return str(blob_dir() / digest[:2] / digest)
+
+
+def put(text: str) -> dict:
+    data = text.encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    ref = {"sha256": digest, "size": len(data)}
+    path = Path(blob_path(ref))
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename, so a reader never sees a half-written blob
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+    return ref
+
+
+def externalize(case: dict) -> dict:
+    """Move oversized payloads of one case into blobs. Raises ValueError on a dangling ref."""
+    case = dict(case)
+    for field, ref_field, preview_field in _FIELDS:
+        value = case.get(field)
+        if isinstance(value, str) and len(value.encode("utf-8")) > settings.TESTCASE_INLINE_MAX_BYTES:
+            case[ref_field] = put(value)
+            case[preview_field] = perf.preview(value)
+            del case[field]
+        elif field not in case and ref_field in case:
+            if not os.path.exists(blob_path(case[ref_field])):
+                raise ValueError(f"Test case data {case[ref_field]['sha256'][:12]} is missing")
+    return case
+
+
+def externalize_cases(cases: list) -> list:
+    return [externalize(tc) for tc in cases or []]
+
+
+def case_io(case: dict) -> dict:
+    """What the runner needs for one case, plus the short forms shown in results."""
+    io = {"stdin": case.get("input", ""), "files": {},
+          "input": case.get("input_preview", case.get("input", "")),
+          "expected": case.get("expected_preview", case.get("expected_output", "")).strip()}
+    if "input_ref" in case:
+        io["stdin"] = ""
+        io["files"]["stdin_path"] = blob_path(case["input_ref"])
+    if "expected_ref" in case:
+        io["files"]["expected_path"] = blob_path(case["expected_ref"])
+    return io
+
+
+def summary(case: dict) -> dict:
+    """Size and preview of a case, for listings that must not ship the payload."""
+    size = case["input_ref"]["size"] if "input_ref" in case else len(case.get("input", "").encode("utf-8"))
+    return {"input_bytes": size,
+            "expected": case.get("expected_preview", perf.preview(case.get("expected_output", "")))}
+
+
+# ── Task rows ──────────────────────────────────────────
+
+def store(task: CodeTask):
+    """Externalize the task's cases and refresh its case count before saving."""
+    task.test_cases = externalize_cases(task.test_cases)
+    if task.generated_cases:
+        task.generated_cases = externalize_cases(task.generated_cases)
+    task.case_count = len(perf.task_cases(task))
+
+
+def case_count(task: CodeTask) -> int:
+    # Rows saved before case_count existed fall back to loading the cases
+    if task.case_count is not None:
+        return task.case_count
+    return len(perf.task_cases(task))
+
+
+def migrate_inline_cases(db: Session):
+    """Move large inline payloads of existing tasks into blobs (idempotent)."""
+    tasks = db.query(CodeTask).options(undefer(CodeTask.test_cases), undefer(CodeTask.generated_cases)).all()
+    for task in tasks:
+        before = (task.test_cases, task.generated_cases, task.case_count)
+        store(task)
+        if (task.test_cases, task.generated_cases, task.case_count) == before:
+            db.expire(task)
+    db.commit()
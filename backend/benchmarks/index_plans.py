@@ -0,0 +1,193 @@
+"""Benchmark: per-user lookups with and without the composite indexes.
+
+Fills a fresh SQLite database with a synthetic school (students across six
+grades, lesson progress, direct messages, chat history), then calls the
+list_modules, messenger_contacts and chat endpoints for one student. The run
+is repeated after migration 3 creates the indexes; for every distinct
+statement the endpoints issued, the SQLite query plan is printed.
+
+Usage (from backend/):
+    python benchmarks/index_plans.py [--students 1800] [--messages 150000] [--chat 200000]
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The endpoints use the app's engines (and caches); point them at a scratch database
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from sqlalchemy import event, insert, text  # noqa: E402
+from sqlalchemy.ext.asyncio import async_sessionmaker  # noqa: E402
+
+from app import migrations  # noqa: E402
+from app.database import Base, engine, async_engine  # noqa: E402
+from app.models.models import (  # noqa: E402
+    User, Module, Lesson, LessonProgress, ChatMessage, DirectMessage, GroupMessage,
+)
+from app.routers import student  # noqa: E402
+from app.utils import curriculum  # noqa: E402
+from app.schemas.schemas import ChatSend  # noqa: E402
+
+GRADES = ["6A", "7A", "8A", "9A", "10A", "11A"]
+TEACHERS = 20
+MODULES = 12
+LESSONS_PER_MODULE = 20
+BATCH = 5000
+
+
+def _bulk(conn, model, rows):
+    for i in range(0, len(rows), BATCH):
+        conn.execute(insert(model), rows[i:i + BATCH])
+
+
+def _seed(engine, students: int, messages: int, chat: int):
+    rng = random.Random(7)
+    now = datetime.datetime(2024, 9, 1)
+    with engine.begin() as conn:
+        users = [{"username": f"t{i}", "hashed_password": "x", "full_name": f"Teacher {i}", "role": "teacher"}
+                 for i in range(TEACHERS)]
+        users += [{"username": f"s{i}", "hashed_password": "x", "full_name": f"Student {i}",
+                   "role": "student", "grade": GRADES[i % len(GRADES)], "max_unlocked_grade": 11}
+                  for i in range(students)]
+        _bulk(conn, User, users)
+        teacher_ids = list(range(1, TEACHERS + 1))
+        by_grade = {g: [] for g in GRADES}
+        for i in range(students):
+            by_grade[GRADES[i % len(GRADES)]].append(TEACHERS + 1 + i)
+
+        _bulk(conn, Module, [{"title": f"Module {m}", "order": m} for m in range(MODULES)])
+        lessons = [{"module_id": m + 1, "title": f"Lesson {m}.{k}", "order": k, "grade": 6 + k % 6}
+                   for m in range(MODULES) for k in range(LESSONS_PER_MODULE)]
+        _bulk(conn, Lesson, lessons)
+        lesson_ids = list(range(1, len(lessons) + 1))
+
+        progress = []
+        for uid in range(TEACHERS + 1, TEACHERS + students + 1):
+            for lid in rng.sample(lesson_ids, len(lesson_ids) // 3):
+                progress.append({"user_id": uid, "lesson_id": lid, "completed": rng.random() < 0.7,
+                                 "time_spent_seconds": 60, "last_opened": now})
+        _bulk(conn, LessonProgress, progress)
+
+        dms = []
+        for n in range(messages):
+            grade = GRADES[n % len(GRADES)]
+            sender = rng.choice(by_grade[grade])
+            receiver = rng.choice(teacher_ids) if rng.random() < 0.1 else rng.choice(by_grade[grade])
+            if rng.random() < 0.5:
+                sender, receiver = receiver, sender
+            dms.append({"sender_id": sender, "receiver_id": receiver, "content": "hi there",
+                        "message_type": "text", "is_read": rng.random() < 0.8,
+                        "created_at": now + datetime.timedelta(seconds=n)})
+        _bulk(conn, DirectMessage, dms)
+        migrations._conversation_summaries(conn)
+        migrations._read_watermarks(conn)
+
+        _bulk(conn, GroupMessage, [{"sender_id": rng.choice(by_grade[GRADES[n % 6]]), "grade": GRADES[n % 6],
+                                    "content": "hello class", "created_at": now + datetime.timedelta(seconds=n)}
+                                   for n in range(messages // 4)])
+        _bulk(conn, ChatMessage, [{"user_id": TEACHERS + 1 + rng.randrange(students),
+                                   "role": "user" if n % 2 else "assistant", "content": "what is a loop?",
+                                   "created_at": now + datetime.timedelta(seconds=n)}
+                                  for n in range(chat)])
+    return by_grade[GRADES[0]][0]
+
+
+def _capture(engine):
+    seen = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and statement not in seen:
+            seen[statement] = parameters
+    event.listen(engine, "before_cursor_execute", record)
+    return seen, lambda: event.remove(engine, "before_cursor_execute", record)
+
+
+def _calls(Session, user_id: int):
+    def run(fn):
+        async def call():
+            async with Session() as db:
+                user = await db.get(User, user_id)
+                await fn(user, db)
+        return call
+    return {
+        "list_modules": run(lambda user, db: student.list_modules(db=db, user=user)),
+        "messenger_contacts": run(lambda user, db: student.messenger_contacts(user=user, db=db)),
+        "chat": run(lambda user, db: student.chat(ChatSend(message="what is a loop?"), user=user, db=db)),
+    }
+
+
+def _phase(engine, async_engine, loop, user_id: int, repeat: int) -> dict:
+    Session = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    out = {}
+    curriculum.invalidate()
+    for name, call in _calls(Session, user_id).items():
+        seen, stop = _capture(async_engine.sync_engine)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            loop.run_until_complete(call())
+            times.append(time.perf_counter() - start)
+        stop()
+        plans = []
+        with engine.connect() as conn:
+            for statement, params in seen.items():
+                rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, params).fetchall()
+                plans.append((" ".join(statement.split())[:110], [r[-1] for r in rows]))
+        out[name] = (sorted(times)[len(times) // 2], plans)
+    return out
+
+
+def _report(title: str, results: dict):
+    print(f"\n== {title} ==")
+    for name, (median, plans) in results.items():
+        print(f"{name}: median {median * 1000:.1f} ms")
+        for statement, plan in plans:
+            print(f"  {statement}")
+            for line in plan:
+                print(f"    -> {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=1800)
+    parser.add_argument("--messages", type=int, default=150000, help="direct messages")
+    parser.add_argument("--chat", type=int, default=200000, help="AI chat messages")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for name in migrations._HOT_LOOKUP_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    start = time.perf_counter()
+    user_id = _seed(engine, args.students, args.messages, args.chat)
+    print(f"seeded {args.students} students, {args.messages} direct messages, {args.chat} chat messages "
+          f"in {time.perf_counter() - start:.1f}s")
+    # The endpoints are async handlers
+    loop = asyncio.new_event_loop()
+
+    before = _phase(engine, async_engine, loop, user_id, args.repeat)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        migrations.create_model_indexes(conn, migrations._HOT_LOOKUP_INDEXES)
+        conn.execute(text("ANALYZE"))
+    after = _phase(engine, async_engine, loop, user_id, args.repeat)
+
+    _report("without composite indexes", before)
+    _report("with composite indexes", after)
+    print("\nsummary")
+    for name in before:
+        b, a = before[name][0] * 1000, after[name][0] * 1000
+        print(f"  {name:20s} {b:9.1f} ms -> {a:7.1f} ms  ({b / a:.0f}x)")
+    loop.run_until_complete(async_engine.dispose())
+    loop.close()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Benchmark: cold python3 spawn vs. the warm sandbox pool.
+
+Usage (from backend/):
+    python benchmarks/sandbox_pool.py [--runs 200] [--threads 4] [--pool-size 4]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.sandbox import SandboxPool, run_cold  # noqa: E402
+
+CODE = "n = int(input())\nprint(sum(range(n)))\n"
+STDIN = "1000\n"
+
+
+def _measure(fn, runs: int, threads: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        results = list(ex.map(lambda _: fn(CODE, STDIN), range(runs)))
+    elapsed = time.perf_counter() - start
+    assert all(r.ok and r.stdout.strip() == "499500" for r in results), results[:3]
+    return runs / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--pool-size", type=int, default=4)
+    args = parser.parse_args()
+
+    cold = _measure(run_cold, args.runs, args.threads)
+    print(f"cold spawn : {cold:8.1f} runs/s")
+
+    pool = SandboxPool(args.pool_size, max_jobs=10_000)
+    pool.start()
+    try:
+        pooled = _measure(pool.run, args.runs, args.threads)
+    finally:
+        pool.shutdown()
+    print(f"warm pool  : {pooled:8.1f} runs/s  ({pooled / cold:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
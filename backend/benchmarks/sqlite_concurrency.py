@@ -0,0 +1,135 @@
+"""Benchmark: default SQLite engine vs. production mode (WAL, pragmas, writer queue).
+
+Threads mix reads (a student's recent messages) with writes (send a message
+and award points, as lesson/test/message endpoints do), each on its own
+session, against a fresh database file per mode.
+
+Usage (from backend/):
+    python benchmarks/sqlite_concurrency.py [--threads 16] [--ops 300] [--write-ratio 0.3]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, update  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app.database import Base  # noqa: E402
+from app.models.models import User, DirectMessage  # noqa: E402
+from app.utils import sqlite_mode  # noqa: E402
+
+USERS = 50
+
+
+def _engine(path: str, production: bool):
+    connect_args = {"check_same_thread": False}
+    if production:
+        connect_args.update(sqlite_mode.connect_args())
+    engine = create_engine(f"sqlite:///{path}", connect_args=connect_args, pool_size=32, max_overflow=0)
+    if production:
+        sqlite_mode.configure(engine)
+    return engine
+
+
+def _seed(Session):
+    db = Session()
+    db.add_all([User(username=f"u{i}", hashed_password="x", full_name=f"User {i}") for i in range(USERS)])
+    db.commit()
+    db.close()
+
+
+def _read(db, uid: int):
+    db.query(DirectMessage).filter(DirectMessage.receiver_id == uid)\
+        .order_by(DirectMessage.id.desc()).limit(20).all()
+    db.query(User).filter(User.id == uid).first()
+
+
+def _write(db, uid: int):
+    other = random.randint(1, USERS)
+    db.query(User).filter(User.id == uid).first()
+    db.add(DirectMessage(sender_id=uid, receiver_id=other, content="hello " * 20))
+    db.execute(update(User).where(User.id == uid).values(points=User.points + 1))
+    db.commit()
+
+
+def _run(production: bool, threads: int, ops: int, write_ratio: float) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = _engine(path, production)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+    _seed(Session)
+
+    latencies = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    lock = threading.Lock()
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        for _ in range(ops):
+            kind = "write" if rng.random() < write_ratio else "read"
+            db = Session()
+            start = time.perf_counter()
+            try:
+                (_write if kind == "write" else _read)(db, rng.randint(1, USERS))
+                ok = True
+            except OperationalError:
+                db.rollback()
+                ok = False
+            finally:
+                db.close()
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies[kind].append(elapsed)
+                else:
+                    errors[kind] += 1
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    wall = time.perf_counter() - start
+    engine.dispose()
+
+    done = sum(len(v) for v in latencies.values())
+    return {"ops_per_s": done / wall, "latencies": latencies, "errors": errors}
+
+
+def _pct(values: list, p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=300, help="operations per thread")
+    parser.add_argument("--write-ratio", type=float, default=0.3)
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads x {args.ops} ops, {args.write_ratio:.0%} writes")
+    for name, production in (("default", False), ("production", True)):
+        r = _run(production, args.threads, args.ops, args.write_ratio)
+        print(f"{name:11s}: {r['ops_per_s']:8.1f} ops/s  locked errors: "
+              f"{r['errors']['write']} writes, {r['errors']['read']} reads")
+        for kind in ("read", "write"):
+            lat = r["latencies"][kind]
+            print(f"  {kind:5s} p50 {_pct(lat, 0.5):7.1f} ms  p95 {_pct(lat, 0.95):7.1f} ms  "
+                  f"p99 {_pct(lat, 0.99):7.1f} ms")
+    if sqlite_mode.stats():
+        print("writer queue:", sqlite_mode.stats())
+
+
+if __name__ == "__main__":
+    main()
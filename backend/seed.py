@@ -8,8 +8,9 @@ from app.models.models import (
     User, Module, Lesson, Test, Question, CodeTask, Badge,
 )
 from app.utils.auth import hash_password
+from app import migrations
 
-Base.metadata.create_all(bind=engine)
+migrations.migrate(engine)
 db = SessionLocal()
 
 # ── Clear existing data ────────────────────────────────
@@ -0,0 +1,18 @@
+"""Test setup: a throwaway seeded SQLite database, configured before the app is imported."""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_DATA = tempfile.mkdtemp(prefix="edu-platform-tests-")
+
+os.environ["DATABASE_URL"] = f"sqlite:///{_DATA}/test.db"
+os.environ["TESTCASE_BLOB_DIR"] = os.path.join(_DATA, "testcases")
+os.environ["SANDBOX_POOL_SIZE"] = "0"
+os.environ["SUBMISSION_WORKERS"] = "0"
+os.environ["REGRADE_WORKERS"] = "0"
+sys.path.insert(0, BACKEND)
+
+subprocess.run([sys.executable, "seed.py"], cwd=BACKEND, env=os.environ, check=True, capture_output=True)
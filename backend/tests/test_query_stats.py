@@ -0,0 +1,40 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+from app.database import SessionLocal
+from app.main import app
+from app.models.models import User
+from app.utils import query_stats
+
+
+def _lookup_each_user(n: int):
+    db = SessionLocal()
+    try:
+        for user_id in range(1, n + 1):
+            db.execute(select(User).where(User.id == user_id)).first()
+    finally:
+        db.close()
+
+
+def test_strict_mode_raises_on_repeated_statement():
+    with pytest.raises(query_stats.NPlusOneError):
+        with query_stats.track(strict=True, threshold=3):
+            _lookup_each_user(5)
+
+
+def test_repeated_statement_is_only_reported_when_not_strict():
+    with query_stats.track(strict=False, threshold=3) as stats:
+        _lookup_each_user(5)
+    assert stats.queries == 5
+    assert [n for _, n in stats.repeated()] == [5]
+
+
+def test_response_headers_count_the_route_queries():
+    with TestClient(app) as client:
+        login = client.post("/api/auth/login", json={"username": "aisha", "password": "aisha123"}).json()
+        r = client.get("/api/student/tasks", headers={"Authorization": "Bearer " + login["access_token"]})
+    assert r.status_code == 200
+    # The current user, then the task catalog in one aggregate query
+    assert r.headers["X-DB-Queries"] == "2"
+    assert float(r.headers["X-DB-Time-Ms"]) >= 0
@@ -1,10 +1,10 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import Editor from '@monaco-editor/react';
-import { api } from '../../utils/api';
+import { api, wsUrl } from '../../utils/api';
 import toast from 'react-hot-toast';
 import MarkdownRenderer from '../../components/MarkdownRenderer';
-import { FiArrowLeft, FiPlay, FiSend, FiChevronDown, FiChevronUp } from 'react-icons/fi';
+import { FiArrowLeft, FiPlay, FiSend, FiChevronDown, FiChevronUp, FiSquare } from 'react-icons/fi';
 
 export default function CodeEditorPage() {
   const { id } = useParams();
@@ -17,19 +17,26 @@ export default function CodeEditorPage() {
   const [running, setRunning] = useState(false);
   const [submitting, setSubmitting] = useState(false);
   const [expandedCase, setExpandedCase] = useState(null);
+  const [fastest, setFastest] = useState([]);
+  const runSocket = useRef(null);
   const navigate = useNavigate();
 
+  // Closing the socket also stops a run that is still going
+  useEffect(() => () => runSocket.current?.close(), []);
+
   useEffect(() => {
     api.get(`/student/tasks/${id}`).then(t => {
       setTask(t);
       setCode(t.starter_code || '');
+      if (t.mode === 'performance') loadFastest();
     }).catch(e => toast.error(e.message)).finally(() => setLoading(false));
   }, [id]);
 
-  async function runCode() {
-    setRunning(true);
-    setOutput(null);
-    setResults(null);
+  function loadFastest() {
+    api.get(`/student/tasks/${id}/fastest`).then(setFastest).catch(() => {});
+  }
+
+  async function runCodeOnce() {
     try {
       const res = await api.post('/student/code/run', { code, stdin });
       const text = res.error ? res.error : (res.output || '(нәтиже жоқ)');
@@ -41,13 +48,64 @@ export default function CodeEditorPage() {
     }
   }
 
+  function runCode() {
+    setRunning(true);
+    setOutput({ text: '', isError: false, live: true });
+    setResults(null);
+
+    // Output is streamed while the program runs; falls back to a plain POST
+    let text = '';
+    let opened = false;
+    const ws = new WebSocket(wsUrl('/student/code/run/ws'));
+    runSocket.current = ws;
+    ws.onopen = () => {
+      opened = true;
+      ws.send(JSON.stringify({ type: 'run', code, stdin }));
+    };
+    ws.onmessage = (ev) => {
+      const msg = JSON.parse(ev.data);
+      if (msg.type === 'stdout' || msg.type === 'stderr') {
+        text += msg.data;
+        setOutput({ text, isError: false, live: true });
+      } else if (msg.type === 'done') {
+        const full = (msg.output || '') + (msg.error || '');
+        setOutput({ text: full || '(нәтиже жоқ)', isError: !!msg.error && !msg.passed });
+        ws.close();
+      } else if (msg.type === 'busy') {
+        setOutput({ text: `Сервер бос емес, ${msg.retry_after} сек. кейін қайталаңыз`, isError: true });
+        ws.close();
+      }
+    };
+    ws.onerror = () => {
+      if (!opened) runCodeOnce();
+    };
+    ws.onclose = () => {
+      if (runSocket.current === ws) runSocket.current = null;
+      if (opened) setRunning(false);
+    };
+  }
+
+  function stopRun() {
+    runSocket.current?.send(JSON.stringify({ type: 'cancel' }));
+  }
+
   async function submitCode() {
     setSubmitting(true);
     setOutput(null);
     setResults(null);
     try {
-      const res = await api.post(`/student/tasks/${id}/submit`, { code });
+      // Grading runs in a background job; poll it and show cases as they finish
+      const { job_id } = await api.post(`/student/tasks/${id}/submit-async`, { code });
+      let job = await api.get(`/student/jobs/${job_id}`);
+      while (job.status === 'queued' || job.status === 'running') {
+        setResults({ results: job.results, pending: true });
+        await new Promise(r => setTimeout(r, 500));
+        job = await api.get(`/student/jobs/${job_id}`);
+      }
+      if (job.status === 'failed') throw new Error(job.error || 'Тексеру сәтсіз аяқталды');
+      const res = job.attempt;
       setResults(res);
+      if (task.mode === 'performance') loadFastest();
       const passed = res.results?.filter(r => r.passed).length ?? 0;
       const total = res.results?.length ?? res.max_score;
       if (passed === total) {
@@ -86,8 +144,23 @@ export default function CodeEditorPage() {
             <MarkdownRenderer content={task.description} />
             <p style={{ fontSize: '0.8rem', color: 'var(--text-secondary)', marginTop: 12 }}>
               {task.test_case_count} тест жағдайы
+              {task.mode === 'performance' && ` · CPU ≤ ${task.time_limit_seconds} сек · жад ≤ ${task.memory_limit_mb} МБ`}
             </p>
           </div>
+
+          {task.mode === 'performance' && fastest.length > 0 && (
+            <div className="card" style={{ marginTop: 12 }}>
+              <div className="card-header">⚡ Ең жылдам шешімдер</div>
+              {fastest.map(f => (
+                <div key={f.user_id} style={{ display: 'flex', justifyContent: 'space-between', fontSize: '0.85rem', padding: '4px 0' }}>
+                  <span>{f.rank}. {f.full_name}</span>
+                  <span style={{ color: 'var(--text-secondary)', fontFamily: 'monospace' }}>
+                    {f.cpu_time_ms} мс{f.peak_rss_kb ? ` · ${Math.round(f.peak_rss_kb / 1024)} МБ` : ''}
+                  </span>
+                </div>
+              ))}
+            </div>
+          )}
         </div>
 
         {/* Right: editor + run + results */}
@@ -97,9 +170,15 @@ export default function CodeEditorPage() {
             <div style={{ padding: '12px 16px', borderBottom: '1px solid var(--border)', display: 'flex', justifyContent: 'space-between', alignItems: 'center' }}>
               <span style={{ fontWeight: 600, fontSize: '0.9rem' }}>Код редакторы</span>
               <div style={{ display: 'flex', gap: 8 }}>
-                <button className="btn btn-secondary btn-sm" onClick={runCode} disabled={running || submitting}>
-                  <FiPlay /> {running ? 'Орындалуда...' : 'Іске қос'}
-                </button>
+                {running ? (
+                  <button className="btn btn-secondary btn-sm" onClick={stopRun}>
+                    <FiSquare /> Тоқтату
+                  </button>
+                ) : (
+                  <button className="btn btn-secondary btn-sm" onClick={runCode} disabled={submitting}>
+                    <FiPlay /> Іске қос
+                  </button>
+                )}
                 <button className="btn btn-primary btn-sm" onClick={submitCode} disabled={submitting || running}>
                   <FiSend /> {submitting ? 'Тексерілуде...' : 'Жіберу'}
                 </button>
@@ -140,7 +219,7 @@ export default function CodeEditorPage() {
                 background: output.isError ? 'var(--error-bg, #FEF2F2)' : 'var(--success-bg, #F0FDF4)',
               }}>
                 <span style={{ fontWeight: 600, fontSize: '0.85rem' }}>
-                  {output.isError ? '❌ Қате' : '✅ Нәтиже'}
+                  {output.live ? '⏳ Орындалуда...' : output.isError ? '❌ Қате' : '✅ Нәтиже'}
                 </span>
               </div>
               <pre style={{
@@ -223,6 +302,11 @@ export default function CodeEditorPage() {
                         <span style={{ fontSize: '0.82rem', fontWeight: 600, color: r.passed ? '#065F46' : '#991B1B' }}>
                           {r.passed ? 'ӨТТІ' : 'ӨТПЕДІ'}
                         </span>
+                        {r.cpu_time_ms != null && (
+                          <span style={{ fontSize: '0.72rem', color: 'var(--text-secondary)' }}>
+                            {r.cpu_time_ms} мс
+                          </span>
+                        )}
                         {r.input !== undefined && (
                           <span style={{ fontSize: '0.75rem', color: 'var(--text-secondary)', fontFamily: 'monospace' }}>
                             stdin: {String(r.input).replace(/\n/g, ' ↵ ').slice(0, 30)}{String(r.input).length > 30 ? '…' : ''}
@@ -84,8 +84,19 @@ Output: \`True\``,
 const emptyForm = {
   title: '', description: '', module_id: '', difficulty: 'medium',
   grade: 6, topic_id: '', starter_code: '',
+  mode: 'output', time_limit_seconds: '', memory_limit_mb: '',
+  input_generator: '', reference_solution: '', generated_case_count: 3,
 };
 
+// Large payloads are kept in files on the server; the row only has a preview
+function StoredPayload({ ref_, preview }) {
+  return (
+    <pre className="form-input" style={{ fontFamily: 'monospace', fontSize: '0.8rem', whiteSpace: 'pre-wrap', margin: 0, opacity: 0.8 }}>
+      📦 {(ref_.size / 1024).toFixed(1)} KB{'\n'}{preview}
+    </pre>
+  );
+}
+
 export default function CodeTasksCMS() {
   const [tasks, setTasks] = useState([]);
   const [modules, setModules] = useState([]);
@@ -141,6 +152,12 @@ export default function CodeTasksCMS() {
         grade: data.grade || 6,
         topic_id: data.topic_id || '',
         starter_code: data.starter_code || '',
+        mode: data.mode || 'output',
+        time_limit_seconds: data.time_limit_seconds ?? '',
+        memory_limit_mb: data.memory_limit_mb ?? '',
+        input_generator: data.input_generator || '',
+        reference_solution: data.reference_solution || '',
+        generated_case_count: data.generated_case_count || 3,
       });
       setTestCases(data.test_cases && data.test_cases.length > 0
         ? data.test_cases
@@ -205,7 +222,7 @@ export default function CodeTasksCMS() {
 
   async function handleSave(e) {
     e.preventDefault();
-    const validCases = testCases.filter(tc => tc.expected_output.trim());
+    const validCases = testCases.filter(tc => tc.expected_ref || tc.expected_output?.trim());
     if (validCases.length === 0) {
       toast.error('Add at least one test case with expected output');
       return;
@@ -219,11 +236,19 @@ export default function CodeTasksCMS() {
       topic_id: form.topic_id ? parseInt(form.topic_id) : null,
       starter_code: form.starter_code,
       test_cases: validCases,
+      mode: form.mode,
+      time_limit_seconds: form.time_limit_seconds ? parseFloat(form.time_limit_seconds) : null,
+      memory_limit_mb: form.memory_limit_mb ? parseInt(form.memory_limit_mb) : null,
     };
+    if (form.mode === 'performance') {
+      payload.input_generator = form.input_generator;
+      payload.reference_solution = form.reference_solution;
+      payload.generated_case_count = parseInt(form.generated_case_count) || 3;
+    }
     try {
       if (editTask) {
-        await api.put(`/teacher/code-tasks/${editTask.id}`, payload);
-        toast.success(t('saved'));
+        const result = await api.put(`/teacher/code-tasks/${editTask.id}`, payload);
+        toast.success(t(result.regrade_job_id ? 'regradeStarted' : 'saved'));
       } else {
         await api.post('/teacher/code-tasks', payload);
         toast.success(t('created'));
@@ -442,6 +467,39 @@ export default function CodeTasksCMS() {
                 <label>{t('starterCode')}</label>
                 <textarea className="form-input" value={form.starter_code} onChange={e => setForm(f => ({ ...f, starter_code: e.target.value }))} rows={3} style={{ fontFamily: 'monospace', fontSize: '0.85rem' }} />
               </div>
+              <div style={{ display: 'grid', gridTemplateColumns: '1fr 1fr 1fr', gap: 12 }}>
+                <div className="form-group">
+                  <label>{t('taskMode')}</label>
+                  <select className="form-input" value={form.mode} onChange={e => setForm(f => ({ ...f, mode: e.target.value }))}>
+                    <option value="output">{t('modeOutput')}</option>
+                    <option value="performance">{t('modePerformance')}</option>
+                  </select>
+                </div>
+                <div className="form-group">
+                  <label>{t('timeLimit')}</label>
+                  <input className="form-input" type="number" step="0.1" min="0.1" value={form.time_limit_seconds} onChange={e => setForm(f => ({ ...f, time_limit_seconds: e.target.value }))} placeholder="5" />
+                </div>
+                <div className="form-group">
+                  <label>{t('memoryLimit')}</label>
+                  <input className="form-input" type="number" min="16" value={form.memory_limit_mb} onChange={e => setForm(f => ({ ...f, memory_limit_mb: e.target.value }))} placeholder="256" />
+                </div>
+              </div>
+              {form.mode === 'performance' && (
+                <>
+                  <div className="form-group">
+                    <label>{t('inputGenerator')}</label>
+                    <textarea className="form-input" value={form.input_generator} onChange={e => setForm(f => ({ ...f, input_generator: e.target.value }))} rows={4} required style={{ fontFamily: 'monospace', fontSize: '0.85rem' }} placeholder={'n = int(input())\nprint(10000 * n)'} />
+                  </div>
+                  <div className="form-group">
+                    <label>{t('referenceSolution')}</label>
+                    <textarea className="form-input" value={form.reference_solution} onChange={e => setForm(f => ({ ...f, reference_solution: e.target.value }))} rows={4} required style={{ fontFamily: 'monospace', fontSize: '0.85rem' }} />
+                  </div>
+                  <div className="form-group">
+                    <label>{t('generatedCaseCount')}</label>
+                    <input className="form-input" type="number" min="1" max="10" value={form.generated_case_count} onChange={e => setForm(f => ({ ...f, generated_case_count: e.target.value }))} />
+                  </div>
+                </>
+              )}
 
               {/* Test cases */}
               <div style={{ marginBottom: 16 }}>
@@ -457,25 +515,33 @@ export default function CodeTasksCMS() {
                     }}>
                       <div>
                         <span style={{ fontSize: '0.7rem', color: 'var(--text-secondary)', textTransform: 'uppercase' }}>{t('input')}</span>
-                        <textarea
-                          className="form-input"
-                          value={tc.input}
-                          onChange={e => updateTestCase(i, 'input', e.target.value)}
-                          rows={2}
-                          style={{ fontFamily: 'monospace', fontSize: '0.8rem' }}
-                          placeholder="stdin input"
-                        />
+                        {tc.input_ref ? (
+                          <StoredPayload ref_={tc.input_ref} preview={tc.input_preview} />
+                        ) : (
+                          <textarea
+                            className="form-input"
+                            value={tc.input}
+                            onChange={e => updateTestCase(i, 'input', e.target.value)}
+                            rows={2}
+                            style={{ fontFamily: 'monospace', fontSize: '0.8rem' }}
+                            placeholder="stdin input"
+                          />
+                        )}
                       </div>
                       <div>
                         <span style={{ fontSize: '0.7rem', color: 'var(--text-secondary)', textTransform: 'uppercase' }}>{t('expected')}</span>
-                        <textarea
-                          className="form-input"
-                          value={tc.expected_output}
-                          onChange={e => updateTestCase(i, 'expected_output', e.target.value)}
-                          rows={2}
-                          style={{ fontFamily: 'monospace', fontSize: '0.8rem' }}
-                          placeholder="expected stdout"
-                        />
+                        {tc.expected_ref ? (
+                          <StoredPayload ref_={tc.expected_ref} preview={tc.expected_preview} />
+                        ) : (
+                          <textarea
+                            className="form-input"
+                            value={tc.expected_output}
+                            onChange={e => updateTestCase(i, 'expected_output', e.target.value)}
+                            rows={2}
+                            style={{ fontFamily: 'monospace', fontSize: '0.8rem' }}
+                            placeholder="expected stdout"
+                          />
+                        )}
                       </div>
                       <button
                         type="button"
@@ -1,8 +1,11 @@
 import { useState, useEffect, useRef } from 'react';
 import { api, getAuth, STATIC_BASE } from '../../utils/api';
 import { useT } from '../../utils/i18n';
+import { useMessengerSocket } from '../../utils/messengerSocket';
 import toast from 'react-hot-toast';
-import { FiSend, FiUsers, FiUser, FiMessageCircle, FiPaperclip, FiMic, FiSquare, FiFile, FiDownload } from 'react-icons/fi';
+import { FiCheck, FiSend, FiUsers, FiUser, FiMessageCircle, FiPaperclip, FiMic, FiSquare, FiFile, FiDownload } from 'react-icons/fi';
+
+const PAGE_SIZE = 50;  // messages per history page (the server's default)
 
 function isImageUrl(url) {
   return /\.(jpg|jpeg|png|gif|webp)$/i.test(url || '');
@@ -69,37 +72,130 @@ export default function Messenger() {
   const [filterGrade, setFilterGrade] = useState('');
   const [recording, setRecording] = useState(false);
   const [recordingTime, setRecordingTime] = useState(0);
+  const [typing, setTyping] = useState(null);  // name of whoever is typing in the open chat
+  const [hasOlder, setHasOlder] = useState(false);  // last page loaded was full, so earlier messages may exist
   const messagesEnd = useRef(null);
   const inputRef = useRef(null);
   const fileInputRef = useRef(null);
-  const pollRef = useRef(null);
+  const typingTimerRef = useRef(null);
+  const typingSentRef = useRef(0);
+  const lastIdRef = useRef(null);
   const mediaRecorderRef = useRef(null);
   const chunksRef = useRef([]);
   const timerRef = useRef(null);
   const t = useT();
   const uploadPath = '/teacher/messages/upload';
+  const { userId } = getAuth();
+  const socket = useMessengerSocket('/teacher/messages/ws', onSocketEvent);
 
   useEffect(() => {
     loadContacts();
     loadGrades();
   }, []);
 
+  // Scroll down for new messages, not when older ones are prepended
   useEffect(() => {
-    messagesEnd.current?.scrollIntoView({ behavior: 'smooth' });
+    const lastId = messages.length ? messages[messages.length - 1].id : null;
+    if (lastId !== lastIdRef.current) messagesEnd.current?.scrollIntoView({ behavior: 'smooth' });
+    lastIdRef.current = lastId;
   }, [messages]);
 
+  // New messages arrive over the socket; history is loaded once per conversation
   useEffect(() => {
-    if (pollRef.current) clearInterval(pollRef.current);
-    if (tab === 'group' && selectedGrade) {
-      loadGroupMessages(selectedGrade);
-      pollRef.current = setInterval(() => loadGroupMessages(selectedGrade), 5000);
-    } else if (tab === 'direct' && selectedContact) {
-      loadDirectMessages(selectedContact.id);
-      pollRef.current = setInterval(() => loadDirectMessages(selectedContact.id), 5000);
-    }
-    return () => { if (pollRef.current) clearInterval(pollRef.current); };
+    setTyping(null);
+    subscribeGrade();
+    loadOpenChat();
   }, [tab, selectedContact, selectedGrade]);
 
+  function loadOpenChat() {
+    if (tab === 'group' && selectedGrade) loadGroupMessages(selectedGrade);
+    else if (tab === 'direct' && selectedContact) loadDirectMessages(selectedContact.id);
+  }
+
+  // The socket carries one grade chat at a time: the open one
+  function subscribeGrade() {
+    socket.send({ type: 'subscribe', grade: tab === 'group' && selectedGrade ? selectedGrade : '' });
+  }
+
+  function chatPath() {
+    if (tab === 'group' && selectedGrade) return `/teacher/messages/group/${encodeURIComponent(selectedGrade)}`;
+    if (tab === 'direct' && selectedContact) return `/teacher/messages/direct/${selectedContact.id}`;
+    return null;
+  }
+
+  async function loadOlder() {
+    const path = chatPath();
+    if (!path || !messages.length) return;
+    try {
+      const data = await api.get(`${path}?before_id=${messages[0].id}`);
+      setHasOlder(data.length >= PAGE_SIZE);
+      setMessages(ms => [...data, ...ms]);
+    } catch (e) { toast.error(e.message); }
+  }
+
+  // After a reconnect: fetch only what arrived while the socket was down
+  async function catchUp() {
+    const path = chatPath();
+    const last = messages[messages.length - 1];
+    if (!path || !last) { loadOpenChat(); return; }
+    try {
+      const data = await api.get(`${path}?since_id=${last.id}`);
+      if (data.length >= PAGE_SIZE) loadOpenChat();  // too far behind: start from the newest page
+      else data.forEach(addMessage);
+    } catch (e) { /* silent */ }
+  }
+
+  function addMessage(m) {
+    setMessages(ms => ms.some(x => x.id === m.id) ? ms : [...ms, m]);
+  }
+
+  function onSocketEvent(ev) {
+    const me = Number(userId);
+    if (ev.type === 'open') {
+      subscribeGrade();
+      if (ev.reconnected) { loadContacts(); catchUp(); }
+    } else if (ev.type === 'direct') {
+      const m = ev.message;
+      const incoming = m.sender_id !== me;
+      const otherId = incoming ? m.sender_id : m.receiver_id;
+      const isOpen = tab === 'direct' && selectedContact?.id === otherId;
+      if (isOpen) {
+        addMessage({ ...m, is_mine: !incoming });
+        if (incoming) socket.send({ type: 'read', with: otherId });
+      }
+      setContacts(cs => cs.map(c => c.id !== otherId ? c : {
+        ...c,
+        last_message: (m.content || '').slice(0, 50) || m.message_type,
+        last_time: m.created_at,
+        unread: incoming && !isOpen ? (c.unread || 0) + 1 : c.unread,
+      }));
+    } else if (ev.type === 'group') {
+      if (tab === 'group' && ev.grade === selectedGrade) addMessage({ ...ev.message, is_mine: ev.message.sender_id === me });
+    } else if (ev.type === 'read') {
+      if (ev.reader_id === me) setContacts(cs => cs.map(c => c.id === ev.other_id ? { ...c, unread: 0 } : c));
+      else if (tab === 'direct' && selectedContact?.id === ev.reader_id) {
+        setMessages(ms => ms.map(m => m.is_mine && m.id <= ev.read_upto ? { ...m, is_read: true } : m));
+      }
+    } else if (ev.type === 'typing') {
+      const here = ev.grade
+        ? tab === 'group' && ev.grade === selectedGrade
+        : tab === 'direct' && selectedContact?.id === ev.from_id;
+      if (here) {
+        setTyping(ev.from_name);
+        clearTimeout(typingTimerRef.current);
+        typingTimerRef.current = setTimeout(() => setTyping(null), 3000);
+      }
+    }
+  }
+
+  function notifyTyping() {
+    const now = Date.now();
+    if (now - typingSentRef.current < 2000) return;
+    typingSentRef.current = now;
+    if (tab === 'group' && selectedGrade) socket.send({ type: 'typing', grade: selectedGrade });
+    else if (tab === 'direct' && selectedContact) socket.send({ type: 'typing', to: selectedContact.id });
+  }
+
   async function loadContacts() {
     try {
       const data = await api.get('/teacher/messages/contacts');
@@ -118,6 +214,7 @@ export default function Messenger() {
     try {
       const data = await api.get(`/teacher/messages/direct/${userId}`);
       setMessages(data);
+      setHasOlder(data.length >= PAGE_SIZE);
     } catch (e) { /* silent */ }
   }
 
@@ -125,6 +222,7 @@ export default function Messenger() {
     try {
       const data = await api.get(`/teacher/messages/group/${encodeURIComponent(grade)}`);
       setMessages(data);
+      setHasOlder(data.length >= PAGE_SIZE);
     } catch (e) { /* silent */ }
   }
 
@@ -132,10 +230,10 @@ export default function Messenger() {
     const body = { content, message_type: messageType, file_url: fileUrl };
     if (tab === 'group' && selectedGrade) {
       await api.post(`/teacher/messages/group/${encodeURIComponent(selectedGrade)}`, body);
-      loadGroupMessages(selectedGrade);
+      if (!socket.isOpen()) loadGroupMessages(selectedGrade);
     } else if (tab === 'direct' && selectedContact) {
       await api.post(`/teacher/messages/direct/${selectedContact.id}`, body);
-      loadDirectMessages(selectedContact.id);
+      if (!socket.isOpen()) loadDirectMessages(selectedContact.id);
     }
   }
 
@@ -354,6 +452,13 @@ export default function Messenger() {
                 <p>{t('noMessages')}</p>
               </div>
             )}
+            {hasOlder && (
+              <div style={{ textAlign: 'center', marginBottom: 8 }}>
+                <button className="btn btn-secondary" onClick={loadOlder} style={{ fontSize: '0.8rem', padding: '4px 12px' }}>
+                  {t('loadEarlier')}
+                </button>
+              </div>
+            )}
             {messages.map(m => (
               <div key={m.id} style={{
                 display: 'flex', justifyContent: m.is_mine ? 'flex-end' : 'flex-start',
@@ -372,10 +477,16 @@ export default function Messenger() {
                   <MessageContent m={m} t={t} />
                   <div style={{ fontSize: '0.65rem', opacity: 0.6, marginTop: 4, textAlign: 'right' }}>
                     {m.created_at ? new Date(m.created_at).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' }) : ''}
+                    {tab === 'direct' && m.is_mine && m.is_read && <FiCheck size={10} style={{ marginLeft: 4 }} />}
                   </div>
                 </div>
               </div>
             ))}
+            {typing && (
+              <div style={{ fontSize: '0.75rem', color: 'var(--text-secondary)', fontStyle: 'italic' }}>
+                {typing} {t('typing')}
+              </div>
+            )}
             <div ref={messagesEnd} />
           </div>
 
@@ -427,7 +538,7 @@ export default function Messenger() {
                     ref={inputRef}
                     className="form-input"
                     value={input}
-                    onChange={e => setInput(e.target.value)}
+                    onChange={e => { setInput(e.target.value); notifyTyping(); }}
                     placeholder={t('typeYourMessage')}
                     disabled={sending}
                     style={{ flex: 1 }}
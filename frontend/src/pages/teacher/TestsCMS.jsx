@@ -144,7 +144,9 @@ export default function TestsCMS() {
     try {
       if (editTest) {
         const result = await api.put(`/teacher/tests/${editTest.id}`, payload);
-        if (result.attempts_preserved) {
+        if (result.regrade_job_id) {
+          toast.success(`Test updated. Regrading ${result.attempt_count} attempts`);
+        } else if (result.attempts_preserved && result.attempt_count) {
           toast.success(`Test updated. Questions kept (${result.attempt_count} attempts exist)`);
         } else {
           toast.success('Test updated');
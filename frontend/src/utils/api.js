@@ -6,6 +6,12 @@ const API_URL = _apiUrl || _sameOrigin || 'http://localhost:8000';
 const BASE = `${API_URL}/api`;
 export const STATIC_BASE = API_URL;
 
+// WebSocket endpoints live under the same /api prefix; the JWT goes in the query string
+export function wsUrl(path) {
+  const base = API_URL.replace(/^http/, 'ws');
+  return `${base}/api${path}${path.includes('?') ? '&' : '?'}token=${encodeURIComponent(getToken() || '')}`;
+}
+
 function getToken() {
   return localStorage.getItem('token');
 }
@@ -143,6 +143,8 @@ const translations = {
   attachFile: 'Файл тіркеу',
   voiceMessage: 'Дауыстық хабарлама',
   recording: 'Жазылуда...',
+  typing: 'жазып жатыр...',
+  loadEarlier: 'Бұрынғы хабарламалар',
   fileTooBig: 'Файл тым үлкен (макс. 10МБ)',
   microphoneError: 'Микрофонға қол жетімді емес',
 
@@ -210,6 +212,15 @@ const translations = {
   starterCode: 'Бастапқы код',
   testCasesJson: 'Тест-кейстер (JSON массив)',
   testCaseFormat: 'Формат: [{"input": "...", "expected_output": "..."}, ...]',
+  taskMode: 'Тексеру түрі',
+  modeOutput: 'Тек нәтиже',
+  modePerformance: 'Нәтиже + жылдамдық',
+  timeLimit: 'Уақыт шегі (сек, CPU)',
+  memoryLimit: 'Жад шегі (МБ)',
+  inputGenerator: 'Кіріс генераторы (stdin-ге кейс нөмірі келеді)',
+  referenceSolution: 'Эталон шешім',
+  generatedCaseCount: 'Генерацияланатын кейстер саны',
+  regradeStarted: 'Сақталды. Бұрынғы жауаптар қайта тексерілуде',
 
   // Templates
   useTemplate: 'Шаблон',
@@ -0,0 +1,61 @@
+import { useEffect, useRef } from 'react';
+import { wsUrl } from './api';
+
+// Live messenger events (backend: app/utils/messenger_hub.py). Answers pings and
+// reconnects with backoff; onEvent also gets {type: 'open', reconnected} whenever
+// a socket opens, so the page can reload what it missed while disconnected.
+export function useMessengerSocket(path, onEvent) {
+  const handler = useRef(onEvent);
+  handler.current = onEvent;
+  const socket = useRef(null);
+
+  useEffect(() => {
+    let stopped = false;
+    let opened = false;
+    let retries = 0;
+    let timer = null;
+
+    function connect() {
+      const ws = new WebSocket(wsUrl(path));
+      socket.current = ws;
+      ws.onopen = () => {
+        retries = 0;
+        handler.current({ type: 'open', reconnected: opened });
+        opened = true;
+      };
+      ws.onmessage = (ev) => {
+        let msg;
+        try { msg = JSON.parse(ev.data); } catch (e) { return; }
+        if (msg.type === 'ping') {
+          ws.send(JSON.stringify({ type: 'pong' }));
+          return;
+        }
+        handler.current(msg);
+      };
+      ws.onclose = (ev) => {
+        if (socket.current === ws) socket.current = null;
+        // 4401: bad or expired token, retrying won't help
+        if (stopped || ev.code === 4401) return;
+        timer = setTimeout(connect, Math.min(30000, 1000 * 2 ** retries++));
+      };
+    }
+
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(timer);
+      socket.current?.close();
+    };
+  }, [path]);
+
+  return {
+    // false when there is no open socket (the message is dropped)
+    send(msg) {
+      const ws = socket.current;
+      if (!ws || ws.readyState !== WebSocket.OPEN) return false;
+      ws.send(JSON.stringify(msg));
+      return true;
+    },
+    isOpen: () => socket.current?.readyState === WebSocket.OPEN,
+  };
+}